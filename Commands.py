@@ -0,0 +1,351 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import click
+import numpy as np
+from sqlalchemy import LargeBinary, bindparam, func, inspect, or_, select, text, type_coerce
+from Models import FaceVector, Student, FACE_PENDING, FACE_READY, indexed_embeddings
+from FaceAudit import AUDIT_BLOCK, duplicate_pairs, vector_checksums, load_audit_state, save_audit_state
+from FaceIndex import face_index
+from GalleryStore import gallery_store
+from Gallery import GALLERY_PRECISIONS, compare_precision
+from Helpers import image_to_encoding, encoder_version
+from FaceBackends import get_backend
+from Recognition import _init_worker
+
+# Embeddings written before encoder versions were tracked all came from face_recognition/dlib.
+LEGACY_ENCODER_VERSION = 1
+
+# columns added to tables that existing databases already have; migrate-face-vectors adds them
+ADDED_COLUMNS = {
+    'students': (('face_encoder_version', 'INTEGER'), ('face_status', 'VARCHAR(20)')),
+    'classes': (('speed_profile', 'VARCHAR(20)'),),
+}
+
+
+def _encode_path(path):
+    # runs in the re-encode pool: a bad image shouldn't take the whole batch down
+    try:
+        return image_to_encoding(path)
+    except Exception:
+        return None
+
+
+def _load_checkpoint(path, version, force):
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    # progress from a run with another encoder (or mode) doesn't apply
+    if state.get('encoder_version') != version or state.get('force') != force:
+        return 0
+    return int(state.get('last_id', 0))
+
+
+def _save_checkpoint(path, version, force, last_id):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'encoder_version': version, 'force': force, 'last_id': last_id}, f)
+    os.replace(tmp, path)
+
+
+def register_commands(app, session_factory):
+    """Attach maintenance commands to `flask --app app <command>`."""
+
+    @app.cli.command('migrate-face-vectors')
+    @click.option('--batch-size', default=500, show_default=True, help='Rows rewritten per commit.')
+    def migrate_face_vectors(batch_size):
+        """
+        Add the columns newer code expects to existing tables (create_all only creates
+        missing tables), then rewrite pickled Student.face_vector rows as compact float32 bytes.
+        """
+        session = session_factory()
+        try:
+            engine = session.get_bind()
+            inspector = inspect(engine)
+            columns = {table: {c['name'] for c in inspector.get_columns(table)} for table in ADDED_COLUMNS}
+            for table, added in ADDED_COLUMNS.items():
+                for name, ddl in added:
+                    if name not in columns[table]:
+                        with engine.begin() as conn:
+                            conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {ddl}'))
+                        click.echo(f'Added {table}.{name}')
+
+            students = Student.__table__
+            raw = type_coerce(students.c.face_vector, LargeBinary)
+            stmt = (students.update()
+                    .where(students.c.id == bindparam('b_id'))
+                    .values(face_vector=bindparam('b_vector'),
+                            face_encoder_version=func.coalesce(students.c.face_encoder_version, LEGACY_ENCODER_VERSION)))
+
+            last_id, seen, converted = 0, 0, 0
+            while True:
+                rows = session.execute(
+                    select(students.c.id, raw)
+                    .where(students.c.id > last_id, students.c.face_vector.isnot(None))
+                    .order_by(students.c.id)
+                    .limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                seen += len(rows)
+
+                params = [{'b_id': sid, 'b_vector': FaceVector.decode(value)}
+                          for sid, value in rows if FaceVector.is_legacy(value)]
+                if params:
+                    session.execute(stmt, params)
+                    session.commit()
+                    converted += len(params)
+                click.echo(f'{seen} rows scanned, {converted} converted')
+
+            click.echo(f'Done: {converted} of {seen} face vectors rewritten as float32')
+        finally:
+            session.close()
+
+    @app.cli.command('enroll-pending')
+    def enroll_pending():
+        """Encode students still marked pending (e.g. jobs lost when the server restarted)."""
+        from Enrollment import enrollment_queue
+
+        session = session_factory()
+        try:
+            rows = (session.query(Student.id, Student.image)
+                    .filter(Student.face_status == FACE_PENDING)
+                    .order_by(Student.id)
+                    .all())
+        finally:
+            session.close()
+
+        # run each job in this process, one at a time
+        threads = enrollment_queue.threads
+        enrollment_queue.configure(session_factory=session_factory, threads=0)
+        try:
+            for student_id, image in rows:
+                enrollment_queue.enqueue(student_id, image)
+        finally:
+            enrollment_queue.configure(threads=threads)
+        stats = enrollment_queue.stats()
+        click.echo(f'{len(rows)} pending students processed: {stats["completed"]} ready, {stats["failed"]} failed')
+
+    @app.cli.command('reencode-faces')
+    @click.option('--batch-size', default=256, show_default=True, help='Students encoded per batch; each batch is one commit.')
+    @click.option('--workers', default=os.cpu_count() or 1, show_default=True, help='Encoding processes (0 = inline).')
+    @click.option('--force', is_flag=True, help='Re-encode every student, not just rows from another encoder version.')
+    @click.option('--checkpoint', default='.reencode-checkpoint.json', show_default=True, help='Progress file used to resume.')
+    @click.option('--restart', is_flag=True, help='Ignore the checkpoint and start from the first student.')
+    def reencode_faces(batch_size, workers, force, checkpoint, restart):
+        """Recompute face_vector for students whose embedding is stale (e.g. after switching FACE_BACKEND)."""
+        version = encoder_version()
+        last_id = 0 if restart else _load_checkpoint(checkpoint, version, force)
+        if last_id:
+            click.echo(f'Resuming after student {last_id}')
+
+        students = Student.__table__
+        stale = Student.image.isnot(None)
+        if not force:
+            stale = stale & or_(Student.face_encoder_version.is_(None), Student.face_encoder_version != version)
+        stmt = (students.update()
+                .where(students.c.id == bindparam('b_id'))
+                .values(face_vector=bindparam('b_vector'),
+                        face_encoder_version=bindparam('b_version'),
+                        face_status=FACE_READY))
+
+        executor = None
+        if workers > 0:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                           initargs=(get_backend().name,))
+        session = session_factory()
+        started = time.perf_counter()
+        seen, encoded = 0, 0
+        try:
+            while True:
+                rows = session.execute(
+                    select(Student.id, Student.image)
+                    .where(Student.id > last_id, stale)
+                    .order_by(Student.id)
+                    .limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+
+                paths = [image for _, image in rows]
+                if executor is None:
+                    results = [_encode_path(p) for p in paths]
+                else:
+                    results = list(executor.map(_encode_path, paths,
+                                                chunksize=max(1, len(paths) // (workers * 4))))
+
+                params = [{'b_id': sid, 'b_vector': enc, 'b_version': version}
+                          for (sid, _), enc in zip(rows, results) if enc is not None]
+                if params:
+                    session.execute(stmt, params)
+                session.commit()
+
+                last_id = rows[-1][0]
+                _save_checkpoint(checkpoint, version, force, last_id)
+                seen += len(rows)
+                encoded += len(params)
+                click.echo(f'{seen} students processed, {encoded} re-encoded, {seen - encoded} without a usable face')
+        finally:
+            session.close()
+            if executor is not None:
+                executor.shutdown()
+
+        # finished: a later run starts from the beginning again
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        elapsed = time.perf_counter() - started
+        rate = seen / elapsed if elapsed > 0 else 0.0
+        click.echo(f'Done: {encoded} of {seen} students re-encoded with encoder version {version} '
+                   f'in {elapsed:.1f}s ({rate:.1f} images/s)')
+        if encoded:
+            # rows were rewritten without the ORM, so none of the commit hooks that keep
+            # galleries current ran; with a gallery store every worker notices the cleared
+            # files on its next frame, otherwise their in-memory galleries stay stale
+            gallery_store.clear()
+            if not gallery_store.enabled:
+                click.echo('Restart the web workers: their cached class galleries still hold the old '
+                           'embeddings (set GALLERY_STORE_DIR to have them reload on their own)')
+            click.echo('Run `flask rebuild-face-index` to retrain the school-wide face index')
+
+    @app.cli.command('rebuild-face-index')
+    @click.option('--lists', default=None, type=int, help='k-means buckets (default FACE_INDEX_LISTS, 0 = ~sqrt(N)).')
+    @click.option('--seed', default=0, show_default=True, help='k-means initialisation seed.')
+    def rebuild_face_index(lists, seed):
+        """Retrain the school-wide face index from every enrolled embedding and save it to FACE_INDEX_PATH."""
+        session = session_factory()
+        try:
+            rows = indexed_embeddings(session)
+        finally:
+            session.close()
+
+        started = time.perf_counter()
+        if lists is not None:
+            face_index.configure(nlist=lists)
+        face_index.build([sid for sid, _ in rows], [vec for _, vec in rows], encoder_version(), seed)
+        elapsed = time.perf_counter() - started
+
+        stats = face_index.stats()
+        click.echo(f'Indexed {stats["students"]} students in {stats["lists"]} lists '
+                   f'(largest {stats["largest_list"]}) in {elapsed:.1f}s')
+        path = app.config.get('FACE_INDEX_PATH')
+        if path:
+            face_index.save(path)
+            click.echo(f'Saved to {path}')
+
+    @app.cli.command('gallery-recall')
+    @click.option('--probes', default=500, show_default=True, help='Enrolled students sampled as probes.')
+    @click.option('--noise', default=0.03, show_default=True, help='Per-dimension noise on each probe, standing in for a new capture of the same face.')
+    @click.option('--rerank', default=None, type=int, help='Candidates re-scored at full precision (default GALLERY_RERANK).')
+    @click.option('--seed', default=0, show_default=True)
+    def gallery_recall(probes, noise, rerank, seed):
+        """Measure recall loss of float16/int8 galleries against full-precision face_distance on the enrolled embeddings."""
+        session = session_factory()
+        try:
+            rows = indexed_embeddings(session)
+        finally:
+            session.close()
+        if not rows:
+            click.echo('No enrolled embeddings to measure')
+            return
+
+        vectors = np.vstack([vec for _, vec in rows]).astype(np.float64)
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(len(vectors), size=min(probes, len(vectors)), replace=False)
+        queries = vectors[sample] + rng.normal(scale=noise, size=(len(sample), vectors.shape[1]))
+        rerank = app.config.get('GALLERY_RERANK', 8) if rerank is None else rerank
+
+        click.echo(f'{len(vectors)} embeddings, {len(sample)} probes, noise {noise}, re-rank {rerank}')
+        click.echo(f'{"precision":<10}{"recall@1":>10}{"scan only":>11}{"decisions":>11}{"max err":>10}{"bytes":>7}{"ms/probe":>10}')
+        for precision in GALLERY_PRECISIONS:
+            r = compare_precision(vectors, queries, precision, rerank)
+            click.echo(f'{precision:<10}{r["recall_at_1"]:>10.4f}{r["scan_recall_at_1"]:>11.4f}'
+                       f'{r["decision_agreement"]:>11.4f}{r["max_distance_error"]:>10.2e}'
+                       f'{r["bytes_per_embedding"]:>7.0f}{r["ms_per_probe"]:>10.3f}')
+
+    @app.cli.command('audit-duplicate-faces')
+    @click.option('--threshold', default=0.45, show_default=True, help='Report pairs of enrolled faces closer than this.')
+    @click.option('--output', default='duplicate-faces.json', show_default=True, help='JSON report of suspicious pairs.')
+    @click.option('--incremental', is_flag=True, help='Only check students enrolled or re-enrolled since the last audit (against everyone).')
+    @click.option('--block', default=AUDIT_BLOCK, show_default=True, help='Rows per side of each distance block.')
+    def audit_duplicate_faces(threshold, output, incremental, block):
+        """Find the same face enrolled under two accounts: every pair of embeddings closer than --threshold."""
+        version = encoder_version()
+        session = session_factory()
+        try:
+            rows = session.execute(
+                select(Student.id, Student.face_vector)
+                .where(Student.face_vector.isnot(None), Student.face_encoder_version == version,
+                       or_(Student.face_status.is_(None), Student.face_status != FACE_PENDING))
+                .order_by(Student.id)
+            ).all()
+        finally:
+            session.close()
+
+        ids = np.array([sid for sid, _ in rows], dtype=np.int64)
+        vectors = np.vstack([vec for _, vec in rows]) if rows else np.empty((0, 128))
+        checksums = vector_checksums(vectors)
+        state_path = output + '.state.npz'
+
+        queries, kept = None, []
+        if incremental:
+            previous = load_audit_state(state_path, version)
+            report = None
+            if previous is not None:
+                try:
+                    with open(output) as f:
+                        report = json.load(f)
+                except (OSError, ValueError):
+                    report = None
+            if report is not None and report.get('threshold') == threshold:
+                known = dict(zip(previous[0].tolist(), previous[1].tolist()))
+                unchanged = np.array([known.get(sid) == c for sid, c in zip(ids.tolist(), checksums.tolist())], dtype=bool)
+                queries = np.flatnonzero(~unchanged)
+                same = set(ids[unchanged].tolist())
+                # pairs between students nobody touched since still stand
+                kept = [(p['student_a']['id'], p['student_b']['id'], p['distance']) for p in report['pairs']
+                        if p['student_a']['id'] in same and p['student_b']['id'] in same]
+            else:
+                click.echo('No previous audit with this threshold and encoder version: checking everyone')
+
+        checked = len(ids) if queries is None else len(queries)
+        started = time.perf_counter()
+        i, j, dist = duplicate_pairs(vectors, threshold, block=block, queries=queries)
+        elapsed = time.perf_counter() - started
+        pairs = sorted(kept + [(int(ids[a]), int(ids[b]), round(float(d), 4)) for a, b, d in zip(i, j, dist)],
+                       key=lambda p: p[2])
+
+        involved = sorted({sid for a, b, _ in pairs for sid in (a, b)})
+        people = {}
+        if involved:
+            session = session_factory()
+            try:
+                people = {sid: {'id': sid, 'name': name, 'email': email} for sid, name, email in session.execute(
+                    select(Student.id, Student.name, Student.email).where(Student.id.in_(involved))).all()}
+            finally:
+                session.close()
+
+        report = {
+            'generated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'encoder_version': version,
+            'threshold': threshold,
+            'students': len(ids),
+            'checked': checked,
+            'incremental': queries is not None,
+            'pairs': [{'student_a': people[a], 'student_b': people[b], 'distance': d} for a, b, d in pairs],
+        }
+        tmp = output + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp, output)
+        save_audit_state(state_path, ids, checksums, version)
+
+        click.echo(f'Checked {checked} of {len(ids)} students in {elapsed:.1f}s: '
+                   f'{len(pairs)} pairs closer than {threshold} written to {output}')
+        for a, b, d in pairs[:10]:
+            click.echo(f'  {d:.4f}  {people[a]["email"]}  {people[b]["email"]}')
@@ -0,0 +1,122 @@
+import logging
+import queue
+import threading
+import time
+from Helpers import image_to_encoding, encoder_version
+from Recognition import recognition_pool, RecognitionBusy
+from Models import Student, FACE_READY, FACE_FAILED
+
+log = logging.getLogger(__name__)
+
+
+class EnrollmentQueue:
+    """
+    Background face enrollment. Registration and photo updates commit the student
+    with face_status 'pending' and enqueue(student_id, image); worker threads run the
+    encoding on the recognition pool and write the embedding back in their own session.
+
+    threads=0 encodes inline inside enqueue() (tests, dev without a pool). A photo the
+    pool is still too busy for (or times out on) after `max_attempts` tries is marked failed.
+    """
+
+    def __init__(self, session_factory=None, threads=1, retry_delay=0.5, max_attempts=10):
+        self.session_factory = session_factory
+        self.threads = threads
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self._jobs = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+
+    def configure(self, session_factory=None, threads=None, max_attempts=None):
+        if session_factory is not None:
+            self.session_factory = session_factory
+        if threads is not None:
+            self.threads = threads
+        if max_attempts is not None:
+            self.max_attempts = max_attempts
+
+    def enqueue(self, student_id, image):
+        """Queue (re-)encoding of student_id's photo. Call after the pending row is committed."""
+        if self.threads == 0:
+            self._process(student_id, image)
+            return
+        self._start_workers()
+        self._jobs.put((student_id, image))
+
+    @property
+    def pending(self):
+        return self._jobs.qsize()
+
+    def stats(self):
+        return {"queued": self.pending, "completed": self.completed, "failed": self.failed}
+
+    def _start_workers(self):
+        with self._lock:
+            self._workers = [t for t in self._workers if t.is_alive()]
+            while len(self._workers) < self.threads:
+                t = threading.Thread(target=self._run, name=f"enrollment-{len(self._workers)}", daemon=True)
+                t.start()
+                self._workers.append(t)
+
+    def _run(self):
+        while True:
+            student_id, image = self._jobs.get()
+            try:
+                self._process(student_id, image)
+            except Exception:
+                log.exception("Enrollment of student %s failed", student_id)
+            finally:
+                self._jobs.task_done()
+
+    def _encode(self, image):
+        # enrollment waits its turn rather than failing when kiosks have the pool busy, but
+        # RecognitionBusy is also how a timeout surfaces, so a photo that never finishes
+        # gives up (and is marked failed) instead of holding this thread forever
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return recognition_pool.run(image_to_encoding, image)
+            except RecognitionBusy as e:
+                if attempt == self.max_attempts:
+                    raise
+                time.sleep(max(e.retry_after, self.retry_delay))
+
+    def _process(self, student_id, image):
+        try:
+            encoding = self._encode(image)
+        except Exception:
+            log.exception("Encoding %s for student %s failed", image, student_id)
+            encoding = None
+
+        session = self.session_factory()
+        try:
+            student = session.get(Student, student_id)
+            # deleted, or a newer photo was uploaded (its own job will handle it)
+            if student is None or student.image != image:
+                return
+            if encoding is not None:
+                student.face_vector = encoding
+                student.face_encoder_version = encoder_version()
+                student.face_status = FACE_READY
+            else:
+                student.face_status = FACE_FAILED
+            session.commit()
+            with self._lock:
+                if encoding is not None:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def join(self):
+        """Block until every queued job has been processed."""
+        self._jobs.join()
+
+
+enrollment_queue = EnrollmentQueue()
@@ -0,0 +1,77 @@
+import os
+import zlib
+import numpy as np
+from Gallery import GALLERY_DTYPE
+
+# rows per side of each distance block: 1024 x 1024 float32 is 4 MB
+AUDIT_BLOCK = 1024
+
+
+def duplicate_pairs(vectors, threshold, block=AUDIT_BLOCK, queries=None):
+    """
+    Every pair of rows of `vectors` closer than `threshold`, as (i, j, distance) arrays
+    with i < j, closest first. Distances are computed block x block, so memory stays at
+    one block however many rows there are; candidates are re-measured in float64.
+
+    queries (row indexes) limits the search to pairs involving at least one of those
+    rows, for auditing just the newly enrolled students against everyone.
+    """
+    X = np.ascontiguousarray(vectors, dtype=GALLERY_DTYPE)
+    n = len(X)
+    sq = np.einsum("ij,ij->i", X, X)
+    if queries is None:
+        rows = np.arange(n)
+    else:
+        rows = np.unique(np.asarray(queries, dtype=np.int64))
+    is_query = np.zeros(n, dtype=bool)
+    is_query[rows] = True
+    # float32 rounding slack on the squared distance; survivors are re-checked exactly
+    cutoff = threshold * threshold + 1e-4
+
+    found_i, found_j = [], []
+    for start in range(0, len(rows), block):
+        qi = rows[start:start + block]
+        # all-pairs mode only needs the upper triangle of blocks
+        first = int(qi[0]) if queries is None else 0
+        for c in range(first, n, block):
+            d2 = sq[qi, None] + sq[None, c:c + block] - 2.0 * (X[qi] @ X[c:c + block].T)
+            a, b = np.nonzero(d2 <= cutoff)
+            i, j = qi[a], b + c
+            # each pair once: (i, j) with i < j when both are queries, any j that isn't
+            keep = (i < j) | ~is_query[j]
+            found_i.append(i[keep])
+            found_j.append(j[keep])
+
+    if not found_i:
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+    i, j = np.concatenate(found_i), np.concatenate(found_j)
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    exact = np.asarray(vectors, dtype=np.float64)
+    dist = np.linalg.norm(exact[i] - exact[j], axis=1)
+    keep = dist <= threshold
+    order = np.argsort(dist[keep], kind="stable")
+    return i[keep][order], j[keep][order], dist[keep][order]
+
+
+def vector_checksums(vectors):
+    """CRC32 of each embedding's bytes, to spot which students changed since the last audit."""
+    vectors = np.asarray(vectors, dtype=GALLERY_DTYPE)
+    return np.array([zlib.crc32(v.tobytes()) for v in vectors], dtype=np.int64)
+
+
+def load_audit_state(path, encoder_version):
+    """(student ids, checksums) audited by the last run, or None if missing or from another encoder."""
+    try:
+        with np.load(path) as data:
+            if int(data["encoder_version"]) != encoder_version:
+                return None
+            return data["ids"], data["checksums"]
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def save_audit_state(path, ids, checksums, encoder_version):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, ids=np.asarray(ids, dtype=np.int64), checksums=checksums, encoder_version=encoder_version)
+    os.replace(tmp, path)
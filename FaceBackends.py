@@ -0,0 +1,140 @@
+import hashlib
+import numpy as np
+from PIL import Image
+
+# face_recognition (dlib) is optional: without it the dlib backend reports itself
+# unavailable and FACE_BACKEND = 'synthetic' still works for tests and benchmarks
+try:
+    import face_recognition as fr
+except Exception:
+    fr = None
+
+
+class FaceBackend:
+    """
+    What the recognition path needs from a face engine. Boxes are
+    (top, right, bottom, left) tuples, images are HxWx3 uint8 RGB arrays.
+    """
+    name = None
+    # Embeddings from different encoder versions are not comparable (Student.face_encoder_version).
+    encoder_version = None
+
+    def available(self) -> bool:
+        raise NotImplementedError
+
+    def load_image(self, path):
+        return np.asarray(Image.open(path).convert("RGB"))
+
+    def detect(self, arr, upsample=1):
+        raise NotImplementedError
+
+    def encode_batch(self, arr, boxes, landmarks="small", jitters=1):
+        raise NotImplementedError
+
+    def encode(self, arr, box, landmarks="small", jitters=1):
+        return self.encode_batch(arr, [box], landmarks, jitters)[0]
+
+    def encode_aligned(self, arr, box, points, jitters=1):
+        """
+        Encode a face whose 5-point landmarks are already known ((x, y) in the order of
+        dlib's 5-point shape predictor), skipping landmark prediction where the engine
+        allows it.
+        """
+        return self.encode_batch(arr, [box], "small", jitters)[0]
+
+
+class DlibBackend(FaceBackend):
+    """face_recognition / dlib: HOG detection and the 128-d ResNet encoder."""
+    name = "dlib"
+    encoder_version = 1
+
+    def available(self):
+        return fr is not None
+
+    def load_image(self, path):
+        return fr.load_image_file(path)
+
+    def detect(self, arr, upsample=1):
+        # You can switch to model="cnn" if you’ve compiled dlib with CUDA.
+        return fr.face_locations(arr, number_of_times_to_upsample=upsample, model="hog")
+
+    def encode_batch(self, arr, boxes, landmarks="small", jitters=1):
+        if not boxes:
+            return []
+        return fr.face_encodings(arr, known_face_locations=boxes, num_jitters=jitters, model=landmarks)
+
+    def encode_aligned(self, arr, box, points, jitters=1):
+        # the same call face_encodings makes, with the kiosk's landmarks instead of the predictor's
+        import dlib
+        top, right, bottom, left = box
+        shape = dlib.full_object_detection(dlib.rectangle(int(left), int(top), int(right), int(bottom)),
+                                           [dlib.point(int(round(x)), int(round(y))) for x, y in points])
+        return np.array(fr.api.face_encoder.compute_face_descriptor(arr, shape, jitters))
+
+
+class SyntheticBackend(FaceBackend):
+    """
+    Deterministic stand-in for CI, load tests and benchmarks where dlib isn't installed.
+    Any non-blank image has one "face" in its centre, and its embedding is derived from
+    a hash of the image content, so the same photo always maps to the same vector while
+    different photos land ~1.0 apart (well outside the 0.6 match threshold).
+    """
+    name = "synthetic"
+    encoder_version = 1000
+
+    THUMB = 16
+    LEVELS = 16
+    # norm of the generated vectors: random pairs end up about sqrt(2) * SCALE apart
+    SCALE = 0.7
+
+    def available(self):
+        return True
+
+    def detect(self, arr, upsample=1):
+        if arr.size == 0 or float(arr.std()) < 2.0:
+            return []
+        h, w = arr.shape[:2]
+        return [(h // 4, 3 * w // 4, 3 * h // 4, w // 4)]
+
+    def _fingerprint(self, arr):
+        gray = arr.mean(axis=2).astype(np.uint8) if arr.ndim == 3 else arr.astype(np.uint8)
+        thumb = np.asarray(Image.fromarray(gray).resize((self.THUMB, self.THUMB), Image.BILINEAR))
+        return (thumb // (256 // self.LEVELS)).astype(np.uint8).tobytes()
+
+    def embedding_for(self, key: bytes):
+        seed = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+        vec = np.random.default_rng(seed).normal(size=128)
+        return vec / np.linalg.norm(vec) * self.SCALE
+
+    def encode_batch(self, arr, boxes, landmarks="small", jitters=1):
+        h, w = arr.shape[:2]
+        fingerprint = self._fingerprint(arr)
+        out = []
+        for (t, r, b, l) in boxes:
+            # coarse box centre keeps several faces in one frame distinct, while the
+            # few pixels of rounding from downscaled detection don't change it
+            cell = bytes([round(4 * (t + b) / (2 * max(h, 1))), round(4 * (l + r) / (2 * max(w, 1)))])
+            out.append(self.embedding_for(fingerprint + cell))
+        return out
+
+
+BACKENDS = {
+    DlibBackend.name: DlibBackend,
+    SyntheticBackend.name: SyntheticBackend,
+}
+
+_backend = DlibBackend()
+
+
+def use_backend(name):
+    """Select the face engine for this process (config FACE_BACKEND)."""
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown face backend: {name}")
+    if _backend.name != name:
+        _backend = BACKENDS[name]()
+    return _backend
+
+
+def get_backend() -> FaceBackend:
+    return _backend
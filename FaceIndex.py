@@ -0,0 +1,316 @@
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+from Gallery import EMBEDDING_DIM, GALLERY_DTYPE
+
+log = logging.getLogger(__name__)
+
+Candidate = namedtuple("Candidate", ["student_id", "distance"])
+
+
+def _sq_distances(vectors, centroids):
+    v_sq = np.einsum("ij,ij->i", vectors, vectors)
+    c_sq = np.einsum("ij,ij->i", centroids, centroids)
+    d2 = v_sq[:, None] + c_sq[None, :] - 2.0 * (vectors @ centroids.T)
+    return np.maximum(d2, 0.0, out=d2)
+
+
+def kmeans(vectors, k, iters=20, seed=0):
+    """
+    Lloyd's k-means in NumPy, returning (k, dim) centroids. Empty clusters are
+    re-seeded with the points currently furthest from their centroid.
+    """
+    vectors = np.asarray(vectors, dtype=GALLERY_DTYPE)
+    n = len(vectors)
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(n, size=k, replace=False)].copy()
+    rows = np.arange(n)
+    for _ in range(iters):
+        d2 = _sq_distances(vectors, centroids)
+        assign = d2.argmin(axis=1)
+        # cluster sums as one (k, n) @ (n, dim) product
+        onehot = np.zeros((k, n), dtype=GALLERY_DTYPE)
+        onehot[assign, rows] = 1.0
+        sums = onehot @ vectors
+        counts = onehot.sum(axis=1)
+        empty = counts == 0
+        if empty.any():
+            far = np.argsort(d2[rows, assign])[::-1][:int(empty.sum())]
+            sums[empty] = vectors[far]
+            counts[empty] = 1.0
+        updated = sums / counts[:, None]
+        converged = np.allclose(updated, centroids, atol=1e-6)
+        centroids = updated
+        if converged:
+            break
+    return np.ascontiguousarray(centroids, dtype=GALLERY_DTYPE)
+
+
+class FaceIndex:
+    """
+    Inverted-file (IVF) index over every enrolled student's embedding, for identifying
+    a face against the whole school rather than one class roster. Vectors are bucketed
+    by their nearest k-means centroid; search() scans only the `nprobe` buckets nearest
+    the probe and ranks those rows exactly. Until build() has trained centroids
+    everything sits in one bucket, i.e. a flat scan.
+
+    nlist=0 picks ~sqrt(N) buckets at training time. Inserts and deletes go straight to
+    the right bucket; the centroids only change on a rebuild (`flask rebuild-face-index`).
+
+    Commits only reach apply() in the process that made them, so with a shared `path`
+    every applied change is saved back to it, and ensure_loaded() reloads the file and
+    re-syncs against the DB whenever it has been replaced (a stat, as GalleryStore does)
+    or `sync_seconds` have passed since the last sync.
+    """
+
+    def __init__(self, nlist=0, nprobe=8, sync_seconds=60.0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.sync_seconds = sync_seconds
+        self._lock = threading.RLock()
+        self.loaded = False
+        self.encoder_version = None
+        self.path = None
+        self._signature = None  # stat of `path` as last loaded or saved here
+        self._synced_at = 0.0
+        self.syncs = 0
+        self._reset(None)
+
+    def configure(self, nlist=None, nprobe=None, sync_seconds=None):
+        if nlist is not None:
+            self.nlist = nlist
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if sync_seconds is not None:
+            self.sync_seconds = sync_seconds
+
+    def _reset(self, centroids):
+        self.centroids = centroids
+        buckets = 1 if centroids is None else len(centroids)
+        self._ids = [np.empty(0, dtype=np.int64) for _ in range(buckets)]
+        self._vectors = [np.empty((0, EMBEDDING_DIM), dtype=GALLERY_DTYPE) for _ in range(buckets)]
+        self._where = {}        # student id -> bucket
+        self.trained_size = 0
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, student_id):
+        return student_id in self._where
+
+    def _bucket_for(self, vector):
+        if self.centroids is None:
+            return 0
+        return int(_sq_distances(vector[None, :], self.centroids)[0].argmin())
+
+    def build(self, ids, vectors, encoder_version=None, seed=0):
+        """Train the centroids on `vectors` and index them, replacing the current contents."""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=GALLERY_DTYPE).reshape(-1, EMBEDDING_DIM)
+        k = self.nlist or int(np.sqrt(len(ids)))
+        k = min(k, len(ids))
+        centroids = kmeans(vectors, k, seed=seed) if k > 1 else None
+        with self._lock:
+            self._reset(centroids)
+            if centroids is None:
+                assign = np.zeros(len(ids), dtype=np.int64)
+            else:
+                assign = _sq_distances(vectors, centroids).argmin(axis=1)
+            self._fill(ids, vectors, assign)
+            self.trained_size = len(ids)
+            self.encoder_version = encoder_version
+            self.loaded = True
+        return self
+
+    def _fill(self, ids, vectors, assign):
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(len(self._ids) + 1))
+        for b in range(len(self._ids)):
+            rows = order[bounds[b]:bounds[b + 1]]
+            self._ids[b] = ids[rows]
+            self._vectors[b] = np.ascontiguousarray(vectors[rows])
+            self._where.update((int(i), b) for i in self._ids[b])
+
+    def add(self, student_id, vector):
+        """Insert or replace one student's embedding."""
+        vector = np.asarray(vector, dtype=GALLERY_DTYPE).reshape(EMBEDDING_DIM)
+        with self._lock:
+            self._remove(student_id)
+            b = self._bucket_for(vector)
+            self._ids[b] = np.append(self._ids[b], np.int64(student_id))
+            self._vectors[b] = np.vstack([self._vectors[b], vector[None, :]])
+            self._where[student_id] = b
+
+    def remove(self, student_id):
+        with self._lock:
+            self._remove(student_id)
+
+    def _remove(self, student_id):
+        b = self._where.pop(student_id, None)
+        if b is None:
+            return
+        keep = self._ids[b] != student_id
+        self._ids[b] = self._ids[b][keep]
+        self._vectors[b] = self._vectors[b][keep]
+
+    def apply(self, changes):
+        """
+        Apply committed changes, {student_id: embedding or None (drop)}, and save them
+        to the shared path. Ignored until the index has been loaded, since loading
+        reconciles against the DB anyway.
+        """
+        with self._lock:
+            if not self.loaded:
+                return
+            for student_id, vector in changes.items():
+                if vector is None:
+                    self._remove(student_id)
+                else:
+                    self.add(student_id, vector)
+        self._share()
+
+    def sync(self, rows):
+        """Make the index hold exactly these (student_id, embedding) rows. Returns (added, removed)."""
+        rows = {int(sid): vec for sid, vec in rows if vec is not None}
+        added = removed = 0
+        with self._lock:
+            for student_id in [s for s in self._where if s not in rows]:
+                self._remove(student_id)
+                removed += 1
+            for student_id, vector in rows.items():
+                b = self._where.get(student_id)
+                if b is not None:
+                    i = int(np.flatnonzero(self._ids[b] == student_id)[0])
+                    if np.array_equal(self._vectors[b][i], np.asarray(vector, dtype=GALLERY_DTYPE)):
+                        continue
+                self.add(student_id, vector)
+                added += 1
+        return added, removed
+
+    def search(self, probe, k=5, nprobe=None):
+        """The k nearest indexed students to `probe`, closest first, as Candidates."""
+        probe = np.asarray(probe, dtype=GALLERY_DTYPE).reshape(1, EMBEDDING_DIM)
+        nprobe = nprobe or self.nprobe
+        with self._lock:
+            if self.centroids is None or nprobe >= len(self.centroids):
+                buckets = range(len(self._ids))
+            else:
+                d2 = _sq_distances(probe, self.centroids)[0]
+                buckets = np.argpartition(d2, nprobe - 1)[:nprobe]
+            ids = np.concatenate([self._ids[b] for b in buckets])
+            vectors = np.concatenate([self._vectors[b] for b in buckets])
+        if len(ids) == 0:
+            return []
+        dists = np.sqrt(_sq_distances(probe, vectors)[0])
+        k = min(k, len(ids))
+        top = np.argpartition(dists, k - 1)[:k]
+        top = top[np.argsort(dists[top])]
+        return [Candidate(int(ids[i]), float(dists[i])) for i in top]
+
+    def save(self, path):
+        """Write the index to `path` (.npz), atomically."""
+        with self._lock:
+            ids = np.concatenate(self._ids)
+            vectors = np.concatenate(self._vectors)
+            buckets = np.concatenate([np.full(len(a), b, dtype=np.int64) for b, a in enumerate(self._ids)])
+            centroids = self.centroids if self.centroids is not None else np.empty((0, EMBEDDING_DIM), GALLERY_DTYPE)
+            trained_size = self.trained_size
+            version = self.encoder_version
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, ids=ids, vectors=vectors, buckets=buckets, centroids=centroids,
+                     trained_size=trained_size, encoder_version=-1 if version is None else version)
+        os.replace(tmp, path)
+
+    def load(self, path):
+        """Replace the contents with an index written by save()."""
+        with np.load(path) as data:
+            centroids = data["centroids"]
+            with self._lock:
+                self._reset(centroids.astype(GALLERY_DTYPE) if len(centroids) else None)
+                self._fill(data["ids"], data["vectors"].astype(GALLERY_DTYPE), data["buckets"])
+                self.trained_size = int(data["trained_size"])
+                version = int(data["encoder_version"])
+                self.encoder_version = None if version < 0 else version
+
+    @staticmethod
+    def signature(path):
+        try:
+            st = os.stat(path)
+        except (FileNotFoundError, TypeError):
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _share(self):
+        """Save to the shared path, if any, so other workers pick the change up."""
+        path = self.path
+        if not path:
+            return
+        try:
+            self.save(path)
+        except OSError:
+            # the other workers still catch up on their next timed sync
+            log.exception("Could not save face index to %s", path)
+            return
+        self._signature = self.signature(path)
+
+    def _stale(self, path, now):
+        return (not self.loaded or now - self._synced_at >= self.sync_seconds
+                or (path and self.signature(path) != self._signature))
+
+    def ensure_loaded(self, path, load_rows, encoder_version=None, seed=0, now=None):
+        """
+        Load the index on first use, and again once `path` has been replaced or
+        `sync_seconds` have passed: from `path` when it holds an index for this
+        encoder version, reconciled against load_rows() -> [(student_id, embedding)];
+        otherwise built from scratch from those rows. Whatever the DB changed is saved
+        back to `path`.
+        """
+        now = time.monotonic() if now is None else now
+        if not self._stale(path, now):
+            return self
+        with self._lock:
+            if not self._stale(path, now):
+                return self
+            self.path = path
+            signature = self.signature(path)
+            restored = self.loaded and self.encoder_version == encoder_version
+            if signature is not None and (signature != self._signature or not self.loaded):
+                self.load(path)
+                self._signature = signature
+                restored = self.encoder_version == encoder_version
+            rows = [(sid, vec) for sid, vec in load_rows() if vec is not None]
+            if restored:
+                changed = any(self.sync(rows))
+            else:
+                self.build([sid for sid, _ in rows], [vec for _, vec in rows], encoder_version, seed)
+                changed = True
+            self.loaded = True
+            self._synced_at = now
+            self.syncs += 1
+            if changed:
+                self._share()
+        return self
+
+    def clear(self):
+        with self._lock:
+            self._reset(None)
+            self.loaded = False
+            self.encoder_version = None
+            self.path = None
+            self._signature = None
+            self._synced_at = 0.0
+            self.syncs = 0
+
+    def stats(self):
+        with self._lock:
+            sizes = [len(a) for a in self._ids]
+            return {"students": len(self._where), "lists": len(sizes), "nprobe": self.nprobe,
+                    "largest_list": max(sizes) if sizes else 0, "trained_size": self.trained_size,
+                    "loaded": self.loaded, "syncs": self.syncs}
+
+
+face_index = FaceIndex()
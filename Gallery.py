@@ -0,0 +1,304 @@
+from collections import namedtuple, OrderedDict
+import threading
+import time
+import numpy as np
+
+EMBEDDING_DIM = 128
+# embeddings are stored as float32 (see Models.FaceVector), galleries keep them that way
+GALLERY_DTYPE = np.float32
+# in-memory gallery representations; the smaller ones re-rank their top candidates in float32
+GALLERY_PRECISIONS = ("float32", "float16", "int8")
+# rows converted back to float32 at a time when scanning a quantised gallery
+SCAN_CHUNK = 4096
+
+# Threshold — tune to your data. 0.6 is the common starting point for face_recognition.
+MATCH_THRESHOLD = 0.60
+
+Match = namedtuple("Match", ["student_id", "name", "email", "distance", "second_distance"])
+
+
+class Gallery:
+    """
+    A class roster's face embeddings stacked into one contiguous (N, 128) matrix,
+    with the matching ids/names/emails kept in the same row order.
+
+    precision "float16" or "int8" (per-dimension scale) stores the matrix at 1/2 or 1/4
+    of the size. Matching then scans the compact matrix and re-ranks each probe's
+    `rerank` closest rows at full precision, read through fetch(ids) -> {id: embedding}
+    (the DB) or, without a fetch, from the float32 rows kept alongside (no extra memory
+    when those are a GalleryStore memmap).
+    """
+
+    def __init__(self, ids, names, emails, vectors, precision="float32", rerank=8, fetch=None):
+        if precision not in GALLERY_PRECISIONS:
+            raise ValueError(f"Unknown gallery precision: {precision}")
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.names = list(names)
+        self.emails = list(emails)
+        # a read-only np.memmap from GalleryStore is used in place; its pages are
+        # shared with every other worker mapping the same file
+        self.shared = isinstance(vectors, np.memmap)
+        if isinstance(vectors, np.ndarray) and vectors.ndim == 2:
+            full = np.ascontiguousarray(vectors, dtype=GALLERY_DTYPE)
+        elif len(vectors):
+            full = np.ascontiguousarray(np.vstack(vectors), dtype=GALLERY_DTYPE)
+        else:
+            full = np.empty((0, EMBEDDING_DIM), dtype=GALLERY_DTYPE)
+        self.precision = precision
+        self.rerank = max(rerank, 2)
+        self.fetch = fetch
+        self.scale = None
+        if precision == "float32":
+            self.matrix = full
+        elif precision == "float16":
+            self.matrix = full.astype(np.float16)
+        else:
+            scale = np.abs(full).max(axis=0) / 127.0 if len(full) else np.ones(EMBEDDING_DIM)
+            scale[scale == 0] = 1.0
+            self.scale = scale.astype(GALLERY_DTYPE)
+            self.matrix = np.clip(np.rint(full / self.scale), -127, 127).astype(np.int8)
+        # full-precision rows for the re-rank, unless they can be fetched when needed
+        self._full = full if precision == "float32" or fetch is None else None
+        # squared row norms of what the scan sees, so distances need one matrix product per probe batch
+        stored = self._dequantise(0, len(full)) if precision != "float32" else full
+        self.sq_norms = np.einsum("ij,ij->i", stored, stored)
+        # approximate memory held by this process (arrays plus name/email strings), used by GalleryCache
+        strings = sum(len(n or "") + len(e or "") for n, e in zip(self.names, self.emails))
+        self.nbytes = self.sq_norms.nbytes + self.ids.nbytes + strings
+        if not (self.shared and self.matrix is full):
+            self.nbytes += self.matrix.nbytes
+        if self._full is not None and self._full is not self.matrix and not self.shared:
+            self.nbytes += self._full.nbytes
+        # GalleryStore.signature() of the files this gallery was read from, if any
+        self.store_signature = None
+
+    def _dequantise(self, start, stop):
+        rows = self.matrix[start:stop].astype(GALLERY_DTYPE)
+        if self.scale is not None:
+            rows *= self.scale
+        return rows
+
+    @classmethod
+    def from_students(cls, students, **options):
+        """Build a gallery from Student rows, skipping those without an embedding."""
+        return cls.from_rows(((s.id, s.name, s.email, s.face_vector) for s in students), **options)
+
+    @classmethod
+    def from_rows(cls, rows, **options):
+        """
+        Build a gallery from (id, name, email, face_vector) tuples, e.g. a column query.
+        face_vector comes back from the DB as a float32 view over the row bytes, so the
+        only copy made is the one into the contiguous matrix.
+        """
+        rows = [r for r in rows if r[3] is not None]
+        return cls(
+            [r[0] for r in rows],
+            [r[1] for r in rows],
+            [r[2] for r in rows],
+            [r[3] for r in rows],
+            **options,
+        )
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def distances(self, probes):
+        """
+        Euclidean distances between K probes and every row, as a (K, N) array.
+        Same values as Helpers.face_distance, computed in a single BLAS call; for a
+        float16/int8 gallery they are distances to the quantised rows.
+        """
+        probes = np.atleast_2d(np.asarray(probes, dtype=GALLERY_DTYPE))
+        p_sq = np.einsum("ij,ij->i", probes, probes)
+        if self.precision == "float32":
+            dots = probes @ self.matrix.T
+        else:
+            # p . (scale * c) == (p * scale) . c, so int8 rows only need a dtype conversion
+            weighted = probes * self.scale if self.scale is not None else probes
+            dots = np.empty((len(probes), len(self)), dtype=GALLERY_DTYPE)
+            for start in range(0, len(self), SCAN_CHUNK):
+                chunk = self.matrix[start:start + SCAN_CHUNK].astype(GALLERY_DTYPE)
+                dots[:, start:start + len(chunk)] = weighted @ chunk.T
+        d2 = p_sq[:, None] + self.sq_norms[None, :] - 2.0 * dots
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
+
+    def _rerank(self, probes, dists):
+        """Exact distances for each probe's `rerank` closest rows; every other row becomes inf."""
+        probes = np.atleast_2d(np.asarray(probes, dtype=GALLERY_DTYPE))
+        k = min(self.rerank, len(self))
+        top = np.argpartition(dists, k - 1, axis=1)[:, :k]
+        rows = np.unique(top)
+        if self._full is not None:
+            full = self._full[rows]
+            found = np.ones(len(rows), dtype=bool)
+        else:
+            fetched = self.fetch([int(i) for i in self.ids[rows]])
+            found = np.array([int(i) in fetched for i in self.ids[rows]], dtype=bool)
+            full = np.zeros((len(rows), EMBEDDING_DIM), dtype=GALLERY_DTYPE)
+            for j in np.flatnonzero(found):
+                full[j] = fetched[int(self.ids[rows[j]])]
+        pos = np.searchsorted(rows, top)
+        exact = np.linalg.norm(probes[:, None, :] - full[pos], axis=2)
+        exact[~found[pos]] = np.inf
+
+        out = np.full_like(dists, np.inf)
+        out[np.arange(len(probes))[:, None], top] = exact
+        return out
+
+    def match_many(self, probes):
+        """Best and second-best match for each probe (one Match per probe, None if empty)."""
+        if len(self) == 0:
+            return [None] * len(np.atleast_2d(probes))
+        dists = self.distances(probes)
+        if self.precision != "float32":
+            dists = self._rerank(probes, dists)
+        if len(self) == 1:
+            best = np.zeros(dists.shape[0], dtype=np.int64)
+            second = np.full(dists.shape[0], np.inf)
+        else:
+            top2 = np.argpartition(dists, 1, axis=1)[:, :2]
+            rows = np.arange(dists.shape[0])
+            pair = dists[rows[:, None], top2]
+            order = np.argsort(pair, axis=1)
+            best = top2[rows, order[:, 0]]
+            second = pair[rows, order[:, 1]]
+
+        out = []
+        for k, i in enumerate(best):
+            out.append(Match(int(self.ids[i]), self.names[i], self.emails[i],
+                             float(dists[k, i]), float(second[k])))
+        return out
+
+    def match(self, probe):
+        """Best and second-best match for a single probe embedding."""
+        return self.match_many(probe)[0]
+
+
+def compare_precision(vectors, probes, precision, rerank=8, threshold=MATCH_THRESHOLD):
+    """
+    How a float16/int8 gallery of `vectors` matches `probes` compared with exact float64
+    distances (what Helpers.face_distance computes): recall@1 with and without the
+    re-rank, agreement of the match/no-match decision, the largest error in the reported
+    best distance, bytes per stored embedding and matching time per probe.
+    """
+    vectors = np.asarray(vectors, dtype=np.float64)
+    probes = np.atleast_2d(np.asarray(probes, dtype=np.float64))
+    ids = np.arange(len(vectors))
+    gallery = Gallery(ids, [""] * len(ids), [""] * len(ids), vectors.astype(GALLERY_DTYPE),
+                      precision=precision, rerank=rerank)
+
+    reference = np.stack([np.linalg.norm(vectors - p, axis=1) for p in probes])
+    ref_best = reference.argmin(axis=1)
+    ref_dist = reference[np.arange(len(probes)), ref_best]
+
+    started = time.perf_counter()
+    matches = gallery.match_many(probes)
+    elapsed = time.perf_counter() - started
+    best = np.array([m.student_id for m in matches])
+    dist = np.array([m.distance for m in matches])
+    scan_best = gallery.distances(probes).argmin(axis=1)
+
+    return {
+        "precision": precision,
+        "recall_at_1": float(np.mean(best == ref_best)),
+        "scan_recall_at_1": float(np.mean(scan_best == ref_best)),
+        "decision_agreement": float(np.mean((dist <= threshold) == (ref_dist <= threshold))),
+        "max_distance_error": float(np.max(np.abs(dist - ref_dist))),
+        "bytes_per_embedding": gallery.matrix.nbytes / max(len(gallery), 1),
+        "ms_per_probe": elapsed * 1000 / len(probes),
+    }
+
+
+class GalleryCache:
+    """
+    In-process LRU cache of class galleries keyed by class id, bounded by total bytes.
+    Rosters change a few times a term, so kiosk frames mostly hit this instead of the ORM.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._generation = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, max_bytes=None):
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._evict()
+
+    def get(self, class_id):
+        with self._lock:
+            gallery = self._items.get(class_id)
+            if gallery is not None:
+                self._items.move_to_end(class_id)
+            return gallery
+
+    def get_or_build(self, class_id, build):
+        """Return the cached gallery for class_id, or call build() and cache its result."""
+        with self._lock:
+            gallery = self._items.get(class_id)
+            if gallery is not None:
+                self._items.move_to_end(class_id)
+                self.hits += 1
+                return gallery
+            self.misses += 1
+            generation = self._generation.get(class_id, 0)
+
+        gallery = build()
+
+        with self._lock:
+            # an invalidation while we were building means the roster we read may be stale
+            if self._generation.get(class_id, 0) == generation:
+                self._put(class_id, gallery)
+        return gallery
+
+    def generation(self, class_id):
+        """Bumped on every invalidation; lets long-lived holders of a gallery notice roster changes."""
+        with self._lock:
+            return self._generation.get(class_id, 0)
+
+    def invalidate(self, class_id):
+        with self._lock:
+            self._generation[class_id] = self._generation.get(class_id, 0) + 1
+            gallery = self._items.pop(class_id, None)
+            if gallery is not None:
+                self._bytes -= gallery.nbytes
+
+    def clear(self):
+        with self._lock:
+            for class_id in list(self._items):
+                self._generation[class_id] = self._generation.get(class_id, 0) + 1
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"classes": len(self._items), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+    def __contains__(self, class_id):
+        with self._lock:
+            return class_id in self._items
+
+    def _put(self, class_id, gallery):
+        old = self._items.pop(class_id, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+        if gallery.nbytes > self.max_bytes:
+            return
+        self._items[class_id] = gallery
+        self._bytes += gallery.nbytes
+        self._evict()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._items:
+            _, gallery = self._items.popitem(last=False)
+            self._bytes -= gallery.nbytes
+
+
+gallery_cache = GalleryCache()
@@ -0,0 +1,146 @@
+import glob
+import json
+import logging
+import os
+import uuid
+import numpy as np
+from Gallery import Gallery, GALLERY_DTYPE, EMBEDDING_DIM
+
+log = logging.getLogger(__name__)
+
+
+class GalleryStore:
+    """
+    Class galleries shared between worker processes through files in `directory`:
+      class_<id>-<version>.npy   the (N, 128) float32 embedding matrix
+      class_<id>.json            its id index: ids, names, emails, encoder version
+      class_<id>.gen             rewritten whenever the roster or an embedding changes
+    Workers np.load(mmap_mode="r") the matrix, so the OS page cache holds one copy for
+    all of them, and a cold worker skips the DB scan. Files are written under a temp
+    name and renamed into place, the .json last, so a reader never sees half a gallery.
+
+    A .json built against an older .gen (or another encoder version) is stale and the
+    gallery is rebuilt from the DB. signature() is a stat of .gen and .json: cheap enough
+    to compare against a mapped gallery's on every frame to know when to remap.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+
+    def configure(self, directory=None):
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.directory = directory
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write(self, path, write):
+        """Atomically replace `path` with whatever write(f) puts in a temp file next to it."""
+        tmp = f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                write(f)
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def generation(self, class_id):
+        try:
+            with open(self._path(f"class_{class_id}.gen")) as f:
+                return f.read()
+        except FileNotFoundError:
+            return ""
+
+    def invalidate(self, class_id):
+        """Mark class_id's stored gallery stale (every worker remaps on its next frame)."""
+        if not self.enabled:
+            return
+        try:
+            token = uuid.uuid4().hex.encode()
+            self._write(self._path(f"class_{class_id}.gen"), lambda f: f.write(token))
+        except OSError:
+            # a store we can't write to would keep serving the old roster
+            log.exception("Could not invalidate stored gallery for class %s", class_id)
+            self._remove(self._path(f"class_{class_id}.json"))
+
+    def signature(self, class_id):
+        sig = []
+        for suffix in (".gen", ".json"):
+            try:
+                st = os.stat(self._path(f"class_{class_id}{suffix}"))
+                sig.append((st.st_ino, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                sig.append(None)
+        return tuple(sig)
+
+    def is_current(self, class_id, gallery):
+        return gallery.store_signature == self.signature(class_id)
+
+    def save(self, class_id, rows, generation, encoder_version):
+        """Write (id, name, email, face_vector) rows as class_id's gallery, built against `generation`."""
+        rows = [r for r in rows if r[3] is not None]
+        if rows:
+            matrix = np.ascontiguousarray(np.vstack([r[3] for r in rows]), dtype=GALLERY_DTYPE)
+        else:
+            matrix = np.empty((0, EMBEDDING_DIM), dtype=GALLERY_DTYPE)
+        version = uuid.uuid4().hex
+        name = f"class_{class_id}-{version}.npy"
+        self._write(self._path(name), lambda f: np.save(f, matrix))
+        meta = {"version": version, "generation": generation, "encoder_version": encoder_version,
+                "matrix": name, "ids": [int(r[0]) for r in rows],
+                "names": [r[1] for r in rows], "emails": [r[2] for r in rows]}
+        data = json.dumps(meta).encode()
+        self._write(self._path(f"class_{class_id}.json"), lambda f: f.write(data))
+        # workers still mapping an old matrix keep it until they remap (POSIX unlink semantics)
+        for old in glob.glob(self._path(f"class_{class_id}-*.npy")):
+            if os.path.basename(old) != name:
+                self._remove(old)
+
+    def load(self, class_id, encoder_version, **options):
+        """class_id's stored gallery, memory-mapped, or None if it's missing or stale."""
+        signature = self.signature(class_id)
+        try:
+            with open(self._path(f"class_{class_id}.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("generation") != self.generation(class_id) or meta.get("encoder_version") != encoder_version:
+            return None
+        try:
+            matrix = np.load(self._path(meta["matrix"]), mmap_mode="r")
+        except (OSError, ValueError):
+            # replaced by a newer save between reading the index and mapping
+            return None
+        gallery = Gallery(meta["ids"], meta["names"], meta["emails"], matrix, **options)
+        gallery.store_signature = signature
+        return gallery
+
+    def clear(self):
+        """Remove every stored gallery."""
+        if not self.enabled:
+            return
+        for path in glob.glob(self._path("class_*")):
+            self._remove(path)
+
+    def stats(self):
+        if not self.enabled:
+            return {"enabled": False}
+        files = glob.glob(self._path("class_*.json"))
+        return {"enabled": True, "directory": self.directory, "classes": len(files)}
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+gallery_store = GalleryStore()
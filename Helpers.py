@@ -2,40 +2,373 @@ import re
 import random
 import string
 import io
+import time
 import numpy as np
 from PIL import Image
 
-# FALL BACK TO STUB FOR JUST TONIGHT WHILE I SETUP SOMETH ELSE!
-try:
-    import face_recognition as fr
-    FACE_ENABLED = True
-except Exception:
-    fr = None
-    FACE_ENABLED = False
+from FaceBackends import get_backend, use_backend
 
-def bytes_to_encoding(image_bytes: bytes):
+def face_enabled() -> bool:
+    """True when the configured face backend (config FACE_BACKEND) can run."""
+    return get_backend().available()
+
+def encoder_version() -> int:
+    return get_backend().encoder_version
+
+# Named speed/accuracy trade-offs for kiosk frames.
+#   decode:    decode the upload at 1/decode scale for detection (JPEG draft mode, so libjpeg never
+#              builds the full-size frame); a frame with faces to encode is decoded again in full
+#              and encoded at upload resolution
+#   downscale: detect on a frame shrunk by this factor (relative to the upload), boxes are
+#              mapped back to upload resolution for encoding
+#   upsample:  detection upsampling (face_locations number_of_times_to_upsample)
+#   landmarks: encoder landmark model (face_encodings model=) -> "small" (5-point) or "large" (68-point)
+#   jitters:   encoder resampling (face_encodings num_jitters)
+SPEED_PROFILES = {
+    "fast":     {"decode": 4, "downscale": 4, "upsample": 1, "landmarks": "small", "jitters": 1},
+    "balanced": {"decode": 1, "downscale": 2, "upsample": 1, "landmarks": "small", "jitters": 1},
+    "accurate": {"decode": 1, "downscale": 1, "upsample": 1, "landmarks": "large", "jitters": 2},
+}
+DEFAULT_SPEED_PROFILE = "balanced"
+
+# stages reported by analyse_frame, in pipeline order ("roi" replaces "detect" on tracked frames)
+FRAME_STAGES = ("decode", "quality", "roi", "detect", "encode")
+
+# Frame-quality gate (analyse_frame quality=, config FRAME_QUALITY_GATE). Failing frames
+# raise FrameRejected before detection (brightness) or before encoding (face size, blur).
+#   min/max_brightness: mean pixel value of the frame, 0-255
+#   min_sharpness:      variance of the Laplacian of the face, resized to QUALITY_PATCH px square
+#   min_face:           shorter side of the face box, in upload pixels
+DEFAULT_QUALITY_GATE = {"min_brightness": 35, "max_brightness": 240, "min_sharpness": 40.0, "min_face": 64}
+QUALITY_PATCH = 96
+REJECT_REASONS = {
+    "too_dark": "Frame too dark",
+    "too_bright": "Frame too bright",
+    "face_too_small": "Face too small, move closer to the camera",
+    "blurry": "Frame too blurry",
+}
+
+
+class FrameRejected(Exception):
+    """A kiosk frame that failed the quality gate. reason is a REJECT_REASONS key."""
+
+    def __init__(self, reason, value=None, timings=None):
+        super().__init__(reason, value, timings)
+        self.reason = reason
+        self.value = value
+        self.timings = timings if timings is not None else {}
+
+# Pre-cropped face chips (analyse_chips): kiosks that run their own face detector upload
+# just the faces, each cropped to its detector box plus CHIP_MARGIN of the box size on
+# every side, with optional 5-point landmarks (dlib shape_predictor_5 order, chip pixels).
+CHIP_MARGIN = 0.2
+CHIP_LANDMARKS = 5
+
+# Face-region tracking (hints come from KioskState.FaceTracker)
+#   ROI_MARGIN: a tracked box is searched again inside itself grown by this fraction of its size per side
+#   TRACK_IOU:  overlap at which a face found in the ROI counts as the tracked face, not a new one
+ROI_MARGIN = 0.5
+TRACK_IOU = 0.5
+
+def get_speed_profile(name=None) -> dict:
+    return SPEED_PROFILES[name or DEFAULT_SPEED_PROFILE]
+
+def decode_frame(image_bytes: bytes, scale: int = 1):
     """
-    Convert a JPEG/PNG bytes blob (from webcam) into a 128-d face embedding.
-    Returns None if no *single* face is found or FACE is disabled.
+    Decode an uploaded frame into one C-contiguous HxWx3 uint8 array.
+    JPEGs are decoded straight at ~1/scale (draft mode picks the nearest DCT scale of
+    1/2, 1/4 or 1/8); other formats are decoded in full and reduced.
+    Returns (image, array, actual_scale), or None if the bytes can't be decoded.
     """
-    if not FACE_ENABLED or fr is None:
-        return None
     try:
-        im = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        im = Image.open(io.BytesIO(image_bytes))
+        full_w = im.size[0]
+        if scale > 1 and im.format == "JPEG":
+            im.draft("RGB", (im.size[0] // scale, im.size[1] // scale))
+        # convert() to the mode an image already has still copies it, so only when needed
+        im = im.convert("RGB") if im.mode != "RGB" else im
+        im.load()
+        actual = max(1, round(full_w / im.size[0]))
+        if scale // actual > 1:
+            im = im.reduce(scale // actual)
+            actual = max(1, round(full_w / im.size[0]))
     except Exception:
         return None
-    arr = np.array(im)
-    try:
-        # You can switch to model="cnn" if you’ve compiled dlib with CUDA.
-        locs = fr.face_locations(arr, model="hog")
-        if len(locs) != 1:
+    return im, np.asarray(im), actual
+
+def _locate_faces(im, arr, factor, upsample):
+    """
+    Run detection on a copy of the frame shrunk by `factor` and map the boxes back
+    onto `arr`, so encoding still sees every decoded pixel.
+    """
+    small = arr if factor <= 1 else np.asarray(im.reduce(factor))
+    locs = get_backend().detect(small, upsample=upsample)
+    if factor <= 1:
+        return locs
+    return _scale_boxes(locs, factor, arr.shape)
+
+def _scale_boxes(locs, factor, shape):
+    h, w = shape[:2]
+    return [(max(t * factor, 0), min(r * factor, w), min(b * factor, h), max(l * factor, 0)) for (t, r, b, l) in locs]
+
+def box_iou(a, b) -> float:
+    """Intersection over union of two (top, right, bottom, left) boxes."""
+    inter_h = min(a[2], b[2]) - max(a[0], b[0])
+    inter_w = min(a[1], b[1]) - max(a[3], b[3])
+    if inter_h <= 0 or inter_w <= 0:
+        return 0.0
+    inter = inter_h * inter_w
+    union = (a[2] - a[0]) * (a[1] - a[3]) + (b[2] - b[0]) * (b[1] - b[3]) - inter
+    return inter / union if union > 0 else 0.0
+
+def _search_rois(im, arr, boxes, factor, upsample):
+    """
+    Look for each tracked face only inside a margin around its last box (decoded-frame
+    coordinates). Returns one box per tracked box, or None if any region comes up empty
+    or two regions land on the same face, so the caller can fall back to a full scan.
+    """
+    h, w = arr.shape[:2]
+    found = []
+    for (t, r, b, l) in boxes:
+        mh, mw = (b - t) * ROI_MARGIN, (r - l) * ROI_MARGIN
+        top, bottom = max(int(t - mh), 0), min(int(b + mh), h)
+        left, right = max(int(l - mw), 0), min(int(r + mw), w)
+        if bottom - top < 2 or right - left < 2:
             return None
-        encs = fr.face_encodings(arr, known_face_locations=locs)
-        if len(encs) != 1:
+        roi = im.crop((left, top, right, bottom))
+        locs = _locate_faces(roi, np.asarray(roi), factor, upsample)
+        if not locs:
             return None
-        return encs[0]
+        locs = [(tt + top, rr + left, bb + top, ll + left) for (tt, rr, bb, ll) in locs]
+        found.append(max(locs, key=lambda box: box_iou(box, (t, r, b, l))))
+    for i in range(len(found)):
+        for j in range(i + 1, len(found)):
+            if box_iou(found[i], found[j]) > TRACK_IOU:
+                return None
+    return found
+
+def frame_brightness(arr) -> float:
+    # every 8th pixel each way is plenty for a mean
+    return float(arr[::8, ::8].mean())
+
+def face_sharpness(im, box) -> float:
+    """Variance of the Laplacian of the face crop (grayscale, QUALITY_PATCH px square); low = blurred."""
+    t, r, b, l = box
+    patch = im.crop((l, t, r, b)).convert("L").resize((QUALITY_PATCH, QUALITY_PATCH), Image.BILINEAR)
+    g = np.asarray(patch, dtype=np.float32)
+    lap = g[1:-1, :-2] + g[1:-1, 2:] + g[:-2, 1:-1] + g[2:, 1:-1] - 4.0 * g[1:-1, 1:-1]
+    return float(lap.var())
+
+def _face_problem(im, box, scale, gate):
+    """The REJECT_REASONS key a detected face fails on (and the measured value), or None."""
+    t, r, b, l = box
+    side = min(b - t, r - l) * scale
+    if side < gate["min_face"]:
+        return "face_too_small", side
+    sharpness = face_sharpness(im, box)
+    if sharpness < gate["min_sharpness"]:
+        return "blurry", round(sharpness, 1)
+    return None
+
+def analyse_frame(image_bytes: bytes, profile: str = None, multi: bool = False, hints=None, quality=None):
+    """
+    Decode, detect and encode one kiosk frame. Returns (result, timings) where timings
+    maps each FRAME_STAGES entry that ran to its duration in ms, and result is:
+      multi=False: the 128-d embedding, or None unless exactly one face is found
+      multi=True:  a list of ((top, right, bottom, left), encoding) with boxes in upload
+                   pixel coordinates, or None if the frame can't be decoded
+    Either way result is None when the face backend is unavailable.
+
+    hints (multi only) are the faces tracked from the kiosk's previous frame:
+    [{"box": (t, r, b, l), "skip_encode": bool}, ...] in upload coordinates. They are
+    searched for in their own regions first ("roi" in timings); if that works the result
+    lists exactly one face per hint, in hint order, and a face whose hint says
+    skip_encode and that barely moved comes back with encoding None. Otherwise a
+    full-frame scan runs as usual ("detect" in timings).
+
+    quality (see DEFAULT_QUALITY_GATE) turns on the frame-quality gate: a frame that is
+    too dark or bright, or whose face is too small or blurred, raises FrameRejected
+    instead of being encoded. In multi mode failing faces are just left out, and the
+    frame is only rejected if none pass. Faces found by the tracked-region search
+    skip the face checks.
+    """
+    timings = {}
+    backend = get_backend()
+    if not backend.available():
+        return None, timings
+    p = get_speed_profile(profile)
+
+    started = time.perf_counter()
+    decoded = decode_frame(image_bytes, p["decode"])
+    timings["decode"] = _ms_since(started)
+    if decoded is None:
+        return None, timings
+    im, arr, scale = decoded
+
+    if quality:
+        started = time.perf_counter()
+        brightness = frame_brightness(arr)
+        timings["quality"] = _ms_since(started)
+        if brightness < quality["min_brightness"]:
+            raise FrameRejected("too_dark", round(brightness, 1), timings)
+        if brightness > quality["max_brightness"]:
+            raise FrameRejected("too_bright", round(brightness, 1), timings)
+
+    try:
+        locs, reuse = None, set()
+        if multi and hints:
+            started = time.perf_counter()
+            tracked = [tuple(v / scale for v in hint["box"]) for hint in hints]
+            locs = _search_rois(im, arr, tracked, p["downscale"] // scale, p["upsample"])
+            if locs is not None:
+                timings["roi"] = _ms_since(started)
+                reuse = {i for i, hint in enumerate(hints)
+                         if hint.get("skip_encode") and box_iou(locs[i], tracked[i]) >= TRACK_IOU}
+        if locs is None:
+            started = time.perf_counter()
+            locs = _locate_faces(im, arr, p["downscale"] // scale, p["upsample"])
+            timings["detect"] = _ms_since(started)
+        if not locs:
+            return ([] if multi else None), timings
+        if not multi and len(locs) != 1:
+            return None, timings
+
+        if quality and "detect" in timings:
+            started = time.perf_counter()
+            problems = [_face_problem(im, box, scale, quality) for box in locs]
+            timings["quality"] = round(timings.get("quality", 0.0) + _ms_since(started), 2)
+            if all(problems):
+                raise FrameRejected(*problems[0], timings)
+            locs = [box for box, problem in zip(locs, problems) if problem is None]
+
+        todo = [i for i in range(len(locs)) if i not in reuse]
+        encs = [None] * len(locs)
+        if scale > 1:
+            # the draft decode was only for detection: faces are encoded from the full frame
+            shape = (arr.shape[0] * scale, arr.shape[1] * scale)
+            if todo:
+                started = time.perf_counter()
+                decoded = decode_frame(image_bytes)
+                timings["decode"] = round(timings["decode"] + _ms_since(started), 2)
+                if decoded is None:
+                    return None, timings
+                _, arr, _ = decoded
+                shape = arr.shape
+            locs = _scale_boxes(locs, scale, shape)
+        if todo:
+            started = time.perf_counter()
+            for i, enc in zip(todo, backend.encode_batch(arr, [locs[i] for i in todo],
+                                                         landmarks=p["landmarks"], jitters=p["jitters"])):
+                encs[i] = enc
+            timings["encode"] = _ms_since(started)
+    except FrameRejected:
+        raise
     except Exception:
-        return None
+        return None, timings
+
+    if not multi:
+        return (encs[0] if len(encs) == 1 else None), timings
+    return list(zip(locs, encs)), timings
+
+def chip_box(width, height):
+    """The face box inside a chip cropped with CHIP_MARGIN around it, (top, right, bottom, left)."""
+    mx = round(width * CHIP_MARGIN / (1 + 2 * CHIP_MARGIN))
+    my = round(height * CHIP_MARGIN / (1 + 2 * CHIP_MARGIN))
+    return (my, width - mx, height - my, mx)
+
+def analyse_chips(chips, profile: str = None, landmarks=None, quality=None):
+    """
+    Encode pre-cropped face chips (see CHIP_MARGIN) without running detection. Returns
+    (faces, timings) like analyse_frame with multi=True: a list of ((top, right, bottom,
+    left), encoding) with boxes in chip pixels, one per chip that decoded and passed the
+    quality gate; None when the face backend is unavailable. landmarks, if given, holds
+    one list of CHIP_LANDMARKS (x, y) points or None per chip.
+    A chip whose face fails the quality gate is left out; if every chip fails,
+    FrameRejected is raised for the first.
+    """
+    timings = {}
+    backend = get_backend()
+    if not backend.available():
+        return None, timings
+    p = get_speed_profile(profile)
+    landmarks = landmarks or [None] * len(chips)
+
+    started = time.perf_counter()
+    decoded = [decode_frame(chip) for chip in chips]
+    timings["decode"] = _ms_since(started)
+
+    todo, problems = [], []
+    if quality:
+        started = time.perf_counter()
+    for chip, points in zip(decoded, landmarks):
+        if chip is None:
+            continue
+        im, arr, _ = chip
+        box = chip_box(arr.shape[1], arr.shape[0])
+        if quality:
+            brightness = frame_brightness(arr)
+            if brightness < quality["min_brightness"]:
+                problems.append(("too_dark", round(brightness, 1)))
+                continue
+            if brightness > quality["max_brightness"]:
+                problems.append(("too_bright", round(brightness, 1)))
+                continue
+            problem = _face_problem(im, box, 1, quality)
+            if problem is not None:
+                problems.append(problem)
+                continue
+        todo.append((arr, box, points))
+    if quality:
+        timings["quality"] = _ms_since(started)
+        if problems and not todo:
+            raise FrameRejected(*problems[0], timings)
+
+    faces = []
+    if todo:
+        started = time.perf_counter()
+        try:
+            for arr, box, points in todo:
+                if points is not None and p["landmarks"] == "small":
+                    enc = backend.encode_aligned(arr, box, points, jitters=p["jitters"])
+                else:
+                    enc = backend.encode_batch(arr, [box], landmarks=p["landmarks"], jitters=p["jitters"])[0]
+                faces.append((box, enc))
+        except Exception:
+            return None, timings
+        timings["encode"] = _ms_since(started)
+    return faces, timings
+
+def analyse_frames(frames, analyse=analyse_frame):
+    """
+    analyse(*args) for each args tuple in `frames`, as one pool task for a batch of kiosk
+    frames. Each entry is its (result, timings), or the FrameRejected it raised.
+    """
+    out = []
+    for args in frames:
+        try:
+            out.append(analyse(*args))
+        except FrameRejected as e:
+            out.append(e)
+    return out
+
+def _ms_since(started):
+    return round((time.perf_counter() - started) * 1000, 2)
+
+def bytes_to_encoding(image_bytes: bytes, profile: str = None):
+    """
+    Convert a JPEG/PNG bytes blob (from webcam) into a 128-d face embedding.
+    Returns None if no *single* face is found or the face backend is unavailable.
+    """
+    return analyse_frame(image_bytes, profile)[0]
+
+def bytes_to_encodings(image_bytes: bytes, profile: str = None):
+    """
+    Multi-face variant of bytes_to_encoding: detect every face in the frame and
+    encode them all in one batched face_encodings call.
+    Returns a list of ((top, right, bottom, left), encoding), or None if the face
+    backend is unavailable or the frame can't be decoded.
+    """
+    return analyse_frame(image_bytes, profile, multi=True)[0]
 
 def face_distance(a, b) -> float:
     """
@@ -46,17 +379,19 @@ def face_distance(a, b) -> float:
     return float(np.linalg.norm(a - b))
 
 def image_to_encoding(img_path: str):
+    backend = get_backend()
+    if not backend.available():
+        return None
     try:
-        img = fr.load_image_file(img_path)
+        img = backend.load_image(img_path)
     except FileNotFoundError:
         return None
     
-    face_encodings = fr.face_encodings(img)
-
-    if len(face_encodings) == 0:
+    locs = backend.detect(img)
+    if len(locs) == 0:
         return None
 
-    return face_encodings[0]
+    return backend.encode(img, locs[0])
 
 def is_valid_email(email: str) -> bool:
     # This is a simple regular expression for emails. 
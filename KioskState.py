@@ -0,0 +1,434 @@
+import copy
+import io
+import threading
+import time
+from collections import OrderedDict, namedtuple
+import numpy as np
+from PIL import Image
+
+# only needed when PRESENT_SET_REDIS_URL is configured
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+def frame_hash(image_bytes: bytes):
+    """
+    64-bit difference hash (dHash) of a frame. JPEG draft mode decodes straight to a
+    tiny size, so this costs a fraction of a full decode. None if it can't be decoded.
+    """
+    try:
+        im = Image.open(io.BytesIO(image_bytes))
+        im.draft("L", (64, 64))
+        im = im.convert("L").resize((9, 8), Image.BILINEAR)
+    except Exception:
+        return None
+    px = np.asarray(im, dtype=np.int16)
+    bits = px[:, 1:] > px[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def replay_result(payload):
+    """
+    The version of a recognition result to hand back for a repeat frame: anyone it
+    matched was marked by the original request, so they now count as already marked.
+    """
+    payload = copy.deepcopy(payload)
+    payload["cached"] = True
+    payload.pop("timings_ms", None)
+    if "already_marked" in payload:
+        payload["already_marked"] = True
+    if "newly_marked" in payload:
+        payload["newly_marked"] = 0
+    for face in payload.get("faces", ()):
+        if "already_marked" in face:
+            face["already_marked"] = True
+    return payload
+
+
+class FrameCache:
+    """
+    Most recent frame hash and recognition result per kiosk. A near-identical frame
+    (dHash within max_distance bits) inside `window` seconds reuses that result
+    instead of running detection, encoding and the attendance upsert again.
+    """
+
+    def __init__(self, window=3.0, max_distance=4, max_kiosks=1024):
+        self.window = window
+        self.max_distance = max_distance
+        self.max_kiosks = max_kiosks
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, window=None, max_distance=None):
+        if window is not None:
+            self.window = window
+        if max_distance is not None:
+            self.max_distance = max_distance
+
+    def lookup(self, key, fhash, now=None):
+        """Return the (payload, status) stored for a near-identical recent frame, else None."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if (fhash is not None and entry is not None and now - entry[0] <= self.window
+                    and hamming(entry[1], fhash) <= self.max_distance):
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+            return None
+
+    def store(self, key, fhash, result, now=None):
+        if fhash is None:
+            return
+        now = time.monotonic() if now is None else now
+        payload, status = result
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (now, fhash, (replay_result(payload), status))
+            while len(self._entries) > self.max_kiosks:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": (self.hits / total) if total else 0.0,
+                    "kiosks": len(self._entries)}
+
+
+# one face followed from a kiosk's previous frame; student/distance only for a confident match
+Track = namedtuple("Track", ["box", "student", "distance"])
+
+
+class FaceTracker:
+    """
+    Faces seen in each kiosk's last frame, so the next frame can be searched around them
+    (Helpers.analyse_frame hints) instead of scanned in full. tracks() returns None, i.e.
+    "do a full scan", for every `full_scan_every`th frame, when the last frame is older
+    than `max_age` seconds, or when nothing is being tracked.
+    Confident identities (distance <= confident_distance) are only reused while the
+    class gallery generation they were matched against is current.
+    """
+
+    def __init__(self, full_scan_every=4, max_age=3.0, confident_distance=0.45, max_kiosks=1024):
+        self.full_scan_every = full_scan_every
+        self.max_age = max_age
+        self.confident_distance = confident_distance
+        self.max_kiosks = max_kiosks
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.tracked_frames = 0
+        self.full_scans = 0
+
+    def configure(self, full_scan_every=None, max_age=None, confident_distance=None):
+        if full_scan_every is not None:
+            self.full_scan_every = full_scan_every
+        if max_age is not None:
+            self.max_age = max_age
+        if confident_distance is not None:
+            self.confident_distance = confident_distance
+
+    def tracks(self, key, generation, now=None):
+        """Tracks to search for in this kiosk's next frame, or None for a full-frame scan."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is None or now - entry["seen"] > self.max_age
+                    or entry["since_full"] + 1 >= self.full_scan_every):
+                return None
+            if entry["generation"] != generation:
+                return [Track(t.box, None, None) for t in entry["tracks"]]
+            return list(entry["tracks"])
+
+    def update(self, key, generation, faces, full_scan, now=None):
+        """Record the faces of a recognition payload ("faces" of a multi-face result)."""
+        now = time.monotonic() if now is None else now
+        tracks = []
+        for face in faces or ():
+            box = face["box"]
+            confident = face.get("status") == "matched" and face["distance"] <= self.confident_distance
+            tracks.append(Track((box["top"], box["right"], box["bottom"], box["left"]),
+                                face["matched_student"] if confident else None,
+                                face["distance"] if confident else None))
+        with self._lock:
+            if full_scan:
+                self.full_scans += 1
+            else:
+                self.tracked_frames += 1
+            previous = self._entries.pop(key, None)
+            if not tracks:
+                return
+            since_full = 0 if full_scan or previous is None else previous["since_full"] + 1
+            self._entries[key] = {"tracks": tracks, "generation": generation, "seen": now, "since_full": since_full}
+            while len(self._entries) > self.max_kiosks:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.tracked_frames = 0
+            self.full_scans = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.tracked_frames + self.full_scans
+            return {"tracked_frames": self.tracked_frames, "full_scans": self.full_scans,
+                    "tracked_rate": (self.tracked_frames / total) if total else 0.0,
+                    "kiosks": len(self._entries)}
+
+
+class PresentSet:
+    """
+    Students already marked present, per (class_id, date). The first lookup for a
+    class on a given day loads it from the DB; after that repeat recognitions are
+    answered from memory. Keys from earlier days are dropped as soon as a new day
+    is seen, so the set rolls over at midnight on its own.
+    """
+
+    def __init__(self):
+        self._sets = {}
+        self._day = None
+        self._lock = threading.Lock()
+
+    def members(self, class_id, day, load):
+        """Present student ids for class_id on day; load() -> iterable of ids warms a cold entry."""
+        with self._lock:
+            self._roll(day)
+            present = self._sets.get(class_id)
+            if present is not None:
+                return frozenset(present)
+        loaded = set(load())
+        with self._lock:
+            self._roll(day)
+            present = self._sets.setdefault(class_id, set())
+            present.update(loaded)
+            return frozenset(present)
+
+    def add(self, class_id, day, student_ids):
+        with self._lock:
+            self._roll(day)
+            # only extend a warmed entry: a cold one will be loaded with these rows anyway
+            if class_id in self._sets:
+                self._sets[class_id].update(student_ids)
+
+    def clear(self):
+        with self._lock:
+            self._sets.clear()
+            self._day = None
+
+    def _roll(self, day):
+        if self._day != day:
+            self._sets.clear()
+            self._day = day
+
+
+class RedisPresentSet:
+    """PresentSet shared between workers through Redis sets that expire after a day and a half."""
+
+    TTL = 36 * 60 * 60
+
+    def __init__(self, url, prefix="attendu:present"):
+        self._redis = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def _key(self, class_id, day):
+        return f"{self._prefix}:{day.isoformat()}:{class_id}"
+
+    def members(self, class_id, day, load):
+        key = self._key(class_id, day)
+        warm = key + ":warm"
+        if not self._redis.exists(warm):
+            ids = list(load())
+            pipe = self._redis.pipeline()
+            if ids:
+                pipe.sadd(key, *ids)
+            pipe.set(warm, 1, ex=self.TTL)
+            pipe.expire(key, self.TTL)
+            pipe.execute()
+        return frozenset(int(x) for x in self._redis.smembers(key))
+
+    def add(self, class_id, day, student_ids):
+        student_ids = list(student_ids)
+        if student_ids:
+            key = self._key(class_id, day)
+            pipe = self._redis.pipeline()
+            pipe.sadd(key, *student_ids)
+            pipe.expire(key, self.TTL)
+            pipe.execute()
+
+    def clear(self):
+        pass
+
+
+class KioskPacing:
+    """
+    Suggested wait before each kiosk's next capture (next_capture_ms in its results), so
+    kiosks send frames in step with foot traffic instead of on a fixed timer:
+
+    - someone was just marked: min_ms, the next person is probably right behind them
+    - a face is in view: base_ms
+    - nobody there: from base_ms up to max_ms as the kiosk's quiet rate rises, an
+      exponential average of its frames that were repeat-frame cache hits or faceless
+
+    The result is stretched by up to 1 + busy_factor when the recognition pool is full
+    (load 0..1) and kept within [min_ms, max_ms].
+    """
+
+    def __init__(self, min_ms=500, base_ms=2000, max_ms=8000, busy_factor=3.0, smoothing=0.3, max_kiosks=1024):
+        self.min_ms = min_ms
+        self.base_ms = base_ms
+        self.max_ms = max_ms
+        self.busy_factor = busy_factor
+        self.smoothing = smoothing
+        self.max_kiosks = max_kiosks
+        self._quiet = OrderedDict()
+        self._lock = threading.Lock()
+        self.suggestions = 0
+        self.total_ms = 0
+
+    def configure(self, min_ms=None, base_ms=None, max_ms=None, busy_factor=None):
+        if min_ms is not None:
+            self.min_ms = min_ms
+        if base_ms is not None:
+            self.base_ms = base_ms
+        if max_ms is not None:
+            self.max_ms = max_ms
+        if busy_factor is not None:
+            self.busy_factor = busy_factor
+
+    def suggest(self, key, face_present, repeat, arrivals, load=0.0):
+        """Record one result for kiosk `key` and return the delay (ms) before its next frame."""
+        quiet_frame = 1.0 if (repeat or not face_present) else 0.0
+        with self._lock:
+            quiet = self._quiet.pop(key, 0.0)
+            quiet += self.smoothing * (quiet_frame - quiet)
+            self._quiet[key] = quiet
+            while len(self._quiet) > self.max_kiosks:
+                self._quiet.popitem(last=False)
+
+            if arrivals:
+                delay = self.min_ms
+            elif face_present:
+                delay = self.base_ms
+            else:
+                delay = self.base_ms + (self.max_ms - self.base_ms) * quiet
+            delay *= 1.0 + self.busy_factor * load
+            delay = int(min(self.max_ms, max(self.min_ms, delay)))
+            self.suggestions += 1
+            self.total_ms += delay
+        return delay
+
+    def clear(self):
+        with self._lock:
+            self._quiet.clear()
+            self.suggestions = 0
+            self.total_ms = 0
+
+    def stats(self):
+        with self._lock:
+            return {"kiosks": len(self._quiet), "suggestions": self.suggestions,
+                    "mean_next_capture_ms": (self.total_ms / self.suggestions) if self.suggestions else 0.0,
+                    "min_ms": self.min_ms, "base_ms": self.base_ms, "max_ms": self.max_ms}
+
+
+class KioskDevices:
+    """
+    Snapshot of the kiosk device tokens still in force and the speed profile of every
+    class they cover, so a device's requests are authorised without a query each.
+    load() -> (active device ids, {class_id: speed_profile}) refreshes it once it is
+    `refresh` seconds old, or sooner for an unknown device (one issued by another
+    worker), but at most every `min_reload` seconds so revoked tokens can't force a
+    query per request. Revocations elsewhere take effect here within `refresh` seconds.
+    """
+
+    def __init__(self, refresh=30.0, min_reload=1.0):
+        self.refresh = refresh
+        self.min_reload = min_reload
+        self._devices = frozenset()
+        self._profiles = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def configure(self, refresh=None, min_reload=None):
+        if refresh is not None:
+            self.refresh = refresh
+        if min_reload is not None:
+            self.min_reload = min_reload
+
+    def _reload(self, load, now, unknown=False):
+        with self._lock:
+            loaded_at = self._loaded_at
+        if loaded_at is not None:
+            age = now - loaded_at
+            if age < self.min_reload or (age < self.refresh and not unknown):
+                return
+        devices, profiles = load()
+        with self._lock:
+            self._devices = frozenset(devices)
+            self._profiles = dict(profiles)
+            self._loaded_at = now
+            self.reloads += 1
+
+    def is_active(self, device_id, load, now=None):
+        now = time.monotonic() if now is None else now
+        self._reload(load, now)
+        if device_id in self._devices:
+            return True
+        self._reload(load, now, unknown=True)
+        return device_id in self._devices
+
+    def class_profile(self, class_id):
+        """(class still exists, its speed_profile) as of the last reload."""
+        with self._lock:
+            if class_id not in self._profiles:
+                return False, None
+            return True, self._profiles[class_id]
+
+    def revoke(self, device_id):
+        with self._lock:
+            self._devices = self._devices - {device_id}
+
+    def invalidate(self):
+        """Reload on the next lookup (a device was issued or a class setting changed here)."""
+        with self._lock:
+            self._loaded_at = None
+
+    def clear(self):
+        with self._lock:
+            self._devices = frozenset()
+            self._profiles = {}
+            self._loaded_at = None
+            self.reloads = 0
+
+    def stats(self):
+        with self._lock:
+            return {"devices": len(self._devices), "classes": len(self._profiles), "reloads": self.reloads}
+
+
+def make_present_set(redis_url=None):
+    if redis_url:
+        if redis is None:
+            raise RuntimeError("PRESENT_SET_REDIS_URL is set but the redis package is not installed")
+        return RedisPresentSet(redis_url)
+    return PresentSet()
+
+
+frame_cache = FrameCache()
+face_tracker = FaceTracker()
+kiosk_devices = KioskDevices()
+kiosk_pacing = KioskPacing()
@@ -1,15 +1,59 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, LargeBinary
+from sqlalchemy import Column, Integer, String, ForeignKey, LargeBinary, event, inspect, or_
 from sqlalchemy.orm import relationship, Session
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql.schema import Table, UniqueConstraint
-from sqlalchemy.sql.sqltypes import Date, Boolean, PickleType
+from sqlalchemy.sql.sqltypes import Date, DateTime, Boolean
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.exc import SQLAlchemyError
 from flask_login import UserMixin
-from Helpers import image_to_encoding, generate_class_code
-import bcrypt, string, random
+from Helpers import image_to_encoding, generate_class_code, encoder_version
+from Gallery import gallery_cache
+from GalleryStore import gallery_store
+from FaceIndex import face_index
+from Recognition import recognition_pool, RecognitionBusy
+import bcrypt, string, random, pickle
+import numpy as np
 
 Base = declarative_base()
 
+
+class FaceVector(TypeDecorator):
+    """
+    128-d embedding stored as 512 raw little-endian float32 bytes.
+    Rows written by the old PickleType column are still readable and are
+    rewritten in the compact form by `flask migrate-face-vectors`.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    DIM = 128
+    DTYPE = np.dtype('<f4')
+    NBYTES = DIM * 4
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        arr = np.asarray(value, dtype=self.DTYPE)
+        if arr.shape != (self.DIM,):
+            raise ValueError(f"face vector must have shape ({self.DIM},), got {arr.shape}")
+        return arr.tobytes()
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return self.decode(value)
+
+    @classmethod
+    def decode(cls, value):
+        if len(value) == cls.NBYTES:
+            # zero-copy, read-only view over the row bytes
+            return np.frombuffer(value, dtype=cls.DTYPE)
+        return np.asarray(pickle.loads(value), dtype=cls.DTYPE)
+
+    @classmethod
+    def is_legacy(cls, value):
+        return value is not None and len(value) != cls.NBYTES
+
 student_class_association = Table('student_class', Base.metadata,
     Column('student_id', Integer, ForeignKey('students.id', ondelete='CASCADE')),
     Column('class_id', Integer, ForeignKey('classes.id', ondelete='CASCADE'))
@@ -85,7 +129,9 @@ class Class(Base):
     students = relationship('Student', secondary=student_class_association, back_populates='classes')
     attendances = relationship('Attendance', back_populates='_class')
     class_code = Column(String(50), nullable=False, unique=True)
+    speed_profile = Column(String(20), nullable=True)   # Helpers.SPEED_PROFILES key, None = server default
     requests = relationship('ConnectionRequest', back_populates='class_', foreign_keys='ConnectionRequest.class_id', cascade="all, delete-orphan")
+    attendance_sessions = relationship('AttendanceSession', back_populates='class_', cascade="all, delete-orphan")
 
     def __init__(self, *args, **kwargs):
         super(Class, self).__init__(*args, **kwargs)
@@ -142,6 +188,73 @@ class Attendance(Base):
     __table_args__ = (UniqueConstraint('date', 'student_id', 'class_id', name='uq_attendance_day_student_class'),)
 
 
+class AttendanceSession(Base):
+    """
+    A teacher-opened window in which kiosks may mark attendance for a class (see
+    ATTENDANCE_REQUIRE_SESSION). Closing it, or it running past ends_at, records
+    everyone on the roster who wasn't marked as absent for that day.
+    """
+    __tablename__ = 'attendance_sessions'
+
+    id = Column(Integer, primary_key=True)
+    class_id = Column(Integer, ForeignKey('classes.id', ondelete='CASCADE'), index=True, nullable=False)
+    opened_by = Column(Integer, ForeignKey('teachers.id', ondelete='SET NULL'), nullable=True)
+    starts_at = Column(DateTime, nullable=False)
+    ends_at = Column(DateTime, nullable=False)
+    closed_at = Column(DateTime, nullable=True)
+    absent_marked = Column(Integer, nullable=True)   # absent rows written when it closed
+
+    class_ = relationship('Class', back_populates='attendance_sessions')
+
+    def is_open(self, now):
+        return self.closed_at is None and self.starts_at <= now < self.ends_at
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "class_id": self.class_id,
+            "starts_at": self.starts_at.isoformat(timespec="seconds"),
+            "ends_at": self.ends_at.isoformat(timespec="seconds"),
+            "closed_at": self.closed_at.isoformat(timespec="seconds") if self.closed_at else None,
+            "absent_marked": self.absent_marked,
+        }
+
+
+class KioskDevice(Base):
+    """
+    A kiosk signed in with its own device token rather than a teacher's login. The token
+    claims carry the device id and the classes it may mark, so kiosk requests are
+    authorised without a query; this row is what the teacher lists and revokes.
+    """
+    __tablename__ = 'kiosk_devices'
+
+    id = Column(Integer, primary_key=True)
+    teacher_id = Column(Integer, ForeignKey('teachers.id', ondelete='CASCADE'), index=True, nullable=False)
+    name = Column(String(100), nullable=False)
+    class_ids = Column(String(255), nullable=False)     # comma separated, as issued in the token
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, nullable=True)
+
+    @property
+    def classes(self):
+        return [int(x) for x in self.class_ids.split(',') if x]
+
+    def is_active(self, now):
+        return self.revoked_at is None and now < self.expires_at
+
+    def to_dict(self, now):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "class_ids": self.classes,
+            "created_at": self.created_at.isoformat(timespec="seconds"),
+            "expires_at": self.expires_at.isoformat(timespec="seconds"),
+            "revoked_at": self.revoked_at.isoformat(timespec="seconds") if self.revoked_at else None,
+            "active": self.is_active(now),
+        }
+
+
 class Teacher(User):
     __tablename__ = "teachers"
 
@@ -285,11 +398,18 @@ class Parent(User):
             session.rollback()
             raise
 
+# Student.face_status: enrollment state of the face embedding (None on rows from before it existed)
+FACE_PENDING = 'pending'
+FACE_READY = 'ready'
+FACE_FAILED = 'failed'
+
 class Student(User):
     __tablename__ = "students"
 
     id = Column(Integer, ForeignKey('users.id'), primary_key=True)
-    face_vector = Column(PickleType, nullable=True)
+    face_vector = Column(FaceVector, nullable=True)
+    face_encoder_version = Column(Integer, nullable=True)
+    face_status = Column(String(20), nullable=True)
     classes = relationship('Class', secondary=student_class_association, back_populates='students')
     parents = relationship('Parent', secondary=parent_student_association, back_populates='children')
     attendances = relationship('Attendance', back_populates='student')
@@ -298,14 +418,21 @@ class Student(User):
         'polymorphic_identity':'student',
     }
 
-    def __init__(self, name, email, password, image=None) -> None:
+    def __init__(self, name, email, password, image=None, encode=True) -> None:
         super().__init__(name, email, password, image)
         if self.image:
+            if not encode:
+                # Enrollment.enrollment_queue computes it once the student is committed
+                self.mark_face_pending()
+                return
             try:
                 self._update_face_vector()
+            except RecognitionBusy:
+                raise
             except Exception:
                 # skip if encoding unavailable or fails
                 self.face_vector = None
+                self.face_status = FACE_FAILED
     
     def join_class(self, session: Session, class_id: int):
         try:
@@ -337,7 +464,7 @@ class Student(User):
             session.rollback()
             raise
 
-    def update_profile(self, session: Session, name=None, email=None, image=None):
+    def update_profile(self, session: Session, name=None, email=None, image=None, encode=True):
         try:
             if name:
                 self.name = name
@@ -345,18 +472,122 @@ class Student(User):
                 self.email = email
             if image:
                 self.image = image
-                try:
-                    self._update_face_vector()
-                except Exception:
-                    self.face_vector = None
+                if not encode:
+                    self.mark_face_pending()
+                else:
+                    try:
+                        self._update_face_vector()
+                    except RecognitionBusy:
+                        raise
+                    except Exception:
+                        self.face_vector = None
+                        self.face_status = FACE_FAILED
             session.commit()
         except SQLAlchemyError:
             session.rollback()
             raise
     
     def _update_face_vector(self):
-        encoding = image_to_encoding(self.image)
+        # dlib work runs in the recognition pool, not the request thread
+        encoding = recognition_pool.run(image_to_encoding, self.image)
         if encoding is not None:
             self.face_vector = encoding
+            self.face_encoder_version = encoder_version()
+            self.face_status = FACE_READY
         else:
             raise ValueError("Image encoding failed")
+
+    def mark_face_pending(self):
+        # the old embedding belongs to the old photo, so the student stays out of
+        # class galleries until the new one has been computed
+        self.face_vector = None
+        self.face_encoder_version = None
+        self.face_status = FACE_PENDING
+
+    @property
+    def enrollment_status(self):
+        if self.face_status:
+            return self.face_status
+        if self.face_vector is not None:
+            return FACE_READY
+        return FACE_FAILED if self.image else None
+
+
+
+# Keep cached class galleries in step with the roster. Everything that changes a gallery
+# (add/remove_student, join/leave_class, a new face_vector, name/email edits, deleting a
+# user or class) goes through a flush, so we collect the affected class ids there and
+# drop them from the cache once the transaction actually commits.
+def _touched_class_ids(session):
+    class_ids = set()
+    with session.no_autoflush:
+        for obj in session.deleted:
+            if isinstance(obj, Class):
+                class_ids.add(obj.id)
+            elif isinstance(obj, Student):
+                class_ids.update(c.id for c in obj.classes)
+            elif isinstance(obj, Teacher):
+                class_ids.update(c.id for c in obj.classes)
+        for obj in session.dirty:
+            state = inspect(obj)
+            if isinstance(obj, Class):
+                if state.attrs.students.history.has_changes():
+                    class_ids.add(obj.id)
+            elif isinstance(obj, Student):
+                history = state.attrs.classes.history
+                class_ids.update(c.id for c in (history.added or ()))
+                class_ids.update(c.id for c in (history.deleted or ()))
+                if any(state.attrs[key].history.has_changes() for key in ('face_vector', 'face_status', 'name', 'email')):
+                    class_ids.update(c.id for c in obj.classes)
+        for obj in session.new:
+            if isinstance(obj, Student):
+                class_ids.update(c.id for c in obj.classes)
+    class_ids.discard(None)
+    return class_ids
+
+@event.listens_for(Session, "before_flush")
+def _collect_gallery_changes(session, flush_context, instances):
+    session.info.setdefault('gallery_dirty', set()).update(_touched_class_ids(session))
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_galleries(session):
+    for class_id in session.info.pop('gallery_dirty', ()):
+        gallery_cache.invalidate(class_id)
+        gallery_store.invalidate(class_id)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_gallery_changes(session):
+    session.info.pop('gallery_dirty', None)
+
+
+# The school-wide FaceIndex follows the same pattern: note each touched student's
+# embedding at flush time (None = drop it from the index, e.g. deleted or pending a
+# new photo) and apply the changes once the transaction commits.
+def indexed_embeddings(session):
+    """(student_id, face_vector) for every student who belongs in the FaceIndex."""
+    return (session.query(Student.id, Student.face_vector)
+            .filter(Student.face_vector.isnot(None),
+                    or_(Student.face_status.is_(None), Student.face_status != FACE_PENDING))
+            .all())
+
+@event.listens_for(Session, "after_flush")
+def _collect_face_index_changes(session, flush_context):
+    changes = session.info.setdefault('face_index_changes', {})
+    for obj in session.deleted:
+        if isinstance(obj, Student):
+            changes[obj.id] = None
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Student):
+            state = inspect(obj)
+            if obj in session.new or any(state.attrs[key].history.has_changes() for key in ('face_vector', 'face_status')):
+                changes[obj.id] = obj.face_vector if obj.face_status != FACE_PENDING else None
+
+@event.listens_for(Session, "after_commit")
+def _update_face_index(session):
+    changes = session.info.pop('face_index_changes', None)
+    if changes:
+        face_index.apply(changes)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_face_index_changes(session):
+    session.info.pop('face_index_changes', None)
@@ -0,0 +1,315 @@
+import atexit
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from FaceBackends import get_backend, use_backend
+
+
+class RecognitionBusy(Exception):
+    """Raised when the recognition pool's queue is full; callers should retry later."""
+
+    def __init__(self, retry_after=1):
+        super().__init__("Recognition queue is full")
+        self.retry_after = retry_after
+
+
+def _init_worker(backend_name):
+    # Importing Helpers pulls in face_recognition, which loads the dlib detector,
+    # landmark and encoder models. Doing it here means once per pool process
+    # instead of once per task.
+    import Helpers  # noqa: F401
+    use_backend(backend_name)
+
+
+class RecognitionPool:
+    """
+    Dedicated process pool for face detection/encoding, so dlib work never runs in
+    (or blocks) the Flask request thread. At most `max_pending` tasks may be queued
+    or running; beyond that submit() raises RecognitionBusy.
+
+    workers=0 runs tasks inline in the calling thread (tests, dev without a pool).
+    """
+
+    def __init__(self, workers=2, max_pending=8, timeout=10.0, retry_after=1):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def configure(self, workers=None, max_pending=None, timeout=None, retry_after=None):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            if workers is not None:
+                self.workers = workers
+            if max_pending is not None:
+                self.max_pending = max_pending
+                self._slots = threading.BoundedSemaphore(max_pending)
+            if timeout is not None:
+                self.timeout = timeout
+            if retry_after is not None:
+                self.retry_after = retry_after
+
+    @property
+    def pending(self):
+        """Tasks currently queued or running in the pool."""
+        return self._pending
+
+    @property
+    def load(self):
+        """pending / max_pending: 0 when idle (or inline), 1 when the next submit() would be refused."""
+        if self.workers == 0 or not self.max_pending:
+            return 0.0
+        return min(1.0, self._pending / self.max_pending)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                     initargs=(get_backend().name,))
+            return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args) on the pool and return its Future, or raise RecognitionBusy."""
+        if self.workers == 0:
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise RecognitionBusy(self.retry_after)
+        with self._lock:
+            self._pending += 1
+
+        def _release(_):
+            with self._lock:
+                self._pending -= 1
+            slots.release()
+
+        try:
+            future = self._get_executor().submit(fn, *args, **kwargs)
+        except Exception:
+            _release(None)
+            raise
+        future.add_done_callback(_release)
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        """Run fn(*args) on the pool and wait for its result (inline when workers == 0)."""
+        if self.workers == 0:
+            return fn(*args, **kwargs)
+        future = self.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise RecognitionBusy(self.retry_after)
+
+    def run_batch(self, fn, items, *args):
+        """
+        Run fn(chunk, *args) -> list over `items`, split into one chunk per worker so a
+        batch still uses the whole pool, and return the concatenated results in order.
+        """
+        if self.workers == 0 or len(items) <= 1:
+            return self.run(fn, items, *args)
+        n = min(self.workers, len(items))
+        size = -(-len(items) // n)
+        futures = [self.submit(fn, items[i:i + size], *args) for i in range(0, len(items), size)]
+        out = []
+        try:
+            for future in futures:
+                out.extend(future.result(timeout=self.timeout))
+        except FutureTimeout:
+            raise RecognitionBusy(self.retry_after)
+        return out
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+class _BatchSlot:
+    __slots__ = ("item", "done", "result", "error")
+
+    def __init__(self, item):
+        self.item = item
+        self.done = False
+        self.result = None
+        self.error = None
+
+
+class FrameBatcher:
+    """
+    Micro-batching for concurrent recognition requests. run() queues an item; the first
+    caller with nothing in flight becomes the leader, waits up to `window_ms` for more
+    (or until `max_batch` are queued), and runs execute(items) -> results for all of
+    them while the others wait for theirs. An Exception in the results is raised in
+    that item's caller; one raised by execute() is raised in every caller of the batch.
+
+    window_ms=0 (or max_batch=1) disables batching: run() just calls execute([item]).
+    Batch sizes are counted for stats().
+    """
+
+    def __init__(self, window_ms=0, max_batch=16):
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._queue = []
+        self._leading = False
+        self._sizes = {}
+
+    def configure(self, window_ms=None, max_batch=None):
+        with self._cond:
+            if window_ms is not None:
+                self.window_ms = window_ms
+            if max_batch is not None:
+                self.max_batch = max(1, max_batch)
+
+    @property
+    def enabled(self):
+        return self.window_ms > 0 and self.max_batch > 1
+
+    def run(self, item, execute):
+        slot = _BatchSlot(item)
+        if not self.enabled:
+            self._run([slot], execute)
+            return self._result(slot)
+
+        with self._cond:
+            self._queue.append(slot)
+            if len(self._queue) >= self.max_batch:
+                self._cond.notify_all()
+        while True:
+            with self._cond:
+                while not slot.done and self._leading:
+                    self._cond.wait()
+                if slot.done:
+                    break
+                self._leading = True
+                deadline = time.monotonic() + self.window_ms / 1000.0
+                while len(self._queue) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._queue[:self.max_batch]
+                del self._queue[:self.max_batch]
+            try:
+                self._run(batch, execute)
+            finally:
+                with self._cond:
+                    self._leading = False
+                    self._cond.notify_all()
+            # the queue is FIFO, so our slot may have been left for the next batch
+        return self._result(slot)
+
+    def _run(self, batch, execute):
+        try:
+            results = execute([s.item for s in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for s, result in zip(batch, results):
+            if isinstance(result, Exception):
+                s.error = result
+            else:
+                s.result = result
+            s.done = True
+        with self._cond:
+            self._sizes[len(batch)] = self._sizes.get(len(batch), 0) + 1
+
+    @staticmethod
+    def _result(slot):
+        if slot.error is not None:
+            raise slot.error
+        return slot.result
+
+    def clear(self):
+        with self._cond:
+            self._sizes.clear()
+
+    def stats(self):
+        with self._cond:
+            batches = sum(self._sizes.values())
+            frames = sum(size * n for size, n in self._sizes.items())
+            return {"window_ms": self.window_ms, "max_batch": self.max_batch,
+                    "batches": batches, "frames": frames,
+                    "mean_batch_size": (frames / batches) if batches else 0.0,
+                    "batch_sizes": {str(size): self._sizes[size] for size in sorted(self._sizes)}}
+
+
+class StageTimings:
+    """Running count / mean / max of per-stage frame timings (ms), for /api/recognition/stats."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, timings):
+        with self._lock:
+            for stage, ms in timings.items():
+                count, total, peak = self._stages.get(stage, (0, 0.0, 0.0))
+                self._stages[stage] = (count + 1, total + ms, max(peak, ms))
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+
+    def stats(self):
+        with self._lock:
+            return {stage: {"count": count, "mean_ms": round(total / count, 2), "max_ms": peak}
+                    for stage, (count, total, peak) in self._stages.items()}
+
+
+class FrameQuality:
+    """Per-class count of kiosk frames and of frame-quality gate rejections by reason."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._classes = {}
+
+    def record(self, class_id, reason=None):
+        """Count one frame for class_id; reason is the rejection reason, None if it passed."""
+        with self._lock:
+            counts = self._classes.setdefault(class_id, {"frames": 0, "rejected": {}})
+            counts["frames"] += 1
+            if reason is not None:
+                counts["rejected"][reason] = counts["rejected"].get(reason, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._classes.clear()
+
+    def stats(self, class_id=None):
+        """One class's counts, or totals across every class when class_id is None."""
+        with self._lock:
+            if class_id is not None:
+                selected = [self._classes.get(class_id, {"frames": 0, "rejected": {}})]
+            else:
+                selected = list(self._classes.values())
+            frames = sum(c["frames"] for c in selected)
+            rejected = {}
+            for c in selected:
+                for reason, n in c["rejected"].items():
+                    rejected[reason] = rejected.get(reason, 0) + n
+        out = {"frames": frames, "rejected": rejected,
+               "rejection_rate": (sum(rejected.values()) / frames) if frames else 0.0}
+        if class_id is None:
+            out["classes"] = len(selected)
+        return out
+
+
+recognition_pool = RecognitionPool()
+frame_batcher = FrameBatcher()
+stage_timings = StageTimings()
+frame_quality = FrameQuality()
+atexit.register(recognition_pool.shutdown)
@@ -7,10 +7,18 @@ from Models import (Base, Teacher, Class, User,
                     Student, Parent, ConnectionRequest, 
                     student_class_association, 
                     parent_student_association,
-                    Attendance)
-from Helpers import (is_valid_email, bytes_to_encoding, face_distance,
-                    FACE_ENABLED)
-from datetime import timedelta
+                    Attendance, AttendanceSession, KioskDevice, FACE_PENDING, indexed_embeddings)
+from Helpers import (is_valid_email, analyse_frame, analyse_frames, analyse_chips, FrameRejected, REJECT_REASONS,
+                    CHIP_LANDMARKS,
+                    face_enabled, use_backend, encoder_version, SPEED_PROFILES)
+from Gallery import Gallery, Match, MATCH_THRESHOLD, GALLERY_PRECISIONS, gallery_cache
+from FaceIndex import face_index
+from GalleryStore import gallery_store
+from Recognition import recognition_pool, RecognitionBusy, stage_timings, frame_quality, frame_batcher
+from Commands import register_commands
+from Enrollment import enrollment_queue
+from KioskState import frame_cache, frame_hash, face_tracker, make_present_set, kiosk_devices, kiosk_pacing
+from datetime import datetime, timedelta
 from flask_cors import CORS
 from flask_jwt_extended import (
     JWTManager, create_refresh_token,
@@ -18,13 +26,24 @@ from flask_jwt_extended import (
     create_access_token, verify_jwt_in_request,
     decode_token)
 import bcrypt
+import io
+import json
+import math
 import os
+import time
 import imghdr
+from collections import namedtuple
 from functools import wraps
 from config import CORS_ORIGIN
 from datetime import date
 import numpy as np
-from sqlalchemy import and_
+from sqlalchemy import and_, or_
+
+# optional: kiosks fall back to per-frame POSTs without it
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
 
 app = Flask(__name__)
 cfg_name = os.getenv("FLASK_CONFIG", "Production")
@@ -42,7 +61,12 @@ TOKEN_BLOCKLIST = set()
 
 @jwt.token_in_blocklist_loader
 def check_if_token_revoked(jwt_headers, jwt_payload):
-    return jwt_payload.get("jti") in TOKEN_BLOCKLIST
+    if jwt_payload.get("jti") in TOKEN_BLOCKLIST:
+        return True
+    # kiosk device tokens are revoked per device, across workers (see KioskState.KioskDevices)
+    if jwt_payload.get("role") == "kiosk":
+        return not kiosk_devices.is_active(jwt_payload.get("device"), load_kiosk_devices)
+    return False
 
 @jwt.unauthorized_loader
 def _unauth(msg):
@@ -95,17 +119,104 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 # limit the maximum file size to 1MB
 app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024  # 2 MB
 
+##### GALLERY CACHE #####
+
+gallery_cache.configure(max_bytes=app.config.get('GALLERY_CACHE_MAX_BYTES'))
+# per-class gallery files the workers memory-map instead of each building its own copy
+gallery_store.configure(directory=app.config.get('GALLERY_STORE_DIR'))
+
+if app.config.get('GALLERY_PRECISION', 'float32') not in GALLERY_PRECISIONS:
+    raise ValueError(f"GALLERY_PRECISION must be one of {', '.join(GALLERY_PRECISIONS)}")
+
+##### FACE INDEX #####
+
+face_index.configure(nlist=app.config.get('FACE_INDEX_LISTS'),
+                     nprobe=app.config.get('FACE_INDEX_PROBES'),
+                     sync_seconds=app.config.get('FACE_INDEX_SYNC_SECONDS'))
+
+##### KIOSK FRAME CACHE #####
+
+frame_cache.configure(window=app.config.get('FRAME_CACHE_WINDOW_SECONDS'),
+                      max_distance=app.config.get('FRAME_CACHE_MAX_DISTANCE'))
+
+##### FACE TRACKING #####
+
+face_tracker.configure(full_scan_every=app.config.get('TRACKER_FULL_SCAN_EVERY'),
+                       max_age=app.config.get('TRACKER_MAX_AGE_SECONDS'),
+                       confident_distance=app.config.get('TRACKER_CONFIDENT_DISTANCE'))
+
+##### KIOSK PACING #####
+
+# suggested delay before each kiosk's next frame, returned with its results
+kiosk_pacing.configure(**app.config.get('KIOSK_PACING', {}))
+
+##### PRESENT SET #####
+
+# who is already marked today, per class (shared through Redis when configured)
+present_set = make_present_set(app.config.get('PRESENT_SET_REDIS_URL'))
+
+##### RECOGNITION POOL #####
+
+use_backend(app.config.get('FACE_BACKEND', 'dlib'))
+
+recognition_pool.configure(
+    workers=app.config.get('RECOGNITION_WORKERS'),
+    max_pending=app.config.get('RECOGNITION_QUEUE_SIZE'),
+    timeout=app.config.get('RECOGNITION_TIMEOUT_SECONDS'),
+    retry_after=app.config.get('RECOGNITION_RETRY_AFTER_SECONDS'))
+
+frame_batcher.configure(
+    window_ms=app.config.get('RECOGNITION_BATCH_WINDOW_MS', 0),
+    max_batch=app.config.get('RECOGNITION_MAX_BATCH', 16))
+
+@app.errorhandler(RecognitionBusy)
+def _recognition_busy(e):
+    resp = jsonify({"status": "error", "message": "Recognition server busy, retry shortly",
+                    "retry_after": e.retry_after, "code": 503})
+    resp.headers['Retry-After'] = str(e.retry_after)
+    return resp, 503
+
 ##### SQLALCHEMY #####
 # Create the SQLAlchemy engine
 engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+##### ENROLLMENT #####
+
+# face encodings for new/updated student photos are computed off the request thread
+enrollment_queue.configure(session_factory=SessionLocal,
+                           threads=app.config.get('ENROLLMENT_THREADS'))
+
+##### KIOSK DEVICES #####
+
+kiosk_devices.configure(refresh=app.config.get('KIOSK_DEVICE_REFRESH_SECONDS'))
+
+def load_kiosk_devices():
+    """(ids of the device tokens in force, {class_id: speed_profile} of the classes they cover)."""
+    now = datetime.now()
+    devices = (g.session.query(KioskDevice.id, KioskDevice.class_ids)
+               .join(Teacher, Teacher.id == KioskDevice.teacher_id)
+               .filter(KioskDevice.revoked_at.is_(None), KioskDevice.expires_at > now)
+               .all())
+    class_ids = {int(x) for _, ids in devices for x in ids.split(',') if x}
+    profiles = {}
+    if class_ids:
+        profiles = dict(g.session.query(Class.id, Class.speed_profile).filter(Class.id.in_(class_ids)).all())
+    return [device_id for device_id, _ in devices], profiles
+
+# all a kiosk device token may call (the stream's endpoint sits under flask-sock's blueprint)
+KIOSK_ENDPOINTS = {"mark_attendance_from_frame", "run_kiosk_stream", "me"}
+# a device token comes in the Authorization header, and a browser a teacher is signed in on
+# also sends the access_token cookie: on these endpoints the header wins
+KIOSK_TOKEN_LOCATIONS = ['headers', 'cookies']
+
 @app.before_request
 def create_session():
     g.session = SessionLocal()
+    kiosk_endpoint = (request.endpoint or "").rsplit(".", 1)[-1] in KIOSK_ENDPOINTS
 
     try:
-        verify_jwt_in_request(optional=True)
+        verify_jwt_in_request(optional=True, locations=KIOSK_TOKEN_LOCATIONS if kiosk_endpoint else None)
         uid = get_jwt_identity()
         role = get_jwt().get("role") if uid else None
     except Exception:
@@ -113,7 +224,14 @@ def create_session():
 
     g.role, g.user = None, None
     if uid:
-        if role == "teacher":
+        if role == "kiosk":
+            # device token: everything it may do is in the claims, so no user row to load
+            if not kiosk_endpoint:
+                return jsonify({"status":"error","message":"Forbidden","code":403}), 403
+            claims = get_jwt()
+            g.role, g.kiosk_device, g.kiosk_classes = "kiosk", claims.get("device"), frozenset(claims.get("classes") or ())
+            g.kiosk_expires = claims.get("exp")
+        elif role == "teacher":
             g.role, g.user = "teacher", g.session.get(Teacher, uid)
         elif role == "student":
             g.role, g.user = "student", g.session.get(Student, uid)
@@ -220,7 +338,7 @@ def delete_user():
         return jsonify({"status": "error", "message": "An error occurred while deleting the user", "code": 500}), 500
 
 @app.route('/api/me', methods=['GET'])
-@jwt_required()
+@jwt_required(locations=KIOSK_TOKEN_LOCATIONS)
 def me():
     j = get_jwt()
     return jsonify({
@@ -691,6 +809,7 @@ def get_students(class_id):
             'id': student.id,
             'name': student.name,
             'email': student.email,
+            'face_status': student.enrollment_status,
         }
     for student in students
 ]
@@ -1105,11 +1224,14 @@ def register_student():
         image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(image_path)
 
-        new_student = Student(name=name, email=email, password=password, image=image_path)
+        new_student = Student(name=name, email=email, password=password, image=image_path, encode=False)
 
         g.session.add(new_student)
         g.session.commit()
-        return jsonify({"status": "success", "message": "Student created", "code": 201}), 201
+        # the face is encoded in the background; poll GET /api/students/enrollment
+        enrollment_queue.enqueue(new_student.id, image_path)
+        return jsonify({"status": "success", "message": "Student created", "student_id": new_student.id,
+                        "face_status": FACE_PENDING, "code": 201}), 201
 
     except SQLAlchemyError as e:
         app.logger.error(f"SQLAlchemyError: {e}")
@@ -1161,8 +1283,10 @@ def update_student():
             image.save(image_path)
         
         # Update the student's profile
-        student.update_profile(session=g.session, name=name, email=email, image=image_path)
-        return jsonify({"status": "success", "message": "Student updated", "code": 200}), 200
+        student.update_profile(session=g.session, name=name, email=email, image=image_path, encode=False)
+        if image_path:
+            enrollment_queue.enqueue(student.id, image_path)
+        return jsonify({"status": "success", "message": "Student updated", "face_status": student.enrollment_status, "code": 200}), 200
 
     except SQLAlchemyError as e:
         app.logger.error(f"SQLAlchemyError: {e}")
@@ -1174,6 +1298,22 @@ def update_student():
         g.session.rollback()
         return jsonify({"status": "error", "message": "Cannot recognize a face from the image", "code": 422}), 422
 
+
+@app.route('/api/students/enrollment', methods=['GET'])
+@jwt_required()
+@role_required("student")
+def get_enrollment_status():
+    try:
+        student = g.session.query(Student).filter_by(id=g.user.id).first()
+        if not student:
+            return jsonify({"status": "error", "message": "Student not found", "code": 404}), 404
+        return jsonify({"status": "success", "face_status": student.enrollment_status,
+                        "encoder_version": student.face_encoder_version, "code": 200}), 200
+    except SQLAlchemyError as e:
+        app.logger.error(f"SQLAlchemyError: {e}")
+        return jsonify({"status": "error", "message": "An error occurred", "code": 500}), 500
+
+
 @app.route('/api/students/family/requests/', methods=['GET'])
 @jwt_required()
 @role_required("student")
@@ -1556,71 +1696,907 @@ def parent_child_attendance_history(student_id, class_id):
         return jsonify({"status":"error","message":"An error occurred","code":500}), 500
 
 
-@app.route('/api/classes/<int:class_id>/attendance/mark', methods=['POST'])
+@app.route('/api/classes/<int:class_id>/recognition', methods=['PATCH'])
 @jwt_required()
 @role_required("teacher")
-def mark_attendance_from_frame(class_id):
+def update_class_recognition(class_id):
+    speed_profile = (request.get_json() or {}).get('speed_profile')
     try:
-        # Ensure class belongs to this teacher
         cls = g.session.query(Class).filter_by(id=class_id, teacher_id=g.user.id).first()
         if not cls:
             return jsonify({"status":"error","message":"Class not found or unauthorized","code":404}), 404
 
-        if not FACE_ENABLED:
-            return jsonify({"status":"error","message":"Face recognition disabled on server","code":503}), 503
+        # null resets the class to the server default
+        if speed_profile is not None and (not isinstance(speed_profile, str) or speed_profile not in SPEED_PROFILES):
+            return jsonify({"status":"error","message":"Unknown speed profile","profiles":sorted(SPEED_PROFILES),"code":400}), 400
 
-        if 'frame' not in request.files:
-            return jsonify({"status":"error","message":"No frame provided","code":400}), 400
-
-        raw = request.files['frame'].read()
-        probe = bytes_to_encoding(raw)
-        if probe is None:
-            # No face / multiple faces / decoding failure
-            return jsonify({"status":"error","message":"No single face detected","code":422}), 422
-
-        # Candidates = enrolled students with vectors
-        enrolled = [(s.id, s.name, s.email, s.face_vector) for s in cls.students if s.face_vector is not None]
-        if not enrolled:
-            return jsonify({"status":"error","message":"No enrolled students have embeddings on file","code":409}), 409
+        cls.speed_profile = speed_profile
+        g.session.commit()
+        kiosk_devices.invalidate()
+        return jsonify({"status":"success","speed_profile":cls.speed_profile,"code":200}), 200
+    except SQLAlchemyError as e:
+        app.logger.error(f"SQLAlchemyError: {e}")
+        g.session.rollback()
+        return jsonify({"status":"error","message":"An error occurred","code":500}), 500
 
-        # Find best match by Euclidean distance (lower = better)
-        best = None
-        best_dist = 1e9
-        for sid, sname, semail, vec in enrolled:
-            d = face_distance(probe, vec)
-            if d < best_dist:
-                best_dist = d
-                best = (sid, sname, semail)
 
-        # Threshold — tune to your data. 0.6 is the common starting point for face_recognition.
-        THRESH = 0.60
-        if best is None or best_dist > THRESH:
-            return jsonify({"status":"error","message":"No confident match","distance":best_dist,"code":404}), 404
+@app.route('/api/classes/<int:class_id>/recognition/quality', methods=['GET'])
+@jwt_required()
+@role_required("teacher")
+def class_frame_quality(class_id):
+    """Kiosk frames seen for the class and how many the quality gate rejected, by reason."""
+    cls = g.session.query(Class).filter_by(id=class_id, teacher_id=g.user.id).first()
+    if not cls:
+        return jsonify({"status":"error","message":"Class not found or unauthorized","code":404}), 404
+    return jsonify({"status":"success","class_id":class_id,**frame_quality.stats(class_id),
+                    "thresholds":app.config.get('FRAME_QUALITY_GATE'),"code":200}), 200
+
+
+def class_gallery_rows(class_id):
+    """
+    (id, name, email, face_vector) for the class roster, straight from the student/roster
+    columns without loading full Student objects. face_vector decodes to a float32 view
+    of the row bytes.
+    """
+    return (g.session.query(Student.id, Student.name, Student.email, Student.face_vector)
+            .join(student_class_association, student_class_association.c.student_id == Student.id)
+            .filter(student_class_association.c.class_id == class_id,
+                    Student.face_vector.isnot(None),
+                    or_(Student.face_status.is_(None), Student.face_status != FACE_PENDING))
+            .order_by(Student.id)
+            .all())
+
+
+def load_class_gallery(class_id):
+    """
+    Build a class gallery. With GALLERY_STORE_DIR set the shared file is memory-mapped
+    when it's current; otherwise the roster is read from the DB and stored for the
+    other workers first.
+    """
+    options = {"precision": app.config.get('GALLERY_PRECISION', 'float32'),
+               "rerank": app.config.get('GALLERY_RERANK', 8)}
+    if not gallery_store.enabled:
+        return Gallery.from_rows(class_gallery_rows(class_id), fetch=fetch_embeddings, **options)
+
+    version = encoder_version()
+    gallery = gallery_store.load(class_id, version, **options)
+    if gallery is not None:
+        return gallery
+    signature = gallery_store.signature(class_id)
+    generation = gallery_store.generation(class_id)
+    rows = class_gallery_rows(class_id)
+    try:
+        gallery_store.save(class_id, rows, generation, version)
+        gallery = gallery_store.load(class_id, version, **options)
+    except OSError:
+        app.logger.exception(f"Could not store gallery for class {class_id}")
+    if gallery is None:
+        # roster changed while we were reading it, or the store isn't writable: serve
+        # what we read; if the store has moved on it's rebuilt on the next frame
+        gallery = Gallery.from_rows(rows, fetch=fetch_embeddings, **options)
+        gallery.store_signature = signature
+    return gallery
+
+
+def class_gallery(class_id):
+    """The class gallery from the process cache, dropped first if another worker changed the stored copy."""
+    if gallery_store.enabled:
+        cached = gallery_cache.get(class_id)
+        if cached is not None and not gallery_store.is_current(class_id, cached):
+            gallery_cache.invalidate(class_id)
+    return gallery_cache.get_or_build(class_id, lambda: load_class_gallery(class_id))
+
+
+def fetch_embeddings(student_ids):
+    """
+    Full-precision embeddings by student id, for the re-rank of a float16/int8 gallery.
+    Uses its own session: cached galleries outlive the request that built them.
+    """
+    session = SessionLocal()
+    try:
+        return {sid: vec for sid, vec in session.query(Student.id, Student.face_vector)
+                                                .filter(Student.id.in_(student_ids))
+                if vec is not None}
+    finally:
+        session.close()
 
-        sid, sname, semail = best
 
-        # Upsert attendance for today
-        today = date.today()
-        row = (g.session.query(Attendance)
-               .filter(and_(Attendance.date == today,
-                            Attendance.class_id == class_id,
-                            Attendance.student_id == sid))
-               .first())
-        already = False
+def upsert_attendance(class_id, student_ids, today=None):
+    """
+    Mark every student in student_ids present for today in one SELECT + one flush.
+    Returns {student_id: already_marked}. Caller commits.
+    """
+    today = today or date.today()
+    student_ids = list(dict.fromkeys(student_ids))
+    if not student_ids:
+        return {}
+    rows = (g.session.query(Attendance)
+            .filter(and_(Attendance.date == today,
+                         Attendance.class_id == class_id,
+                         Attendance.student_id.in_(student_ids)))
+            .all())
+    existing = {r.student_id: r for r in rows}
+    already = {}
+    for sid in student_ids:
+        row = existing.get(sid)
         if row:
-            already = bool(row.attended)
+            already[sid] = bool(row.attended)
             row.attended = True
         else:
+            already[sid] = False
             g.session.add(Attendance(date=today, attended=True, student_id=sid, class_id=class_id))
+    return already
+
+
+def present_today(class_id, today):
+    """Student ids with an attended row for the class on `today` (what warms the present set)."""
+    return [sid for (sid,) in g.session.query(Attendance.student_id)
+                                       .filter_by(class_id=class_id, date=today, attended=True)]
+
+
+def mark_present(class_id, student_ids):
+    """
+    Mark student_ids present today and return {student_id: already_marked}.
+    Students already in the class's present set are answered from memory; only
+    the rest cost a SELECT + COMMIT, and none at all if everyone is known.
+    """
+    today = date.today()
+    present = present_set.members(class_id, today, lambda: present_today(class_id, today))
+
+    already = {sid: True for sid in student_ids if sid in present}
+    new_ids = [sid for sid in student_ids if sid not in present]
+    if new_ids:
+        already.update(upsert_attendance(class_id, new_ids, today))
         g.session.commit()
+        present_set.add(class_id, today, new_ids)
+    return already
+
+
+def mark_faces_in_frame(class_id, faces, gallery, known=None, encoded_matches=None):
+    """
+    Multi-face mode: match every detected face against the class gallery in one
+    matrix call and mark all confident matches in a single transaction.
+    known maps face index -> Match for tracked faces that weren't re-encoded;
+    encoded_matches, if the batch already matched them, the Matches of the rest in order.
+    """
+    THRESH = MATCH_THRESHOLD
+    known = known or {}
+    matches = [known.get(i) for i in range(len(faces))]
+    encoded = [i for i in range(len(faces)) if i not in known]
+    if encoded:
+        if encoded_matches is None:
+            encoded_matches = gallery.match_many(np.vstack([faces[i][1] for i in encoded]))
+        for i, m in zip(encoded, encoded_matches):
+            matches[i] = m
+
+    # if two faces land on the same student keep the closer one
+    best_face = {}
+    for i, m in enumerate(matches):
+        if m.distance <= THRESH and (m.student_id not in best_face or m.distance < matches[best_face[m.student_id]].distance):
+            best_face[m.student_id] = i
+
+    already = mark_present(class_id, list(best_face))
+
+    results = []
+    for i, ((top, right, bottom, left), m) in enumerate(zip((loc for loc, _ in faces), matches)):
+        face = {"box": {"top": int(top), "right": int(right), "bottom": int(bottom), "left": int(left)},
+                "distance": m.distance}
+        if i in known:
+            face["tracked"] = True
+        if best_face.get(m.student_id) == i:
+            face.update({
+                "status": "matched",
+                "matched_student": {"id": m.student_id, "name": m.name, "email": m.email},
+                "already_marked": already[m.student_id],
+            })
+        elif m.distance <= THRESH:
+            face["status"] = "duplicate"
+        else:
+            face["status"] = "unknown"
+        results.append(face)
+
+    return {
+        "status": "success",
+        "faces": results,
+        "matched": len(best_face),
+        "newly_marked": sum(1 for v in already.values() if not v),
+        "threshold": THRESH,
+        "code": 200
+    }, 200
+
+
+def recognise_frame(class_id, raw, multi, profile, gallery=None, track_key=None):
+    """
+    Detect, encode, match and mark one kiosk frame. Returns (payload, status);
+    the payload carries per-stage timings in ms under "timings_ms".
+    With a track_key (multi-face only) the faces from that kiosk's previous frame are
+    searched for first, and confidently matched ones aren't re-encoded.
+    """
+    tracks = None
+    if multi and track_key is not None:
+        generation = gallery_cache.generation(class_id)
+        tracks = face_tracker.tracks(track_key, generation)
+    hints = [{"box": t.box, "skip_encode": t.student is not None} for t in tracks] if tracks else None
+
+    started = time.perf_counter()
+    try:
+        result, timings, gallery, matches = frame_batcher.run(
+            FrameJob(class_id, raw, multi, profile, hints, gallery), run_frame_batch)
+    except FrameRejected as e:
+        return kiosk_frame_rejected(class_id, e, started)
+    frame_quality.record(class_id)
+    # whatever the worker didn't spend decoding/detecting/encoding (or the batch on
+    # matching) went on batching, queueing and IPC
+    timings["queue"] = round(max((time.perf_counter() - started) * 1000 - sum(timings.values()), 0.0), 2)
+    marking = time.perf_counter()
+
+    # faces that came back without an encoding are tracked faces, in hint order
+    known = None
+    if multi and result and "roi" in timings:
+        known = {i: Match(tracks[i].student["id"], tracks[i].student["name"], tracks[i].student["email"],
+                          tracks[i].distance, float("inf"))
+                 for i, (_, enc) in enumerate(result) if enc is None}
+
+    payload, status = _match_frame(class_id, result, multi, gallery, known, matches)
+    timings["match"] = round(timings.get("match", 0.0) + (time.perf_counter() - marking) * 1000, 2)
+    stage_timings.record(timings)
+    if multi and track_key is not None:
+        face_tracker.update(track_key, generation, payload.get("faces"), full_scan="roi" not in timings)
+    payload["timings_ms"] = timings
+    return payload, status
+
+
+def recognise_chips(class_id, chips, landmarks, profile):
+    """
+    Encode, match and mark pre-cropped face chips (Helpers.analyse_chips): no detection,
+    and the response is a multi-face one with boxes in chip pixels, in chip order.
+    """
+    started = time.perf_counter()
+    try:
+        faces, timings = recognition_pool.run(analyse_chips, chips, profile, landmarks,
+                                              app.config.get('FRAME_QUALITY_GATE'))
+    except FrameRejected as e:
+        return kiosk_frame_rejected(class_id, e, started)
+    frame_quality.record(class_id)
+    timings["queue"] = round(max((time.perf_counter() - started) * 1000 - sum(timings.values()), 0.0), 2)
+    marking = time.perf_counter()
+    payload, status = _match_frame(class_id, faces, True)
+    timings["match"] = round((time.perf_counter() - marking) * 1000, 2)
+    stage_timings.record(timings)
+    payload["timings_ms"] = timings
+    return payload, status
+
+
+def kiosk_frame_rejected(class_id, e, started):
+    """Count a kiosk frame the quality gate rejected and build its 422 response."""
+    frame_quality.record(class_id, e.reason)
+    timings = e.timings
+    timings["queue"] = round(max((time.perf_counter() - started) * 1000 - sum(timings.values()), 0.0), 2)
+    stage_timings.record(timings)
+    payload, status = rejected_frame(e)
+    payload["timings_ms"] = timings
+    return payload, status
+
+
+def parse_chip_landmarks(raw, count):
+    """
+    The "landmarks" form field of a chips upload: JSON with one entry per chip, either
+    null or CHIP_LANDMARKS [x, y] points. None when absent; ValueError if malformed.
+    """
+    if not raw:
+        return None
+    landmarks = json.loads(raw)
+    if not isinstance(landmarks, list) or len(landmarks) != count:
+        raise ValueError("one landmarks entry per chip")
+    out = []
+    for points in landmarks:
+        if points is None:
+            out.append(None)
+            continue
+        if not isinstance(points, list) or len(points) != CHIP_LANDMARKS:
+            raise ValueError(f"{CHIP_LANDMARKS} points per chip")
+        out.append([(float(x), float(y)) for x, y in points])
+    return out
+
+
+# one kiosk frame waiting in the frame_batcher
+FrameJob = namedtuple("FrameJob", ["class_id", "raw", "multi", "profile", "hints", "gallery"])
+
+def run_frame_batch(jobs):
+    """
+    frame_batcher step for a batch of FrameJobs: detect/encode every frame on the pool,
+    then match all the probes against each class gallery in one match_many call (its
+    time is added to every frame's "match" timing). Returns, per job, the FrameRejected
+    it raised or (result, timings, gallery, matches), where matches are the Matches of
+    the frame's encoded faces in order, or None if there was nothing to match.
+    """
+    gate = app.config.get('FRAME_QUALITY_GATE')
+    analysed = recognition_pool.run_batch(
+        analyse_frames, [(job.raw, job.profile, job.multi, job.hints, gate) for job in jobs], analyse_frame)
+
+    out, probes, galleries, groups = [], [], {}, {}
+    for job, outcome in zip(jobs, analysed):
+        if isinstance(outcome, FrameRejected):
+            out.append(outcome)
+            probes.append(None)
+            continue
+        result, timings = outcome
+        if job.multi:
+            encs = [enc for _, enc in result or () if enc is not None]
+        else:
+            encs = [] if result is None else [result]
+        gallery = job.gallery
+        if encs and gallery is None:
+            if job.class_id not in galleries:
+                galleries[job.class_id] = class_gallery(job.class_id)
+            gallery = galleries[job.class_id]
+        out.append([result, timings, gallery, None])
+        probes.append(encs)
+        if encs and len(gallery):
+            groups.setdefault(id(gallery), (gallery, []))[1].append(len(out) - 1)
+
+    for gallery, members in groups.values():
+        started = time.perf_counter()
+        matches = gallery.match_many(np.vstack([p for i in members for p in probes[i]]))
+        ms = round((time.perf_counter() - started) * 1000, 2)
+        at = 0
+        for i in members:
+            out[i][3] = matches[at:at + len(probes[i])]
+            out[i][1]["match"] = ms
+            at += len(probes[i])
+    return [entry if isinstance(entry, Exception) else tuple(entry) for entry in out]
+
+
+def rejected_frame(e):
+    """422 response for a frame the quality gate turned away, with its reason code."""
+    return {"status":"error","message":REJECT_REASONS[e.reason],"reason":e.reason,
+            "value":e.value,"code":422}, 422
+
+
+def _match_frame(class_id, result, multi, gallery=None, known=None, matches=None):
+    if multi:
+        faces = result
+        if not faces:
+            # No face / decoding failure
+            return {"status":"error","message":"No face detected","code":422}, 422
+    else:
+        probe = result
+        if probe is None:
+            # No face / multiple faces / decoding failure
+            return {"status":"error","message":"No single face detected","code":422}, 422
+
+    # Candidates = enrolled students with vectors, stacked into one matrix (cached per class)
+    if gallery is None:
+        gallery = class_gallery(class_id)
+    if len(gallery) == 0:
+        return {"status":"error","message":"No enrolled students have embeddings on file","code":409}, 409
+
+    if multi:
+        return mark_faces_in_frame(class_id, faces, gallery, known, matches)
+
+    # Best + runner-up by Euclidean distance (lower = better), one numpy call for the whole roster
+    best = matches[0] if matches else gallery.match(probe)
+    THRESH = MATCH_THRESHOLD
+    if best.distance > THRESH:
+        return {"status":"error","message":"No confident match","distance":best.distance,"code":404}, 404
+
+    sid, sname, semail = best.student_id, best.name, best.email
+    best_dist = best.distance
+    second_dist = best.second_distance if np.isfinite(best.second_distance) else None
+
+    # Upsert attendance for today (skipped if they're already in the present set)
+    already = mark_present(class_id, [sid])[sid]
+
+    return {
+        "status":"success",
+        "matched_student": {"id": sid, "name": sname, "email": semail},
+        "distance": best_dist,
+        "second_distance": second_dist,
+        "threshold": THRESH,
+        "already_marked": already,
+        "code":200
+    }, 200
+
+
+def frame_bytes(upload):
+    """
+    The uploaded frame as bytes. Small uploads are spooled into a BytesIO, whose
+    getvalue() hands over its buffer rather than copying it the way read() does.
+    """
+    if isinstance(upload.stream, io.BytesIO):
+        return upload.stream.getvalue()
+    return upload.read()
+
+
+# results worth replaying for a repeat frame (not 409/5xx, which can change any moment)
+REPLAYABLE_STATUSES = {200, 404, 422}
+
+def process_kiosk_frame(class_id, kiosk_id, raw, multi, profile, gallery=None):
+    """Recognise one kiosk frame, reusing the kiosk's last result for a repeat frame. Returns (payload, status)."""
+    # Same person still in front of the camera (or nobody there)? Reuse the last answer.
+    cache_key = (class_id, kiosk_id, multi, profile)
+    fhash = frame_hash(raw)
+    cached = frame_cache.lookup(cache_key, fhash)
+    if cached is not None:
+        return cached
+
+    payload, status = recognise_frame(class_id, raw, multi, profile, gallery, track_key=cache_key)
+    if status in REPLAYABLE_STATUSES:
+        frame_cache.store(cache_key, fhash, (payload, status))
+    return payload, status
+
+
+# quality rejections that still mean someone is in front of the camera
+FACE_PRESENT_REASONS = {"blurry", "face_too_small"}
+
+def paced(class_id, kiosk_id, payload, status):
+    """The kiosk's result plus next_capture_ms, its suggested wait before the next frame (see KioskPacing)."""
+    face_present = status in (200, 404) or payload.get("reason") in FACE_PRESENT_REASONS
+    if "faces" in payload:
+        arrivals = payload.get("newly_marked", 0) > 0
+    else:
+        arrivals = status == 200 and not payload.get("already_marked")
+    delay = kiosk_pacing.suggest((class_id, kiosk_id), face_present, bool(payload.get("cached")),
+                                 arrivals, recognition_pool.load)
+    return dict(payload, next_capture_ms=delay), status
+
+
+def resolve_speed_profile(class_profile, requested=None):
+    """kiosk override > class setting > server default; None if the result isn't a known profile."""
+    profile = requested or class_profile or app.config.get('RECOGNITION_SPEED_PROFILE')
+    return profile if profile in SPEED_PROFILES else None
+
+
+def kiosk_class_access(class_id):
+    """
+    (allowed, class speed_profile) for the caller of a kiosk endpoint. A device token's
+    classes are in its claims and the profile comes from the kiosk_devices snapshot, so
+    that answer needs no query; a teacher still goes through the ownership check.
+    """
+    if g.role == "kiosk":
+        if class_id not in g.kiosk_classes:
+            return False, None
+        return kiosk_devices.class_profile(class_id)
+    cls = g.session.query(Class).filter_by(id=class_id, teacher_id=g.user.id).first()
+    return (True, cls.speed_profile) if cls else (False, None)
+
+
+def kiosk_device_active():
+    """
+    Whether the caller's device token is still good: not past its exp and not revoked
+    (on any worker, as of the kiosk_devices snapshot). Streams re-check it every message,
+    since the token itself was only verified at the handshake.
+    """
+    expires = g.get('kiosk_expires')
+    if expires is not None and time.time() >= expires:
+        return False
+    return kiosk_devices.is_active(g.kiosk_device, load_kiosk_devices)
+
+
+def default_kiosk_id():
+    return f"device-{g.kiosk_device}" if g.role == "kiosk" else str(g.user.id)
+
+##### ATTENDANCE SESSIONS #####
+
+def current_attendance_session(class_id, now=None):
+    """The class's attendance session open right now, or None."""
+    now = now or datetime.now()
+    return (g.session.query(AttendanceSession)
+            .filter(AttendanceSession.class_id == class_id,
+                    AttendanceSession.closed_at.is_(None),
+                    AttendanceSession.starts_at <= now,
+                    AttendanceSession.ends_at > now)
+            .order_by(AttendanceSession.starts_at.desc())
+            .first())
+
+
+def no_session_response():
+    return {"status":"error","message":"No open attendance session","reason":"no_session","code":409}, 409
+
+
+def close_attendance_session(att_session, now=None):
+    """
+    Close the session and write an absent row for every student on the roster without
+    an attendance row for its day. Returns the number of absent rows, or None if another
+    request closed it first.
+    """
+    now = now or datetime.now()
+    closed_at = min(now, att_session.ends_at)
+    # claim the close, so two workers never both write the absent rows
+    claimed = (g.session.query(AttendanceSession)
+               .filter(AttendanceSession.id == att_session.id, AttendanceSession.closed_at.is_(None))
+               .update({"closed_at": closed_at}, synchronize_session=False))
+    if not claimed:
+        g.session.rollback()
+        return None
+
+    day = att_session.starts_at.date()
+    roster = [sid for (sid,) in g.session.query(student_class_association.c.student_id)
+                                         .filter(student_class_association.c.class_id == att_session.class_id)]
+    recorded = {sid for (sid,) in g.session.query(Attendance.student_id)
+                                           .filter_by(class_id=att_session.class_id, date=day)}
+    absent = [sid for sid in roster if sid not in recorded]
+    if absent:
+        g.session.execute(Attendance.__table__.insert(), [
+            {"date": day, "attended": False, "student_id": sid, "class_id": att_session.class_id}
+            for sid in absent])
+    att_session.closed_at = closed_at
+    att_session.absent_marked = len(absent)
+    g.session.commit()
+    return len(absent)
+
+
+def close_expired_sessions(class_id, now=None):
+    """Close (and write the absent rows of) sessions that ran past ends_at without being closed."""
+    now = now or datetime.now()
+    expired = (g.session.query(AttendanceSession)
+               .filter(AttendanceSession.class_id == class_id,
+                       AttendanceSession.closed_at.is_(None),
+                       AttendanceSession.ends_at <= now)
+               .all())
+    for att_session in expired:
+        close_attendance_session(att_session, now)
+
+
+def prewarm_class(class_id):
+    """Load the class gallery and today's present set ahead of the first kiosk frame."""
+    started = time.perf_counter()
+    gallery = class_gallery(class_id)
+    today = date.today()
+    present = present_set.members(class_id, today, lambda: present_today(class_id, today))
+    return {"students": len(gallery), "present": len(present),
+            "ms": round((time.perf_counter() - started) * 1000, 2)}
+
+
+def _parse_session_window(data, now):
+    """(starts_at, ends_at, explicit) from a session request body; ValueError if invalid."""
+    max_minutes = app.config.get('ATTENDANCE_SESSION_MAX_MINUTES', 240)
+    if data.get('starts_at') or data.get('ends_at'):
+        starts_at = datetime.fromisoformat(data['starts_at']) if data.get('starts_at') else now
+        ends_at = datetime.fromisoformat(data['ends_at'])
+        explicit = True
+    else:
+        minutes = data.get('minutes', app.config.get('ATTENDANCE_SESSION_MINUTES', 15))
+        if isinstance(minutes, bool) or not isinstance(minutes, (int, float)):
+            raise ValueError("minutes must be a number")
+        # bounded before timedelta(), which overflows on huge or infinite values
+        if not math.isfinite(minutes):
+            raise ValueError("minutes must be a number")
+        if minutes > max_minutes:
+            raise ValueError(f"sessions last at most {max_minutes} minutes")
+        if minutes <= 0:
+            raise ValueError("the session would already be over")
+        starts_at, ends_at = now, now + timedelta(minutes=minutes)
+        explicit = False
+    # stored naive, in server local time like Attendance.date
+    starts_at, ends_at = (d.astimezone().replace(tzinfo=None) if d.tzinfo else d for d in (starts_at, ends_at))
+    if not starts_at < ends_at:
+        raise ValueError("ends_at must be after starts_at")
+    if ends_at <= now:
+        raise ValueError("the session would already be over")
+    if ends_at - starts_at > timedelta(minutes=max_minutes):
+        raise ValueError(f"sessions last at most {max_minutes} minutes")
+    return starts_at, ends_at, explicit
+
+
+@app.route('/api/classes/<int:class_id>/attendance/sessions', methods=['POST'])
+@jwt_required()
+@role_required("teacher")
+def open_attendance_session(class_id):
+    """
+    Open an attendance session: {"minutes": n} from now (default ATTENDANCE_SESSION_MINUTES)
+    or an explicit {"starts_at", "ends_at"} window (ISO 8601). Opening with no window
+    while one is open returns that one, so kiosks can call this on start. Prewarms the
+    class gallery and present set.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        cls = g.session.query(Class).filter_by(id=class_id, teacher_id=g.user.id).first()
+        if not cls:
+            return jsonify({"status":"error","message":"Class not found or unauthorized","code":404}), 404
+
+        now = datetime.now()
+        try:
+            starts_at, ends_at, explicit = _parse_session_window(data, now)
+        except (ValueError, TypeError, KeyError, OverflowError) as e:
+            return jsonify({"status":"error","message":f"Invalid session window: {e}","code":400}), 400
+
+        close_expired_sessions(class_id, now)
+        overlapping = (g.session.query(AttendanceSession)
+                       .filter(AttendanceSession.class_id == class_id,
+                               AttendanceSession.closed_at.is_(None),
+                               AttendanceSession.starts_at < ends_at,
+                               AttendanceSession.ends_at > starts_at)
+                       .order_by(AttendanceSession.starts_at)
+                       .first())
+        if overlapping is not None:
+            if explicit or not overlapping.is_open(now):
+                return jsonify({"status":"error","message":"Overlaps another attendance session",
+                                "session":overlapping.to_dict(),"code":409}), 409
+            return jsonify({"status":"success","session":overlapping.to_dict(),
+                            "prewarm":prewarm_class(class_id),"code":200}), 200
+
+        att_session = AttendanceSession(class_id=class_id, opened_by=g.user.id, starts_at=starts_at, ends_at=ends_at)
+        g.session.add(att_session)
+        g.session.commit()
+        return jsonify({"status":"success","session":att_session.to_dict(),
+                        "prewarm":prewarm_class(class_id),"code":201}), 201
+    except SQLAlchemyError as e:
+        app.logger.error(f"SQLAlchemyError: {e}")
+        g.session.rollback()
+        return jsonify({"status":"error","message":"An error occurred","code":500}), 500
+
+
+@app.route('/api/classes/<int:class_id>/attendance/sessions', methods=['GET'])
+@jwt_required()
+@role_required("teacher")
+def list_attendance_sessions(class_id):
+    """The class's most recent attendance sessions, newest first."""
+    try:
+        cls = g.session.query(Class).filter_by(id=class_id, teacher_id=g.user.id).first()
+        if not cls:
+            return jsonify({"status":"error","message":"Class not found or unauthorized","code":404}), 404
+
+        now = datetime.now()
+        close_expired_sessions(class_id, now)
+        rows = (g.session.query(AttendanceSession)
+                .filter_by(class_id=class_id)
+                .order_by(AttendanceSession.starts_at.desc())
+                .limit(50)
+                .all())
+        return jsonify({"status":"success","sessions":[dict(r.to_dict(), open=r.is_open(now)) for r in rows],
+                        "code":200}), 200
+    except SQLAlchemyError as e:
+        app.logger.error(f"SQLAlchemyError: {e}")
+        g.session.rollback()
+        return jsonify({"status":"error","message":"An error occurred","code":500}), 500
+
+
+@app.route('/api/classes/<int:class_id>/attendance/sessions/<int:session_id>/close', methods=['POST'])
+@jwt_required()
+@role_required("teacher")
+def close_attendance_session_route(class_id, session_id):
+    """Close the session now and mark everyone not marked present as absent."""
+    try:
+        cls = g.session.query(Class).filter_by(id=class_id, teacher_id=g.user.id).first()
+        if not cls:
+            return jsonify({"status":"error","message":"Class not found or unauthorized","code":404}), 404
+        att_session = g.session.query(AttendanceSession).filter_by(id=session_id, class_id=class_id).first()
+        if not att_session:
+            return jsonify({"status":"error","message":"Attendance session not found","code":404}), 404
+        if att_session.closed_at is not None:
+            return jsonify({"status":"error","message":"Attendance session already closed","code":409}), 409
+
+        absent = close_attendance_session(att_session)
+        if absent is None:
+            return jsonify({"status":"error","message":"Attendance session already closed","code":409}), 409
+        return jsonify({"status":"success","session":att_session.to_dict(),"absent":absent,"code":200}), 200
+    except SQLAlchemyError as e:
+        app.logger.error(f"SQLAlchemyError: {e}")
+        g.session.rollback()
+        return jsonify({"status":"error","message":"An error occurred","code":500}), 500
+
+
+##### KIOSK DEVICE TOKENS #####
+
+@app.route('/api/kiosk/devices', methods=['POST'])
+@jwt_required()
+@role_required("teacher")
+def create_kiosk_device():
+    """
+    Issue a device token for a kiosk: {"name": ..., "class_ids": [...]}, all classes the
+    teacher's own. The token (sent as "Authorization: Bearer <token>") can only mark
+    attendance for those classes, and is returned this once; only the device row is kept.
+    """
+    data = request.get_json(silent=True) or {}
+    name = (data.get('name') or '').strip()
+    class_ids = data.get('class_ids')
+    if not name or len(name) > 100:
+        return jsonify({"status":"error","message":"A device name of up to 100 characters is required","code":400}), 400
+    max_classes = app.config.get('KIOSK_DEVICE_MAX_CLASSES', 20)
+    if (not isinstance(class_ids, list) or not class_ids or len(class_ids) > max_classes
+            or not all(isinstance(c, int) and not isinstance(c, bool) and 0 < c < 2**63 for c in class_ids)):
+        return jsonify({"status":"error","message":f"class_ids must list 1 to {max_classes} class ids","code":400}), 400
+    class_ids = sorted(set(class_ids))
+    try:
+        owned = (g.session.query(Class.id)
+                 .filter(Class.id.in_(class_ids), Class.teacher_id == g.user.id)
+                 .count())
+        if owned != len(class_ids):
+            return jsonify({"status":"error","message":"Class not found or unauthorized","code":404}), 404
+
+        now = datetime.now()
+        lifetime = timedelta(days=app.config.get('KIOSK_TOKEN_EXPIRES_DAYS', 180))
+        device = KioskDevice(teacher_id=g.user.id, name=name, class_ids=",".join(map(str, class_ids)),
+                             created_at=now, expires_at=now + lifetime)
+        g.session.add(device)
+        g.session.commit()
+        token = create_access_token(identity=g.user.id, expires_delta=lifetime,
+                                    additional_claims={"role": "kiosk", "name": name,
+                                                       "device": device.id, "classes": class_ids})
+        # this worker picks it up on the next lookup; others reload when they first see it
+        kiosk_devices.invalidate()
+        return jsonify({"status":"success","device":device.to_dict(now),"token":token,"code":201}), 201
+    except SQLAlchemyError as e:
+        app.logger.error(f"SQLAlchemyError: {e}")
+        g.session.rollback()
+        return jsonify({"status":"error","message":"An error occurred","code":500}), 500
+
+
+@app.route('/api/kiosk/devices', methods=['GET'])
+@jwt_required()
+@role_required("teacher")
+def list_kiosk_devices():
+    """The teacher's kiosk devices, newest first, revoked and expired ones included."""
+    try:
+        now = datetime.now()
+        rows = (g.session.query(KioskDevice)
+                .filter_by(teacher_id=g.user.id)
+                .order_by(KioskDevice.created_at.desc(), KioskDevice.id.desc())
+                .all())
+        return jsonify({"status":"success","devices":[r.to_dict(now) for r in rows],"code":200}), 200
+    except SQLAlchemyError as e:
+        app.logger.error(f"SQLAlchemyError: {e}")
+        g.session.rollback()
+        return jsonify({"status":"error","message":"An error occurred","code":500}), 500
+
+
+@app.route('/api/kiosk/devices/<int:device_id>', methods=['DELETE'])
+@jwt_required()
+@role_required("teacher")
+def revoke_kiosk_device(device_id):
+    """Revoke a device token: immediately on this worker, within KIOSK_DEVICE_REFRESH_SECONDS on the others."""
+    try:
+        device = g.session.query(KioskDevice).filter_by(id=device_id, teacher_id=g.user.id).first()
+        if not device:
+            return jsonify({"status":"error","message":"Device not found or unauthorized","code":404}), 404
+        now = datetime.now()
+        if device.revoked_at is None:
+            device.revoked_at = now
+            g.session.commit()
+        kiosk_devices.revoke(device.id)
+        return jsonify({"status":"success","device":device.to_dict(now),"code":200}), 200
+    except SQLAlchemyError as e:
+        app.logger.error(f"SQLAlchemyError: {e}")
+        g.session.rollback()
+        return jsonify({"status":"error","message":"An error occurred","code":500}), 500
+
+
+@app.route('/api/classes/<int:class_id>/attendance/mark', methods=['POST'])
+@jwt_required(locations=KIOSK_TOKEN_LOCATIONS)
+@role_required("teacher", "kiosk")
+def mark_attendance_from_frame(class_id):
+    try:
+        # Ensure class belongs to this teacher (or is one the kiosk device was issued for)
+        allowed, class_profile = kiosk_class_access(class_id)
+        if not allowed:
+            return jsonify({"status":"error","message":"Class not found or unauthorized","code":404}), 404
+
+        if not face_enabled():
+            return jsonify({"status":"error","message":"Face recognition disabled on server","code":503}), 503
+
+        # before anything touches the upload
+        if app.config.get('ATTENDANCE_REQUIRE_SESSION') and current_attendance_session(class_id) is None:
+            payload, status = no_session_response()
+            return jsonify(payload), status
+
+        mode = request.args.get('mode') or request.form.get('mode')
+        if mode == 'chips':
+            return mark_attendance_from_chips(class_id, class_profile)
+
+        if 'frame' not in request.files:
+            return jsonify({"status":"error","message":"No frame provided","code":400}), 400
+
+        multi = mode == 'multi'
+
+        profile = resolve_speed_profile(class_profile, request.args.get('profile') or request.form.get('profile'))
+        if profile is None:
+            return jsonify({"status":"error","message":"Unknown speed profile","code":400}), 400
+
+        raw = frame_bytes(request.files['frame'])
+
+        kiosk_id = request.form.get('kiosk_id') or request.headers.get('X-Kiosk-Id') or default_kiosk_id()
+        payload, status = paced(class_id, kiosk_id, *process_kiosk_frame(class_id, kiosk_id, raw, multi, profile))
+        return jsonify(payload), status
+
+    except SQLAlchemyError as e:
+        g.session.rollback()
+        app.logger.error(f"SQLAlchemyError: {e}")
+        return jsonify({"status":"error","message":"DB error","code":500}), 500
+
+
+def mark_attendance_from_chips(class_id, class_profile):
+    """
+    mode=chips: the kiosk ran face detection itself and uploads one "chip" file per face
+    (see Helpers.CHIP_MARGIN), optionally with a "landmarks" JSON field. Skips the
+    repeat-frame cache and face tracking, which both work on whole frames.
+    """
+    chips = [frame_bytes(f) for f in request.files.getlist('chip')]
+    if not chips:
+        return jsonify({"status":"error","message":"No face chips provided","code":400}), 400
+    max_chips = app.config.get('KIOSK_MAX_CHIPS', 10)
+    if len(chips) > max_chips:
+        return jsonify({"status":"error","message":f"At most {max_chips} face chips per request","code":400}), 400
+    try:
+        landmarks = parse_chip_landmarks(request.form.get('landmarks'), len(chips))
+    except (ValueError, TypeError):
+        return jsonify({"status":"error","message":"Invalid landmarks","code":400}), 400
+
+    profile = resolve_speed_profile(class_profile, request.args.get('profile') or request.form.get('profile'))
+    if profile is None:
+        return jsonify({"status":"error","message":"Unknown speed profile","code":400}), 400
+
+    kiosk_id = request.form.get('kiosk_id') or request.headers.get('X-Kiosk-Id') or default_kiosk_id()
+    payload, status = paced(class_id, kiosk_id, *recognise_chips(class_id, chips, landmarks, profile))
+    return jsonify(payload), status
+
+
+def load_face_index():
+    """The school-wide FaceIndex, loaded from FACE_INDEX_PATH (or built) on first use and kept in sync with other workers."""
+    return face_index.ensure_loaded(app.config.get('FACE_INDEX_PATH'),
+                                    lambda: indexed_embeddings(g.session),
+                                    encoder_version=encoder_version())
+
+
+@app.route('/api/recognition/identify', methods=['POST'])
+@jwt_required()
+@role_required("teacher")
+def identify_student():
+    """Building-entrance lookup: the k enrolled students (any class) closest to the face in the frame."""
+    try:
+        if not face_enabled():
+            return jsonify({"status":"error","message":"Face recognition disabled on server","code":503}), 503
+
+        if 'frame' not in request.files:
+            return jsonify({"status":"error","message":"No frame provided","code":400}), 400
+
+        k = request.args.get('k') or request.form.get('k') or 5
+        max_k = app.config.get('IDENTIFY_MAX_CANDIDATES', 20)
+        try:
+            k = int(k)
+        except (TypeError, ValueError):
+            k = 0
+        if not 1 <= k <= max_k:
+            return jsonify({"status":"error","message":f"k must be between 1 and {max_k}","code":400}), 400
+
+        profile = request.args.get('profile') or request.form.get('profile') or app.config.get('RECOGNITION_SPEED_PROFILE')
+        if profile not in SPEED_PROFILES:
+            return jsonify({"status":"error","message":"Unknown speed profile","code":400}), 400
+
+        raw = frame_bytes(request.files['frame'])
+        started = time.perf_counter()
+        try:
+            probe, timings = recognition_pool.run(analyse_frame, raw, profile, False, None,
+                                                  app.config.get('FRAME_QUALITY_GATE'))
+        except FrameRejected as e:
+            payload, status = rejected_frame(e)
+            return jsonify(payload), status
+        timings["queue"] = round(max((time.perf_counter() - started) * 1000 - sum(timings.values()), 0.0), 2)
+        if probe is None:
+            return jsonify({"status":"error","message":"No single face detected","code":422}), 422
+
+        index = load_face_index()
+        searched = time.perf_counter()
+        candidates = index.search(probe, k)
+        timings["search"] = round((time.perf_counter() - searched) * 1000, 2)
+        if not candidates:
+            return jsonify({"status":"error","message":"No enrolled students have embeddings on file","code":409}), 409
+
+        students = {sid: (name, email) for sid, name, email in
+                    g.session.query(Student.id, Student.name, Student.email)
+                             .filter(Student.id.in_([c.student_id for c in candidates]))}
+        results = [{"id": c.student_id, "name": students[c.student_id][0], "email": students[c.student_id][1],
+                    "distance": c.distance}
+                   for c in candidates if c.student_id in students]
+        best = results[0] if results and results[0]["distance"] <= MATCH_THRESHOLD else None
 
         return jsonify({
-            "status":"success",
-            "matched_student": {"id": sid, "name": sname, "email": semail},
-            "distance": best_dist,
-            "threshold": THRESH,
-            "already_marked": already,
-            "code":200
+            "status": "success",
+            "candidates": results,
+            "match": best,
+            "threshold": MATCH_THRESHOLD,
+            "timings_ms": timings,
+            "code": 200
         }), 200
 
     except SQLAlchemyError as e:
@@ -1629,6 +2605,145 @@ def mark_attendance_from_frame(class_id):
         return jsonify({"status":"error","message":"DB error","code":500}), 500
 
 
+@app.route('/api/recognition/stats', methods=['GET'])
+@jwt_required()
+@role_required("teacher")
+def recognition_stats():
+    return jsonify({
+        "status": "success",
+        "frame_cache": frame_cache.stats(),
+        "gallery_cache": gallery_cache.stats(),
+        "gallery_store": gallery_store.stats(),
+        "recognition_queue": {"pending": recognition_pool.pending, "max_pending": recognition_pool.max_pending},
+        "batching": frame_batcher.stats(),
+        "stage_timings": stage_timings.stats(),
+        "frame_quality": frame_quality.stats(),
+        "face_tracker": face_tracker.stats(),
+        "face_index": face_index.stats(),
+        "enrollment": enrollment_queue.stats(),
+        "kiosk_devices": kiosk_devices.stats(),
+        "pacing": {**kiosk_pacing.stats(), "load": recognition_pool.load},
+        "code": 200
+    }), 200
+
+
+##### KIOSK STREAM #####
+
+def _ws_send(ws, event_type, payload):
+    ws.send(app.json.dumps(dict(payload, type=event_type)))
+
+def _allowed_ws_origin():
+    # browsers send cookies on cross-site WebSocket handshakes, and CORS doesn't apply to them
+    origin = request.headers.get('Origin')
+    allowed = {o.strip() for o in CORS_ORIGIN.split(',')}
+    return origin is None or '*' in allowed or origin in allowed
+
+def run_kiosk_stream(ws, class_id):
+    """
+    Long-lived kiosk connection for one class. Auth, ownership and settings are checked
+    once at the handshake (a kiosk device token is re-checked for revocation and expiry
+    on every message); after that every binary message is a JPEG/PNG frame and gets
+    a "recognition" event back (same body as POST /attendance/mark). Text messages are
+    JSON settings changes: {"mode": "multi"|"single", "profile": "fast"|...}.
+    The class gallery is pinned for the connection and only reloaded when the roster changes.
+    """
+    if not _allowed_ws_origin():
+        return _ws_send(ws, "error", {"status":"error","message":"Origin not allowed","code":403})
+    if g.role not in ("teacher", "kiosk"):
+        return _ws_send(ws, "error", {"status":"error","message":"Missing or invalid credentials","code":401})
+    allowed, class_profile = kiosk_class_access(class_id)
+    if not allowed:
+        return _ws_send(ws, "error", {"status":"error","message":"Class not found or unauthorized","code":404})
+    if not face_enabled():
+        return _ws_send(ws, "error", {"status":"error","message":"Face recognition disabled on server","code":503})
+
+    require_session = app.config.get('ATTENDANCE_REQUIRE_SESSION')
+    if require_session and current_attendance_session(class_id) is None:
+        return _ws_send(ws, "error", no_session_response()[0])
+
+    multi = request.args.get('mode') == 'multi'
+    profile = resolve_speed_profile(class_profile, request.args.get('profile'))
+    if profile is None:
+        return _ws_send(ws, "error", {"status":"error","message":"Unknown speed profile","code":400})
+    kiosk_id = request.args.get('kiosk_id') or request.headers.get('X-Kiosk-Id') or default_kiosk_id()
+
+    generation = gallery_cache.generation(class_id)
+    gallery = class_gallery(class_id)
+    # don't sit on an open transaction (and a stale snapshot) between frames
+    g.session.rollback()
+    _ws_send(ws, "ready", {"status":"success","class_id":class_id,"mode":"multi" if multi else "single",
+                           "profile":profile,"students":len(gallery),"code":200})
+
+    while True:
+        message = ws.receive()
+        if message is None:
+            break
+
+        if g.role == "kiosk":
+            active = kiosk_device_active()
+            g.session.rollback()
+            if not active:
+                _ws_send(ws, "error", {"status":"error","message":"Device token revoked or expired","code":401})
+                break
+
+        if isinstance(message, str):
+            try:
+                settings = json.loads(message)
+                requested = settings.get('profile', profile)
+                mode = settings.get('mode', 'multi' if multi else 'single')
+                if not isinstance(requested, str) or requested not in SPEED_PROFILES:
+                    raise ValueError(requested)
+                if not isinstance(mode, str) or mode not in ('multi', 'single'):
+                    raise ValueError(mode)
+            except (ValueError, AttributeError):
+                _ws_send(ws, "error", {"status":"error","message":"Invalid settings","code":400})
+                continue
+            profile = requested
+            multi = mode == 'multi'
+            _ws_send(ws, "settings", {"status":"success","mode":"multi" if multi else "single","profile":profile,"code":200})
+            continue
+
+        if len(message) > app.config['MAX_CONTENT_LENGTH']:
+            _ws_send(ws, "recognition", {"status":"error","message":"Frame too large","code":413})
+            continue
+
+        if require_session:
+            open_now = current_attendance_session(class_id) is not None
+            g.session.rollback()
+            if not open_now:
+                _ws_send(ws, "recognition", no_session_response()[0])
+                continue
+
+        if gallery_store.enabled and not gallery_store.is_current(class_id, gallery):
+            gallery_cache.invalidate(class_id)
+        current = gallery_cache.generation(class_id)
+        if current != generation:
+            generation = current
+            gallery = class_gallery(class_id)
+
+        try:
+            payload, status = paced(class_id, kiosk_id,
+                                    *process_kiosk_frame(class_id, kiosk_id, message, multi, profile, gallery))
+        except RecognitionBusy as e:
+            payload = {"status":"error","message":"Recognition server busy, retry shortly",
+                       "retry_after":e.retry_after,"code":503}
+        except SQLAlchemyError as e:
+            app.logger.error(f"SQLAlchemyError: {e}")
+            payload = {"status":"error","message":"DB error","code":500}
+        finally:
+            g.session.rollback()
+        _ws_send(ws, "recognition", payload)
+
+if Sock is not None:
+    sock = Sock(app)
+    sock.route('/api/classes/<int:class_id>/kiosk/stream')(run_kiosk_stream)
+
+
+##### CLI #####
+
+register_commands(app, SessionLocal)
+
+
 ##### MAIN #####
 
 if __name__ == '__main__':
@@ -13,7 +13,7 @@ import ParentChildClassDashboard from "./pages/parent/ParentChildClassDashboard.
 import Kiosk from "./pages/Kiosk.jsx";
 
 // custom route guards to decide who can visit what.
-import { RequireAuth, PublicOnly } from "./routes.jsx";
+import { RequireAuth, RequireAuthOrDevice, PublicOnly } from "./routes.jsx";
 
 // wraps the entire app in a Routes component
 export default function App() {
@@ -33,13 +33,17 @@ export default function App() {
       <Route element={<RequireAuth />}>
         <Route path="/dashboard" element={<RoleDashboardRouter />} />
         <Route path="/classes/:id" element={<RoleClassRouter />} />
-        <Route path="/classes/:id/kiosk" element={<Kiosk />} />
 
         {/* Parent deep links */}
         <Route path="/parent/children/:childId" element={<ChildClasses />} />
         <Route path="/parent/children/:childId/classes/:classId" element={<ParentChildClassDashboard />} />
       </Route>
 
+      {/* KIOSK - a teacher, or a kiosk device signed in with its own device token */}
+      <Route element={<RequireAuthOrDevice />}>
+        <Route path="/classes/:id/kiosk" element={<Kiosk />} />
+      </Route>
+
       {/* FALLBACK ROUTE... handles any unknown URL, redirect to / */}
       <Route path="*" element={<Navigate to="/" replace />} />
     </Routes>
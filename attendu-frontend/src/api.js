@@ -1,4 +1,4 @@
-import { request } from "./apiClient";    // import the request wrapper we made around fetch() .
+import { request, API_BASE_URL } from "./apiClient";    // import the request wrapper we made around fetch() .
 
 // this is the central api layer of the app. it bridges the frontend and backend.
 
@@ -148,11 +148,60 @@ export const getParentChildAttendanceHistory = (student_id, class_id, params = {
 export const studentSendParentRequest = (email) =>
   postJSON("/api/students/family/requests/", { email });
 
-export async function markAttendanceFromFrame(classId, blob) {
+// attendance sessions: kiosks only mark while one is open; closing marks everyone else absent
+export const openAttendanceSession = (classId, { minutes } = {}) =>
+  postJSON(`/api/classes/${classId}/attendance/sessions`, minutes ? { minutes } : {});
+export const getAttendanceSessions = (classId) => get(`/api/classes/${classId}/attendance/sessions`);
+export const closeAttendanceSession = (classId, sessionId) =>
+  request(`/api/classes/${classId}/attendance/sessions/${sessionId}/close`, { method: "POST" });
+
+// kiosk device tokens: a kiosk signed in as itself, limited to marking the listed classes.
+// the token is only returned by createKioskDevice; send it as deviceToken below.
+export const createKioskDevice = (name, classIds) => postJSON("/api/kiosk/devices", { name, class_ids: classIds });
+export const getKioskDevices = () => get("/api/kiosk/devices");
+export const revokeKioskDevice = (deviceId) => request(`/api/kiosk/devices/${deviceId}`, { method: "DELETE" });
+
+// with a device token, leave any teacher cookies at home (the server would otherwise see both),
+// and don't try to refresh a teacher session when the token is turned away
+const deviceAuth = (deviceToken) =>
+  deviceToken ? { headers: { Authorization: `Bearer ${deviceToken}` }, credentials: "omit", retry: false } : {};
+
+export async function markAttendanceFromFrame(classId, blob, { mode, profile, kioskId, deviceToken } = {}) {
   const form = new FormData();  
   form.append("frame", blob, "frame.jpg");
+  if (kioskId) form.append("kiosk_id", kioskId);   // lets the server reuse results for repeat frames
+  if (mode) form.append("mode", mode);   // "multi" -> mark every face in the frame
+  if (profile) form.append("profile", profile);   // "fast" | "balanced" | "accurate"
   return request(`/api/classes/${classId}/attendance/mark`, {
     method: "POST",
     body: form,
+    ...deviceAuth(deviceToken),
   });
-}
\ No newline at end of file
+}
+
+// kiosks that detect faces themselves: upload just the face crops (box + 20% margin each side)
+export async function markAttendanceFromChips(classId, chips, { profile, kioskId, landmarks, deviceToken } = {}) {
+  const form = new FormData();
+  form.append("mode", "chips");
+  chips.forEach((blob, i) => form.append("chip", blob, `chip${i}.jpg`));
+  if (landmarks) form.append("landmarks", JSON.stringify(landmarks));   // per chip: null or 5 [x, y] points
+  if (kioskId) form.append("kiosk_id", kioskId);
+  if (profile) form.append("profile", profile);
+  return request(`/api/classes/${classId}/attendance/mark`, {
+    method: "POST",
+    body: form,
+    ...deviceAuth(deviceToken),
+  });
+}
+
+// long-lived kiosk connection: send JPEG blobs, receive {type: "ready"|"recognition"|"settings"|"error", ...}
+export function openKioskStream(classId, { mode, profile, kioskId } = {}) {
+  const params = new URLSearchParams();
+  if (mode) params.set("mode", mode);
+  if (profile) params.set("profile", profile);
+  if (kioskId) params.set("kiosk_id", kioskId);
+  const scheme = window.location.protocol === "https:" ? "wss" : "ws";
+  const ws = new WebSocket(`${scheme}://${window.location.host}${API_BASE_URL}/api/classes/${classId}/kiosk/stream?${params}`);
+  ws.binaryType = "arraybuffer";
+  return ws;
+}
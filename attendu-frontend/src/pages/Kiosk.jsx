@@ -1,20 +1,73 @@
 // src/pages/kiosk/Kiosk.jsx
 import React, { useEffect, useRef, useState } from "react";
-import { useParams, useNavigate } from "react-router-dom";
+import { useParams, useNavigate, useSearchParams } from "react-router-dom";
 import { useAuth } from "../AuthContext.jsx";
-import { markAttendanceFromFrame } from "../api.js";
+import {
+  markAttendanceFromFrame, markAttendanceFromChips, openKioskStream,
+  openAttendanceSession, closeAttendanceSession,
+} from "../api.js";
+
+// face chips (mode=chips) must match the server's Helpers.CHIP_MARGIN
+const CHIP_MARGIN = 0.2;
+const CHIP_SIZE = 160;
+
+// until the server suggests otherwise (next_capture_ms on every recognition result)
+const CAPTURE_MS = 2000;
+
+// on-device face detection (Shape Detection API) where the browser has it
+function makeFaceDetector() {
+  try {
+    return "FaceDetector" in window ? new window.FaceDetector({ fastMode: true, maxDetectedFaces: 10 }) : null;
+  } catch {
+    return null;
+  }
+}
+
+// stable per-device id so the server can tell kiosks apart (repeat-frame cache)
+function getKioskId() {
+  let id = localStorage.getItem("attendu_kiosk_id");
+  if (!id) {
+    id = globalThis.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    localStorage.setItem("attendu_kiosk_id", id);
+  }
+  return id;
+}
+
+// device token (POST /api/kiosk/devices), given once as /classes/<id>/kiosk#device_token=...
+// (or ?device_token=...) and kept on the device, so the kiosk keeps marking without a teacher
+// signed in. It is good for months, so it is taken straight back out of the address bar and
+// doesn't end up in history, bookmarks or Referer headers.
+export function getDeviceToken() {
+  const url = new URL(window.location.href);
+  const hash = new URLSearchParams(url.hash.slice(1));
+  const given = hash.get("device_token") || url.searchParams.get("device_token");
+  if (given) {
+    localStorage.setItem("attendu_kiosk_device_token", given);
+    hash.delete("device_token");
+    url.searchParams.delete("device_token");
+    url.hash = hash.toString();
+    window.history.replaceState(window.history.state, "", url);
+  }
+  return localStorage.getItem("attendu_kiosk_device_token") || undefined;
+}
 
 export default function Kiosk() {
   const { id } = useParams();
   const classId = Number(id);
   const navigate = useNavigate();
   const { user } = useAuth();
+  const [searchParams] = useSearchParams();
+  const speedProfile = searchParams.get("profile") || undefined;   // per-kiosk override, e.g. /kiosk?profile=fast
+  const kioskIdRef = useRef(getKioskId());
+  const deviceTokenRef = useRef(getDeviceToken());
+  // /kiosk?chips=0 forces whole-frame uploads even where the browser can detect faces
+  const faceDetectorRef = useRef(searchParams.get("chips") === "0" ? null : makeFaceDetector());
 
   const isStartingRef = useRef(false);
   const playPromiseRef = useRef(null);
 
   useEffect(() => {
-    if (user?.role && user.role !== "teacher") {
+    if (!deviceTokenRef.current && user?.role && user.role !== "teacher") {
       navigate(`/classes/${classId}`, { replace: true });
     }
     // eslint-disable-next-line
@@ -25,6 +78,7 @@ export default function Kiosk() {
   const [recentMarks, setRecentMarks] = useState([]);
   const [scanState, setScanState] = useState({ state: "idle", text: "Idle" });
   const [isFs, setIsFs] = useState(false);
+  const [attSession, setAttSession] = useState(null);   // the open attendance session, if any
 
   const videoRef = useRef(null);
   const canvasRef = useRef(null);
@@ -32,6 +86,11 @@ export default function Kiosk() {
   const wrapRef = useRef(null);
   const streamRef = useRef(null);
   const timerRef = useRef(null);
+  const captureRunRef = useRef(0);     // bumped on stop, so a capture still in flight doesn't reschedule
+  const nextDelayRef = useRef(CAPTURE_MS);
+  const wsRef = useRef(null);          // kiosk stream; null -> per-frame POSTs
+  const wsReadyRef = useRef(false);
+  const wsBusyRef = useRef(false);     // one frame in flight on the stream at a time
   const lastMarkRef = useRef(new Map());
   const [todayMap, setTodayMap] = useState({});
 
@@ -113,8 +172,21 @@ export default function Kiosk() {
 
       await safePlay(v);
 
+      // the server only accepts frames while a session is open (reuses one already open);
+      // a device-token kiosk can't open one, the teacher does that from their dashboard
+      if (!deviceTokenRef.current) {
+        try {
+          const res = await openAttendanceSession(classId);
+          setAttSession(res.session);
+        } catch (e) {
+          setAttMsg(e?.message || "Could not open an attendance session.");
+        }
+      }
+
       setAttRunning(true);
-      timerRef.current = setInterval(captureAndSend, 2000);
+      // chips go over POST; so do device-token kiosks (browsers can't put the token on a WebSocket)
+      if (!faceDetectorRef.current && !deviceTokenRef.current) connectStream();
+      startCapturing();
     } catch (e) {
       setAttMsg(e?.message || "Camera failed.");
       if (streamRef.current) {
@@ -126,11 +198,55 @@ export default function Kiosk() {
     }
   }
 
+  function connectStream() {
+    let ws;
+    try {
+      ws = openKioskStream(classId, { mode: "multi", profile: speedProfile, kioskId: kioskIdRef.current });
+    } catch {
+      return;   // no WebSocket support -> stay on POSTs
+    }
+    wsRef.current = ws;
+    ws.onmessage = (ev) => {
+      let msg = null;
+      try { msg = JSON.parse(ev.data); } catch { return; }
+      if (msg.type === "ready") {
+        wsReadyRef.current = true;
+      } else if (msg.type === "recognition") {
+        wsBusyRef.current = false;
+        if (msg.status === "success") handleResult(msg);
+        else handleError(msg.message, msg);
+      } else if (msg.type === "error") {
+        ws.close();
+      }
+    };
+    ws.onclose = () => {
+      if (wsRef.current === ws) wsRef.current = null;
+      wsReadyRef.current = false;
+      wsBusyRef.current = false;
+    };
+  }
+
+  // capture, then wait however long the server suggested: quick at a busy door,
+  // slow in an empty room or while the recognition backend is backed up
+  function startCapturing() {
+    const run = ++captureRunRef.current;
+    const tick = async () => {
+      try { await captureAndSend(); } catch {}
+      if (captureRunRef.current === run) timerRef.current = setTimeout(tick, nextDelayRef.current);
+    };
+    timerRef.current = setTimeout(tick, nextDelayRef.current);
+  }
+
   function stopAttendance() {
+    captureRunRef.current += 1;
     if (timerRef.current) {
-      clearInterval(timerRef.current);
+      clearTimeout(timerRef.current);
       timerRef.current = null;
     }
+    if (wsRef.current) {
+      wsRef.current.close();
+      wsRef.current = null;
+    }
     const v = videoRef.current;
     if (v) {
       try { v.pause(); } catch {}
@@ -143,6 +259,19 @@ export default function Kiosk() {
     setAttRunning(false);
   }
 
+  // close the session: everyone not marked by now is recorded absent
+  async function endSession() {
+    if (!attSession) return;
+    try {
+      const res = await closeAttendanceSession(classId, attSession.id);
+      setAttMsg(`Session closed · ${res.absent} marked absent`);
+      setAttSession(null);
+      stopAttendance();
+    } catch (e) {
+      setAttMsg(e?.message || "Could not close the session.");
+    }
+  }
+
   useEffect(() => {
     startAttendance();
     return () => stopAttendance();
@@ -158,47 +287,124 @@ export default function Kiosk() {
     const ctx = canvas.getContext("2d");
     ctx.drawImage(video, 0, 0, w, h);
 
+    if (faceDetectorRef.current) {
+      let faces = null;
+      try {
+        faces = await faceDetectorRef.current.detect(canvas);
+      } catch {
+        faceDetectorRef.current = null;   // detector unusable here -> whole frames from now on
+        if (!deviceTokenRef.current) connectStream();
+      }
+      if (faces) {
+        await sendChips(canvas, faces);
+        return;
+      }
+    }
+
     const blob = await new Promise((res) => canvas.toBlob(res, "image/jpeg", 0.85));
     if (!blob) return;
 
+    const ws = wsRef.current;
+    const streaming = ws && wsReadyRef.current;
+    if (streaming && wsBusyRef.current) return;   // still waiting on the previous frame
+
     setScanState((s) => (s.state === "matched" ? s : { state: "scanning", text: "Scanning…" }));
 
+    if (streaming) {
+      wsBusyRef.current = true;
+      ws.send(blob);
+      return;
+    }
+
     try {
-      const res = await markAttendanceFromFrame(classId, blob);
+      const res = await markAttendanceFromFrame(classId, blob, {
+        mode: "multi", profile: speedProfile, kioskId: kioskIdRef.current, deviceToken: deviceTokenRef.current,
+      });
+      handleResult(res);
+    } catch (e) {
+      handleError(e?.message, e?.payload);
+    }
+  }
 
-      if (res?.matched_student) {
-        const sid = res.matched_student.id;
-        const name = res.matched_student.name;
-        const now = Date.now();
-        const last = lastMarkRef.current.get(sid) || 0;
+  // crop each detected face (plus CHIP_MARGIN) to at most CHIP_SIZE px and upload only those
+  async function sendChips(canvas, faces) {
+    if (!faces.length) {
+      setScanState({ state: "no_face", text: "No face detected" });
+      return;
+    }
+    const chips = [];
+    for (const { boundingBox: b } of faces) {
+      const mx = b.width * CHIP_MARGIN, my = b.height * CHIP_MARGIN;
+      const sw = b.width + 2 * mx, sh = b.height + 2 * my;
+      const k = Math.min(1, CHIP_SIZE / Math.max(sw, sh));
+      const chip = document.createElement("canvas");
+      chip.width = Math.round(sw * k); chip.height = Math.round(sh * k);
+      chip.getContext("2d").drawImage(canvas, b.x - mx, b.y - my, sw, sh, 0, 0, chip.width, chip.height);
+      const blob = await new Promise((res) => chip.toBlob(res, "image/jpeg", 0.9));
+      if (blob) chips.push(blob);
+    }
+    if (!chips.length) return;
+
+    setScanState((s) => (s.state === "matched" ? s : { state: "scanning", text: "Scanning…" }));
+    try {
+      const res = await markAttendanceFromChips(classId, chips, {
+        profile: speedProfile, kioskId: kioskIdRef.current, deviceToken: deviceTokenRef.current,
+      });
+      handleResult(res);
+    } catch (e) {
+      handleError(e?.message, e?.payload);
+    }
+  }
+
+  function pace(payload) {
+    const ms = payload?.next_capture_ms ?? (payload?.retry_after ? payload.retry_after * 1000 : null);
+    if (ms) nextDelayRef.current = ms;
+  }
 
+  function handleResult(res) {
+    pace(res);
+    const matched = (res?.faces || []).filter((f) => f.status === "matched");
+    if (matched.length) {
+      const now = Date.now();
+      let newcomer = false;
+      const items = matched.map((f) => {
+        const sid = f.matched_student.id;
+        const last = lastMarkRef.current.get(sid) || 0;
         if (now - last > 3000) {
           lastMarkRef.current.set(sid, now);
-          if (!res.already_marked) beep(980, 120);
+          if (!f.already_marked) newcomer = true;
         }
+        return { id: sid, name: f.matched_student.name, already: !!f.already_marked, distance: Number(f.distance).toFixed(3) };
+      });
+      if (newcomer) beep(980, 120);
+
+      setRecentMarks((prev) => [...items, ...prev].slice(0, 10));
+      setTodayMap((m) => ({ ...m, ...Object.fromEntries(items.map((it) => [it.id, true])) }));
+      setScanState({
+        state: "matched",
+        text: items.length === 1
+          ? `Recognized ${items[0].name}${items[0].already ? " (already)" : ""} · d=${items[0].distance}`
+          : `Recognized ${items.length}: ${items.map((it) => it.name).join(", ")}`,
+      });
+      return;
+    }
 
-        const item = { id: sid, name, already: !!res.already_marked, distance: Number(res.distance).toFixed(3) };
-        setRecentMarks((prev) => [item, ...prev.slice(0, 9)]);
-        setTodayMap((m) => ({ ...m, [sid]: true }));
-        setScanState({
-          state: "matched",
-          text: `Recognized ${name}${res.already_marked ? " (already)" : ""} · d=${Number(res.distance).toFixed(3)}`,
-        });
-        return;
-      }
+    setScanState({ state: "unknown", text: "Unknown face" });
+  }
 
+  function handleError(message, payload) {
+    pace(payload);
+    const msg = (message || "").toLowerCase();
+    if (msg.includes("face recognition disabled")) {
+      setScanState({ state: "disabled", text: "Face engine disabled" });
+    } else if (msg.includes("no open attendance session")) {
+      setScanState({ state: "disabled", text: "No attendance session open" });
+    } else if (msg.includes("no face") || msg.includes("no single face")) {
+      setScanState({ state: "no_face", text: "No face detected" });
+    } else if (msg.includes("no confident match")) {
       setScanState({ state: "unknown", text: "Unknown face" });
-    } catch (e) {
-      const msg = (e?.message || "").toLowerCase();
-      if (msg.includes("face recognition disabled")) {
-        setScanState({ state: "disabled", text: "Face engine disabled" });
-      } else if (msg.includes("no single face")) {
-        setScanState({ state: "no_face", text: "No face detected" });
-      } else if (msg.includes("no confident match")) {
-        setScanState({ state: "unknown", text: "Unknown face" });
-      } else {
-        setScanState({ state: "error", text: "Error" });
-      }
+    } else {
+      setScanState({ state: "error", text: "Error" });
     }
   }
 
@@ -240,6 +446,7 @@ export default function Kiosk() {
           <h3 style={{ margin: 0 }}>Kiosk · Class #{classId}</h3>
           <div style={{ display: "flex", gap: 8, flexWrap: "wrap" }}>
             {!attRunning ? <button onClick={startAttendance}>Start</button> : <button onClick={stopAttendance}>Stop</button>}
+            {attSession && <button onClick={endSession}>End session</button>}
             <button onClick={goFullscreen}>{isFs ? "Exit Fullscreen" : "Fullscreen"}</button>
             <button onClick={() => navigate(`/classes/${classId}`, { replace: true })}>Exit</button>
           </div>
@@ -280,7 +487,7 @@ export default function Kiosk() {
               </div>
             )}
             <p style={{ opacity: 0.8, marginTop: 10 }}>
-              Tip: place the device ~1m from the door, good light, one face in frame.
+              Tip: place the device ~1m from the door, good light, faces toward the camera.
             </p>
           </div>
         </div>
@@ -2,6 +2,7 @@
 // outlet is a placeholder where the child content will be rendered
 import { Navigate, Outlet } from "react-router-dom";    
 import { useAuth } from "./AuthContext.jsx";
+import { getDeviceToken } from "./pages/Kiosk.jsx";
 
 /** Only allow authed users. Otherwise send to /login. */
 // ex: if im logged out trying to access my dashboard.
@@ -11,6 +12,13 @@ export function RequireAuth() {
   return <Outlet />;
 }
 
+/** The kiosk page: authed users, or a kiosk device that holds a device token. */
+export function RequireAuthOrDevice() {
+  const { authed } = useAuth();
+  if (!authed && !getDeviceToken()) return <Navigate to="/login" replace />;
+  return <Outlet />;
+}
+
 /** Only allow public (not authed). If authed, go to /dashboard. */
 // ex: if im logged in trying to log in, again.
 export function PublicOnly() {
@@ -9,6 +9,7 @@ export default defineConfig({
         target: 'http://127.0.0.1:5000',  // this forces ipv4
         changeOrigin: true,
         secure: false,
+        ws: true,                          // kiosk stream (/api/classes/:id/kiosk/stream)
         rewrite: p => p.replace(/^\/api/, '')
       }
     }
@@ -0,0 +1,225 @@
+"""
+Recognition pipeline benchmarks.
+
+    python benchmarks/bench_recognition.py --output bench.json
+    python benchmarks/bench_recognition.py --sizes 10,1000 --frames 20 --backend dlib
+
+Runs three groups and writes one JSON document (stdout unless --output):
+  stages      analyse_frame on a sample photo: decode / detect / encode ms per frame
+  gallery     Gallery.match against random rosters of each size, per GALLERY_PRECISION
+  end_to_end  POST /api/classes/<id>/attendance/mark through the Flask test client,
+              against an in-memory SQLite DB holding a class of each size
+
+Always runs with the Test config (SQLite, inline recognition pool). Keep the JSON from
+each release to compare against the next one.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+os.environ["FLASK_CONFIG"] = "Test"
+
+import bcrypt
+import numpy as np
+from app import app, engine, SessionLocal, present_set
+from Models import Base, Teacher, Class, User, Student, student_class_association, FACE_READY
+from Gallery import Gallery, GALLERY_PRECISIONS, gallery_cache
+from FaceBackends import get_backend, use_backend
+from Helpers import analyse_frame, encoder_version
+from KioskState import frame_cache, face_tracker
+from Recognition import stage_timings
+
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+SAMPLE_FRAME = os.path.join(ROOT, "images", "lebron.jpg")
+INSERT_CHUNK = 5000
+
+
+def summarise(samples_ms):
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    return {"n": int(samples.size),
+            "mean_ms": round(float(samples.mean()), 3),
+            "p50_ms": round(float(np.percentile(samples, 50)), 3),
+            "p95_ms": round(float(np.percentile(samples, 95)), 3),
+            "max_ms": round(float(samples.max()), 3)}
+
+
+def bench_stages(frame, profile, frames):
+    """Per-stage ms of analyse_frame over `frames` runs on the same photo."""
+    per_stage = {}
+    for _ in range(frames):
+        _, timings = analyse_frame(frame, profile)
+        for stage, ms in timings.items():
+            per_stage.setdefault(stage, []).append(ms)
+    return {stage: summarise(samples) for stage, samples in per_stage.items()}
+
+
+def bench_gallery(sizes, probes, seed=0):
+    """Gallery.match latency for a random roster of each size, at every gallery precision."""
+    rng = np.random.default_rng(seed)
+    results = []
+    for n in sizes:
+        vectors = rng.normal(scale=0.09, size=(n, 128)).astype(np.float32)
+        queries = vectors[rng.integers(0, n, size=probes)] + rng.normal(scale=0.03, size=(probes, 128))
+        blank = [""] * n
+        # stands in for the DB read the app's float16/int8 galleries re-rank with
+        fetch = lambda ids: {i: vectors[i - 1] for i in ids}
+        for precision in GALLERY_PRECISIONS:
+            started = time.perf_counter()
+            gallery = Gallery(np.arange(1, n + 1), blank, blank, vectors, precision=precision, fetch=fetch)
+            build_ms = (time.perf_counter() - started) * 1000
+            samples = []
+            for q in queries:
+                started = time.perf_counter()
+                gallery.match(q)
+                samples.append((time.perf_counter() - started) * 1000)
+            results.append({"students": n, "precision": precision, "build_ms": round(build_ms, 3),
+                            "bytes": gallery.nbytes, **summarise(samples)})
+    return results
+
+
+def populate(n, probe_vector, password_hash, seed=0):
+    """Fresh DB with one teacher and a class of n students; student 1 has probe_vector."""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        teacher = Teacher(name="Bench", email="bench@teacher.com", password="password")
+        session.add(teacher)
+        session.commit()
+        cls = Class(teacher_id=teacher.id, class_name="bench")
+        session.add(cls)
+        session.commit()
+
+        # bulk inserts: going through Student() would bcrypt every password
+        rng = np.random.default_rng(seed)
+        version = encoder_version()
+        first = teacher.id + 1
+        for start in range(0, n, INSERT_CHUNK):
+            ids = range(first + start, first + min(start + INSERT_CHUNK, n))
+            vectors = rng.normal(scale=0.09, size=(len(ids), 128))
+            if start == 0:
+                vectors[0] = probe_vector
+            session.execute(User.__table__.insert(), [
+                {"id": i, "type": "student", "name": f"Student {i}", "email": f"student{i}@bench.com",
+                 "password": password_hash} for i in ids])
+            session.execute(Student.__table__.insert(), [
+                {"id": i, "face_vector": v, "face_encoder_version": version, "face_status": FACE_READY}
+                for i, v in zip(ids, vectors)])
+            session.execute(student_class_association.insert(), [
+                {"student_id": i, "class_id": cls.id} for i in ids])
+        session.commit()
+        return cls.id
+    finally:
+        session.close()
+
+
+def bench_end_to_end(sizes, frame, profile, frames, mode):
+    """Latency of the mark endpoint for a class of each size (cold = first frame, builds the gallery)."""
+    probe_vector = analyse_frame(frame, profile)[0]
+    password_hash = bcrypt.hashpw(b"password", bcrypt.gensalt())
+    client = app.test_client()
+    results = []
+    for n in sizes:
+        class_id = populate(n, probe_vector, password_hash)
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        stage_timings.clear()
+        client.post('/api/auth/login', json={"email": "bench@teacher.com", "password": "password"})
+
+        def post():
+            # a fresh frame every time, not a replay from the repeat-frame cache
+            frame_cache.clear()
+            data = {"frame": (io.BytesIO(frame), "frame.jpg"), "mode": mode, "profile": profile}
+            started = time.perf_counter()
+            response = client.post(f'/api/classes/{class_id}/attendance/mark', data=data,
+                                   content_type='multipart/form-data')
+            elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code != 200:
+                raise RuntimeError(f"mark returned {response.status_code}: {response.get_data(as_text=True)}")
+            return elapsed
+
+        cold = post()
+        samples = [post() for _ in range(frames)]
+        results.append({"students": n, "cold_ms": round(cold, 3), **summarise(samples),
+                        "stages": stage_timings.stats()})
+    Base.metadata.drop_all(bind=engine)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes=DEFAULT_SIZES, frames=20, probes=200, backend="synthetic", profile="balanced",
+        mode="single", precision="float32", gallery_cache_mb=256):
+    use_backend(backend)
+    if not get_backend().available():
+        raise SystemExit(f"Face backend '{backend}' is not available here")
+    app.config["GALLERY_PRECISION"] = precision
+    gallery_cache.configure(max_bytes=gallery_cache_mb * 1024 * 1024)
+    with open(SAMPLE_FRAME, "rb") as f:
+        frame = f.read()
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "backend": backend,
+            "encoder_version": encoder_version(),
+            "profile": profile,
+            "mode": mode,
+            "precision": precision,
+            "frame": os.path.relpath(SAMPLE_FRAME, ROOT),
+        },
+        "stages": bench_stages(frame, profile, frames),
+        "gallery": bench_gallery(sizes, probes),
+        "end_to_end": bench_end_to_end(sizes, frame, profile, frames, mode),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated class sizes (default %(default)s)")
+    parser.add_argument("--frames", type=int, default=20, help="timed frames per size (default %(default)s)")
+    parser.add_argument("--probes", type=int, default=200, help="gallery probes per size (default %(default)s)")
+    parser.add_argument("--backend", default="synthetic", help="face backend (default %(default)s)")
+    parser.add_argument("--profile", default="balanced", help="speed profile (default %(default)s)")
+    parser.add_argument("--mode", choices=("single", "multi"), default="single")
+    parser.add_argument("--precision", choices=GALLERY_PRECISIONS, default="float32",
+                        help="GALLERY_PRECISION for the end-to-end runs (default %(default)s)")
+    parser.add_argument("--gallery-cache-mb", type=int, default=256)
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    results = run(sizes=[int(s) for s in args.sizes.split(",") if s], frames=args.frames, probes=args.probes,
+                  backend=args.backend, profile=args.profile, mode=args.mode, precision=args.precision,
+                  gallery_cache_mb=args.gallery_cache_mb)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -29,7 +29,8 @@ class ProductionConfig:
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(minutes=int(config['AUTH']['access_expires_minutes']))
     JWT_REFRESH_TOKEN_EXPIRES = timedelta(days=int(config['AUTH']['refresh_expires_days']))
 
-    JWT_TOKEN_LOCATION = ['cookies']
+    # kiosk device tokens (see KIOSK_TOKEN_EXPIRES_DAYS) come in the Authorization header
+    JWT_TOKEN_LOCATION = ['cookies', 'headers']
     JWT_ACCESS_COOKIE_NAME = 'access_token'
     JWT_REFRESH_COOKIE_NAME = 'refresh_token'
 
@@ -37,6 +38,77 @@ class ProductionConfig:
     JWT_COOKIE_SAMESITE = 'Lax'
     JWT_COOKIE_CSRF_PROTECT = False
 
+    GALLERY_CACHE_MAX_BYTES = 256 * 1024 * 1024
+    # 'float32', or 'float16' / 'int8' to shrink cached galleries 2x / 4x; the GALLERY_RERANK
+    # closest rows per face are then re-scored at full precision (read from the DB).
+    # int8 scans about as fast as float32, float16 is slower (NumPy converts it in software).
+    # `flask gallery-recall` measures the recall loss on the enrolled embeddings.
+    GALLERY_PRECISION = os.getenv('GALLERY_PRECISION', 'float32')
+    GALLERY_RERANK = 8
+    # directory of memory-mapped per-class gallery files shared by all workers (None = off)
+    GALLERY_STORE_DIR = os.getenv('GALLERY_STORE_DIR')
+
+    # 'dlib' (face_recognition) or 'synthetic' (deterministic, no dlib needed)
+    FACE_BACKEND = os.getenv('FACE_BACKEND', 'dlib')
+
+    # face detection/encoding process pool, sized independently of web workers
+    RECOGNITION_WORKERS = int(os.getenv('RECOGNITION_WORKERS', 2))
+    RECOGNITION_QUEUE_SIZE = int(os.getenv('RECOGNITION_QUEUE_SIZE', 8))
+    RECOGNITION_TIMEOUT_SECONDS = 10
+    RECOGNITION_RETRY_AFTER_SECONDS = 1
+    RECOGNITION_SPEED_PROFILE = 'balanced'
+    # concurrent kiosk frames are collected for up to this long and detected, encoded and
+    # matched as one batch (0 = off: every frame goes on its own)
+    RECOGNITION_BATCH_WINDOW_MS = float(os.getenv('RECOGNITION_BATCH_WINDOW_MS', 4))
+    RECOGNITION_MAX_BATCH = int(os.getenv('RECOGNITION_MAX_BATCH', 16))
+    # face chips per mode=chips upload (kiosks that crop faces themselves)
+    KIOSK_MAX_CHIPS = 10
+
+    # kiosk frames are only accepted while the teacher has an attendance session open
+    ATTENDANCE_REQUIRE_SESSION = os.getenv('ATTENDANCE_REQUIRE_SESSION', 'true').lower() == 'true'
+    ATTENDANCE_SESSION_MINUTES = 15      # default length of a session opened without a window
+    ATTENDANCE_SESSION_MAX_MINUTES = 240
+
+    # kiosk device tokens: lifetime, classes per token, and how often each worker re-reads
+    # which devices are still in force (the delay before a revocation reaches every worker)
+    KIOSK_TOKEN_EXPIRES_DAYS = 180
+    KIOSK_DEVICE_MAX_CLASSES = 20
+    KIOSK_DEVICE_REFRESH_SECONDS = 30
+
+    # reject blurred / dark / too-small-face kiosk frames before encoding (None = off);
+    # see Helpers.DEFAULT_QUALITY_GATE for what each threshold measures
+    FRAME_QUALITY_GATE = {'min_brightness': 35, 'max_brightness': 240, 'min_sharpness': 40.0, 'min_face': 64}
+
+    # repeat-frame short-circuit: dHash bit distance and reuse window per kiosk
+    FRAME_CACHE_WINDOW_SECONDS = 3.0
+    FRAME_CACHE_MAX_DISTANCE = 4
+
+    # next_capture_ms returned to kiosks: min_ms right after someone is marked, base_ms
+    # while a face is in view, up to max_ms in an empty room; up to (1 + busy_factor)x
+    # longer when the recognition pool is full (see KioskState.KioskPacing)
+    KIOSK_PACING = {'min_ms': 500, 'base_ms': 2000, 'max_ms': 8000, 'busy_factor': 3.0}
+
+    # face-region tracking between a kiosk's frames (multi-face mode)
+    TRACKER_FULL_SCAN_EVERY = 4           # every Nth frame still scans the whole frame
+    TRACKER_MAX_AGE_SECONDS = 3.0
+    TRACKER_CONFIDENT_DISTANCE = 0.45     # tracked matches this close aren't re-encoded
+
+    # kiosk WebSocket stream (flask-sock): keepalive pings so proxies don't drop idle kiosks
+    SOCK_SERVER_OPTIONS = {'ping_interval': 25}
+
+    # background threads feeding student photo encodings into the recognition pool
+    ENROLLMENT_THREADS = int(os.getenv('ENROLLMENT_THREADS', 2))
+
+    # share the per-class "present today" sets between workers, e.g. redis://localhost:6379/0
+    PRESENT_SET_REDIS_URL = os.getenv('PRESENT_SET_REDIS_URL')
+
+    # school-wide face index for /api/recognition/identify (IVF, see FaceIndex.py)
+    FACE_INDEX_PATH = os.getenv('FACE_INDEX_PATH', 'face_index.npz')
+    FACE_INDEX_LISTS = 0                  # k-means buckets, 0 = ~sqrt(number of students)
+    FACE_INDEX_PROBES = 8                 # buckets scanned per search
+    FACE_INDEX_SYNC_SECONDS = 60          # re-sync with the DB at least this often (other workers' commits)
+    IDENTIFY_MAX_CANDIDATES = 20
+
 
 class TestConfig:
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
@@ -52,4 +124,51 @@ class TestConfig:
 
     JWT_COOKIE_SECURE = False        # True on HTTPS
     JWT_COOKIE_SAMESITE = 'Lax'
-    JWT_COOKIE_CSRF_PROTECT = False
\ No newline at end of file
+    JWT_COOKIE_CSRF_PROTECT = False
+
+    GALLERY_CACHE_MAX_BYTES = 16 * 1024 * 1024
+    GALLERY_PRECISION = 'float32'
+    GALLERY_RERANK = 8
+    GALLERY_STORE_DIR = None
+
+    FACE_BACKEND = 'synthetic'
+
+    RECOGNITION_WORKERS = 0          # run inline
+    RECOGNITION_QUEUE_SIZE = 8
+    RECOGNITION_TIMEOUT_SECONDS = 10
+    RECOGNITION_RETRY_AFTER_SECONDS = 1
+    RECOGNITION_SPEED_PROFILE = 'balanced'
+    RECOGNITION_BATCH_WINDOW_MS = 0
+    RECOGNITION_MAX_BATCH = 16
+    KIOSK_MAX_CHIPS = 10
+    ATTENDANCE_REQUIRE_SESSION = False
+    ATTENDANCE_SESSION_MINUTES = 15
+    ATTENDANCE_SESSION_MAX_MINUTES = 240
+    KIOSK_TOKEN_EXPIRES_DAYS = 180
+    KIOSK_DEVICE_MAX_CLASSES = 20
+    KIOSK_DEVICE_REFRESH_SECONDS = 30
+
+    # reject blurred / dark / too-small-face kiosk frames before encoding (None = off);
+    # see Helpers.DEFAULT_QUALITY_GATE for what each threshold measures
+    FRAME_QUALITY_GATE = {'min_brightness': 35, 'max_brightness': 240, 'min_sharpness': 40.0, 'min_face': 64}
+
+    # repeat-frame short-circuit: dHash bit distance and reuse window per kiosk
+    FRAME_CACHE_WINDOW_SECONDS = 3.0
+    FRAME_CACHE_MAX_DISTANCE = 4
+
+    KIOSK_PACING = {'min_ms': 500, 'base_ms': 2000, 'max_ms': 8000, 'busy_factor': 3.0}
+
+    # face-region tracking between a kiosk's frames (multi-face mode)
+    TRACKER_FULL_SCAN_EVERY = 4           # every Nth frame still scans the whole frame
+    TRACKER_MAX_AGE_SECONDS = 3.0
+    TRACKER_CONFIDENT_DISTANCE = 0.45     # tracked matches this close aren't re-encoded
+
+    PRESENT_SET_REDIS_URL = None
+
+    FACE_INDEX_PATH = None           # in memory only
+    FACE_INDEX_LISTS = 0
+    FACE_INDEX_PROBES = 8
+    FACE_INDEX_SYNC_SECONDS = 60
+    IDENTIFY_MAX_CANDIDATES = 20
+
+    ENROLLMENT_THREADS = 0           # encode inline
@@ -0,0 +1,144 @@
+import os, sys
+import io
+import unittest
+import json
+from datetime import datetime, timedelta
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import TestConfig
+from app import app, SessionLocal, engine, present_set
+from Models import Teacher, Base, User, Student, Class, Attendance, AttendanceSession
+from Gallery import gallery_cache
+from KioskState import frame_cache, face_tracker
+from unittest.mock import patch
+
+
+class TestAttendanceSessions(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object(TestConfig)  # Use test configuration
+        app.config['ATTENDANCE_REQUIRE_SESSION'] = True
+        self.client = app.test_client()
+        Base.metadata.create_all(bind=engine)
+        self.session = SessionLocal()
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(scale=0.1, size=(3, 128))
+        self.teacher = Teacher(name="Teacher", email="teacher@gmail.com", password="password")
+        self.students = [Student(name=f"Student{i}", email=f"student{i}@gmail.com", password="password") for i in range(3)]
+        for student, vec in zip(self.students, self.vectors):
+            student.face_vector = vec
+        self.session.add(self.teacher)
+        self.session.add_all(self.students)
+        self.session.commit()
+        self.class_ = Class(teacher_id=self.teacher.id, class_name="class")
+        self.class_.students.extend(self.students)
+        self.session.add(self.class_)
+        self.session.commit()
+        self.client.post('/api/auth/login', json={"email": "teacher@gmail.com", "password": "password"})
+        self.base = f'/api/classes/{self.class_.id}/attendance'
+
+    def tearDown(self):
+        app.config.from_object(TestConfig)
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        self.session.query(AttendanceSession).delete()
+        self.session.query(Attendance).delete()
+        self.session.query(Class).delete()
+        self.session.query(Teacher).delete()
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def post_frame(self):
+        frame_cache.clear()
+        return self.client.post(f'{self.base}/mark', data={"frame": (io.BytesIO(b"frame"), "frame.jpg")},
+                                content_type='multipart/form-data')
+
+    def open_session(self, **body):
+        response = self.client.post(f'{self.base}/sessions', json=body)
+        return response.status_code, json.loads(response.data.decode())
+
+    def test_open_prewarms_and_is_reused(self):
+        status, data = self.open_session(minutes=30)
+        self.assertEqual(status, 201)
+        self.assertEqual((data['prewarm']['students'], data['prewarm']['present']), (3, 0))
+        self.assertIn(self.class_.id, gallery_cache)
+
+        status, again = self.open_session()
+        self.assertEqual(status, 200)
+        self.assertEqual(again['session']['id'], data['session']['id'])
+
+        now = datetime.now()
+        status, _ = self.open_session(starts_at=(now + timedelta(minutes=10)).isoformat(),
+                                      ends_at=(now + timedelta(minutes=50)).isoformat())
+        self.assertEqual(status, 409)
+        self.assertEqual(self.open_session(minutes="soon")[0], 400)
+        self.assertEqual(self.open_session(minutes=-5)[0], 400)
+        self.assertEqual(self.open_session(minutes=TestConfig.ATTENDANCE_SESSION_MAX_MINUTES + 1)[0], 400)
+
+    def test_out_of_range_minutes(self):
+        for body in ('{"minutes": 1e12}', '{"minutes": -1e12}', '{"minutes": Infinity}', '{"minutes": NaN}'):
+            response = self.client.post(f'{self.base}/sessions', data=body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+        # an explicit window past what datetime can hold
+        self.assertEqual(self.open_session(starts_at="0001-01-01T00:00:00+14:00", ends_at="9999-12-31T23:59:59-14:00")[0], 400)
+
+    def test_frames_need_an_open_session(self):
+        with patch('app.analyse_frame', return_value=(self.vectors[1] + 0.001, {})) as analyse:
+            response = self.post_frame()
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(json.loads(response.data.decode())['reason'], "no_session")
+            analyse.assert_not_called()
+
+            self.open_session()
+            self.assertEqual(self.post_frame().status_code, 200)
+
+    def test_close_marks_the_rest_absent(self):
+        _, data = self.open_session()
+        with patch('app.analyse_frame', return_value=(self.vectors[1] + 0.001, {})):
+            self.assertEqual(self.post_frame().status_code, 200)
+
+        response = self.client.post(f'{self.base}/sessions/{data["session"]["id"]}/close')
+        self.assertEqual(response.status_code, 200)
+        closed = json.loads(response.data.decode())
+        self.assertEqual((closed['absent'], closed['session']['absent_marked']), (2, 2))
+        self.assertIsNotNone(closed['session']['closed_at'])
+
+        rows = {r.student_id: r.attended for r in self.session.query(Attendance).filter_by(class_id=self.class_.id)}
+        self.assertEqual(rows, {self.students[0].id: False, self.students[1].id: True, self.students[2].id: False})
+
+        self.assertEqual(self.client.post(f'{self.base}/sessions/{data["session"]["id"]}/close').status_code, 409)
+        self.assertEqual(self.post_frame().status_code, 409)
+
+    def test_expired_session_is_closed_lazily(self):
+        now = datetime.now()
+        self.session.add(AttendanceSession(class_id=self.class_.id, opened_by=self.teacher.id,
+                                           starts_at=now - timedelta(minutes=30), ends_at=now - timedelta(minutes=5)))
+        self.session.commit()
+        self.assertEqual(self.post_frame().status_code, 409)
+
+        response = self.client.get(f'{self.base}/sessions')
+        sessions = json.loads(response.data.decode())['sessions']
+        self.assertEqual(len(sessions), 1)
+        self.assertFalse(sessions[0]['open'])
+        self.assertEqual(sessions[0]['absent_marked'], 3)
+        self.assertEqual(self.session.query(Attendance).filter_by(attended=False).count(), 3)
+
+    def test_other_teachers_class(self):
+        other = Teacher(name="Other", email="other@gmail.com", password="password")
+        self.session.add(other)
+        self.session.commit()
+        self.client.post('/api/auth/login', json={"email": "other@gmail.com", "password": "password"})
+        self.assertEqual(self.open_session()[0], 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import os, sys
+import json
+import tempfile
+import unittest
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks import bench_recognition
+from FaceBackends import get_backend, use_backend
+
+
+class TestRecognitionBenchmarks(unittest.TestCase):
+    def setUp(self):
+        self.previous = get_backend().name
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def test_writes_json_results(self):
+        output = os.path.join(tempfile.mkdtemp(), 'bench.json')
+        bench_recognition.main(['--sizes', '10,50', '--frames', '2', '--probes', '5', '--output', output])
+        with open(output) as f:
+            results = json.load(f)
+
+        self.assertEqual(results['meta']['backend'], 'synthetic')
+        self.assertEqual(set(results['stages']), {'decode', 'detect', 'encode'})
+        self.assertEqual([(r['students'], r['precision']) for r in results['gallery']],
+                         [(n, p) for n in (10, 50) for p in ('float32', 'float16', 'int8')])
+        self.assertEqual([r['students'] for r in results['end_to_end']], [10, 50])
+        for r in results['end_to_end']:
+            self.assertEqual(r['n'], 2)
+            self.assertIn('match', r['stages'])
+            self.assertGreater(r['p95_ms'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+import os, sys
+import io
+import threading
+import unittest
+import json
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import TestConfig
+from app import app, SessionLocal, engine, present_set
+from Models import Teacher, Base, User, Student, Class, Attendance, FACE_PENDING, FACE_READY, FACE_FAILED
+from Gallery import gallery_cache
+from KioskState import frame_cache, face_tracker
+from Enrollment import EnrollmentQueue, enrollment_queue
+from unittest.mock import patch
+
+
+class TestEnrollmentQueue(unittest.TestCase):
+    def test_worker_threads_drain_the_queue(self):
+        q = EnrollmentQueue(threads=2)
+        done, lock = [], threading.Lock()
+
+        def process(student_id, image):
+            with lock:
+                done.append(student_id)
+
+        with patch.object(q, '_process', side_effect=process):
+            for i in range(10):
+                q.enqueue(i, f'./images/{i}.jpg')
+            q.join()
+        self.assertEqual(sorted(done), list(range(10)))
+        self.assertEqual(q.pending, 0)
+
+
+class TestStudentEnrollment(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object(TestConfig)  # Use test configuration
+        self.client = app.test_client()
+        Base.metadata.create_all(bind=engine)
+        self.session = SessionLocal()
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+
+        self.teacher = Teacher(name="Teacher", email="teacher@gmail.com", password="password")
+        self.session.add(self.teacher)
+        self.session.commit()
+        self.class_ = Class(teacher_id=self.teacher.id, class_name="class")
+        self.session.add(self.class_)
+        self.session.commit()
+
+    def tearDown(self):
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        self.session.query(Attendance).delete()
+        self.session.query(Class).delete()
+        self.session.query(Teacher).delete()
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def register(self):
+        with open('./images/lebron.jpg', 'rb') as f:
+            return self.client.post('/api/students', content_type='multipart/form-data',
+                                    data={"name": "Lebron", "email": "lebron@gmail.com", "password": "password",
+                                          "confirmPassword": "password", "image": (io.BytesIO(f.read()), "lebron.jpg")})
+
+    def test_register_returns_before_encoding(self):
+        with patch('app.enrollment_queue.enqueue') as enqueue:
+            response = self.register()
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['face_status'], FACE_PENDING)
+        enqueue.assert_called_once_with(data['student_id'], './images/lebron.jpg')
+
+        student = self.session.get(Student, data['student_id'])
+        self.assertEqual(student.face_status, FACE_PENDING)
+        self.assertIsNone(student.face_vector)
+
+    def test_status_endpoint(self):
+        student_id = json.loads(self.register().data.decode())['student_id']
+        self.client.post('/api/auth/login', json={"email": "lebron@gmail.com", "password": "password"})
+        data = json.loads(self.client.get('/api/students/enrollment').data.decode())
+        self.assertEqual(data['face_status'], FACE_READY)   # TestConfig encodes inline
+        self.assertIsNotNone(self.session.get(Student, student_id).face_vector)
+
+    def test_pending_students_are_left_out_of_the_gallery(self):
+        from app import load_class_gallery
+        ready = Student(name="Ready", email="ready@gmail.com", password="password", image='./images/lebron.jpg')
+        pending = Student(name="Pending", email="pending@gmail.com", password="password",
+                          image='./images/pewdiepie.jpg', encode=False)
+        self.class_.students.extend([ready, pending])
+        self.session.commit()
+
+        with app.test_request_context():
+            from flask import g
+            g.session = self.session
+            self.assertEqual(load_class_gallery(self.class_.id).ids.tolist(), [ready.id])
+
+            enrollment_queue.configure(session_factory=SessionLocal)
+            enrollment_queue.enqueue(pending.id, pending.image)
+            self.session.expire_all()
+            self.assertEqual(pending.face_status, FACE_READY)
+            self.assertEqual(sorted(load_class_gallery(self.class_.id).ids.tolist()), sorted([ready.id, pending.id]))
+
+    def test_failed_encoding(self):
+        student = Student(name="Blank", email="blank@gmail.com", password="password",
+                          image='./images/lebron.jpg', encode=False)
+        self.session.add(student)
+        self.session.commit()
+        enrollment_queue.configure(session_factory=SessionLocal)
+        with patch('Enrollment.recognition_pool.run', return_value=None):
+            enrollment_queue.enqueue(student.id, student.image)
+        self.session.expire_all()
+        self.assertEqual(student.enrollment_status, FACE_FAILED)
+
+    def test_gives_up_when_the_pool_stays_busy(self):
+        from Recognition import RecognitionBusy
+        student = Student(name="Slow", email="slow@gmail.com", password="password",
+                          image='./images/lebron.jpg', encode=False)
+        self.session.add(student)
+        self.session.commit()
+        q = EnrollmentQueue(session_factory=SessionLocal, threads=0, retry_delay=0, max_attempts=3)
+        with patch('Enrollment.recognition_pool.run', side_effect=RecognitionBusy(retry_after=0)) as run, \
+                patch('Enrollment.time.sleep'):
+            q.enqueue(student.id, student.image)
+        self.assertEqual(run.call_count, 3)
+        self.assertEqual(q.stats()['failed'], 1)
+        self.session.expire_all()
+        self.assertEqual(student.enrollment_status, FACE_FAILED)
+
+
+if __name__ == '__main__':
+    unittest.main()
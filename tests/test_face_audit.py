@@ -0,0 +1,108 @@
+import os, sys
+import json
+import tempfile
+import unittest
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import app, SessionLocal, engine
+from Models import Base, User, Student
+from Helpers import encoder_version
+from FaceAudit import duplicate_pairs
+
+
+def brute_force(vectors, threshold):
+    pairs = set()
+    for i in range(len(vectors)):
+        for j in range(i + 1, len(vectors)):
+            if np.linalg.norm(vectors[i] - vectors[j]) <= threshold:
+                pairs.add((i, j))
+    return pairs
+
+
+class TestDuplicatePairs(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(scale=0.09, size=(60, 128))
+        # plant near-duplicates, including a group of three
+        for a, b in [(3, 41), (10, 11), (20, 59), (20, 33)]:
+            self.vectors[b] = self.vectors[a] + rng.normal(scale=0.01, size=128)
+
+    def test_blocks_match_brute_force(self):
+        expected = brute_force(self.vectors, 0.45)
+        self.assertGreaterEqual(len(expected), 5)
+        for block in (7, 16, 1024):
+            i, j, dist = duplicate_pairs(self.vectors, 0.45, block=block)
+            self.assertEqual(set(zip(i.tolist(), j.tolist())), expected)
+            self.assertTrue(np.all(np.diff(dist) >= 0))
+
+    def test_queries_only_pairs_involving_them(self):
+        expected = {p for p in brute_force(self.vectors, 0.45) if 20 in p or 41 in p or 33 in p}
+        i, j, _ = duplicate_pairs(self.vectors, 0.45, block=8, queries=[41, 20, 33])
+        pairs = list(zip(i.tolist(), j.tolist()))
+        self.assertEqual(len(pairs), len(set(pairs)))      # (20, 33) only once
+        self.assertEqual(set(pairs), expected)
+        self.assertEqual(len(duplicate_pairs(self.vectors, 0.45, queries=[])[0]), 0)
+
+
+class TestAuditCommand(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(bind=engine)
+        self.session = SessionLocal()
+        self.output = os.path.join(tempfile.mkdtemp(), 'duplicates.json')
+        rng = np.random.default_rng(1)
+        self.vectors = rng.normal(scale=0.09, size=(4, 128))
+        self.vectors[1] = self.vectors[0] + 0.001
+        self.students = []
+        for i, vec in enumerate(self.vectors):
+            student = Student(name=f"Student{i}", email=f"student{i}@gmail.com", password="password")
+            student.face_vector = vec
+            student.face_encoder_version = encoder_version()
+            self.students.append(student)
+        self.session.add_all(self.students)
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def audit(self, *args):
+        result = app.test_cli_runner().invoke(args=['audit-duplicate-faces', '--output', self.output, *args])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with open(self.output) as f:
+            return json.load(f)
+
+    def test_full_then_incremental(self):
+        report = self.audit()
+        self.assertEqual((report['students'], report['checked']), (4, 4))
+        self.assertEqual([(p['student_a']['id'], p['student_b']['id']) for p in report['pairs']],
+                         [(self.students[0].id, self.students[1].id)])
+
+        # a new account with student 2's face, and student 3 re-enrolled as student 0
+        twin = Student(name="Twin", email="twin@gmail.com", password="password")
+        twin.face_vector = self.vectors[2] + 0.002
+        twin.face_encoder_version = encoder_version()
+        self.session.add(twin)
+        self.students[3].face_vector = self.vectors[0] + 0.003
+        self.session.commit()
+
+        report = self.audit('--incremental')
+        self.assertTrue(report['incremental'])
+        self.assertEqual((report['students'], report['checked']), (5, 2))
+        pairs = {(p['student_a']['id'], p['student_b']['id']) for p in report['pairs']}
+        ids = [s.id for s in self.students]
+        self.assertEqual(pairs, {(ids[0], ids[1]), (ids[2], twin.id), (ids[0], ids[3]), (ids[1], ids[3])})
+        self.assertEqual(report['pairs'][0]['student_a']['email'], "student0@gmail.com")
+
+        # nothing changed since: nothing to check, the report stands
+        report = self.audit('--incremental')
+        self.assertEqual((report['checked'], len(report['pairs'])), (0, 4))
+
+    def test_incremental_without_previous_run_checks_everyone(self):
+        self.assertEqual(self.audit('--incremental')['checked'], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import os, sys
+import io
+import tempfile
+import unittest
+import json
+from PIL import Image, ImageFilter
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import TestConfig
+from app import app, SessionLocal, engine, present_set
+from Models import Teacher, Base, User, Student, Class, Attendance
+from Gallery import gallery_cache
+from KioskState import frame_cache, face_tracker
+from FaceBackends import get_backend, use_backend
+from Recognition import frame_quality
+import Helpers
+
+# where the synthetic backend finds the face in lebron.jpg (1200x900)
+LEBRON_BOX = (225, 900, 675, 300)
+FIVE_POINTS = [[40, 50], [60, 50], [100, 50], [80, 50], [70, 90]]
+
+
+def lebron_chip(size=160, transform=None):
+    """lebron.jpg cropped the way a kiosk would: the face box plus CHIP_MARGIN, scaled down."""
+    t, r, b, l = LEBRON_BOX
+    mx, my = (r - l) * Helpers.CHIP_MARGIN, (b - t) * Helpers.CHIP_MARGIN
+    chip = Image.open('./images/lebron.jpg').convert("RGB").crop((int(l - mx), int(t - my), int(r + mx), int(b + my)))
+    chip = chip.resize((size, round(size * chip.size[1] / chip.size[0])))
+    if transform:
+        chip = transform(chip)
+    buf = io.BytesIO()
+    chip.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+class TestAnalyseChips(unittest.TestCase):
+    def setUp(self):
+        self.previous = get_backend().name
+        use_backend("synthetic")
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def test_chip_box(self):
+        self.assertEqual(Helpers.chip_box(140, 140), (20, 120, 120, 20))
+
+    def test_chip_encodes_like_a_frame_of_it(self):
+        # the synthetic backend finds its one face in the chip's centre, like chip_box
+        (_, frame), = Helpers.analyse_frame(lebron_chip(), "balanced", multi=True)[0]
+        faces, timings = Helpers.analyse_chips([lebron_chip(), b"not an image"], "balanced")
+        self.assertEqual(len(faces), 1)
+        self.assertLess(float(((faces[0][1] - frame) ** 2).sum() ** 0.5), 1e-9)
+        self.assertNotIn("detect", timings)
+        self.assertIn("encode", timings)
+
+    def test_quality_gate(self):
+        blurred = lebron_chip(transform=lambda im: im.filter(ImageFilter.GaussianBlur(4)))
+        faces, _ = Helpers.analyse_chips([blurred, lebron_chip()], "balanced", quality=Helpers.DEFAULT_QUALITY_GATE)
+        self.assertEqual(len(faces), 1)
+        with self.assertRaises(Helpers.FrameRejected) as ctx:
+            Helpers.analyse_chips([lebron_chip(size=48)], "balanced", quality=Helpers.DEFAULT_QUALITY_GATE)
+        self.assertEqual(ctx.exception.reason, "face_too_small")
+
+
+class TestMarkAttendanceChips(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object(TestConfig)  # Use test configuration
+        self.previous = get_backend().name
+        use_backend("synthetic")
+        self.client = app.test_client()
+        Base.metadata.create_all(bind=engine)
+        self.session = SessionLocal()
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        frame_quality.clear()
+
+        # enrolled from the chip itself: the synthetic backend only matches the same picture
+        photo = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
+        photo.write(lebron_chip())
+        photo.close()
+        self.addCleanup(os.remove, photo.name)
+        self.teacher = Teacher(name="Teacher", email="teacher@gmail.com", password="password")
+        self.lebron = Student(name="Lebron", email="lebron@gmail.com", password="password", image=photo.name)
+        self.session.add_all([self.teacher, self.lebron])
+        self.session.commit()
+        self.class_ = Class(teacher_id=self.teacher.id, class_name="class")
+        self.class_.students.append(self.lebron)
+        self.session.add(self.class_)
+        self.session.commit()
+        self.client.post('/api/auth/login', json={"email": "teacher@gmail.com", "password": "password"})
+
+    def tearDown(self):
+        use_backend(self.previous)
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        frame_quality.clear()
+        self.session.query(Attendance).delete()
+        self.session.query(Class).delete()
+        self.session.query(Teacher).delete()
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def post_chips(self, chips, landmarks=None):
+        data = {"mode": "chips", "chip": [(io.BytesIO(c), f"chip{i}.jpg") for i, c in enumerate(chips)]}
+        if landmarks is not None:
+            data["landmarks"] = json.dumps(landmarks)
+        return self.client.post(f'/api/classes/{self.class_.id}/attendance/mark',
+                                data=data, content_type='multipart/form-data')
+
+    def test_chip_marks_student(self):
+        response = self.post_chips([lebron_chip()])
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['faces'][0]['matched_student']['id'], self.lebron.id)
+        self.assertEqual(set(data['timings_ms']), {"decode", "quality", "encode", "queue", "match"})
+        self.assertEqual(self.session.query(Attendance).filter_by(student_id=self.lebron.id).count(), 1)
+
+    def test_chips_with_landmarks(self):
+        response = self.post_chips([lebron_chip(), lebron_chip()], landmarks=[FIVE_POINTS, None])
+        self.assertEqual(response.status_code, 200)
+        statuses = [f['status'] for f in json.loads(response.data.decode())['faces']]
+        self.assertEqual(sorted(statuses), ["duplicate", "matched"])
+
+    def test_bad_uploads(self):
+        self.assertEqual(self.post_chips([]).status_code, 400)
+        self.assertEqual(self.post_chips([lebron_chip()] * (TestConfig.KIOSK_MAX_CHIPS + 1)).status_code, 400)
+        self.assertEqual(self.post_chips([lebron_chip()], landmarks=[FIVE_POINTS[:3]]).status_code, 400)
+        self.assertEqual(self.post_chips([lebron_chip()], landmarks=[FIVE_POINTS, None]).status_code, 400)
+
+    def test_rejected_chips_are_counted(self):
+        response = self.post_chips([lebron_chip(size=48)])
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(json.loads(response.data.decode())['reason'], "face_too_small")
+        self.assertEqual(frame_quality.stats(self.class_.id)['rejected'], {"face_too_small": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import os, sys
+import json
+import tempfile
+import unittest
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import TestConfig
+from app import app, SessionLocal, engine
+from Models import Teacher, Base, User, Student
+from FaceIndex import FaceIndex, face_index
+from FaceBackends import get_backend, use_backend
+
+
+def clustered(n, centres=50, seed=0):
+    rng = np.random.default_rng(seed)
+    means = rng.normal(scale=0.3, size=(centres, 128))
+    return means[rng.integers(0, centres, size=n)] + rng.normal(scale=0.05, size=(n, 128))
+
+
+class TestFaceIndex(unittest.TestCase):
+    def setUp(self):
+        self.vectors = clustered(3000)
+        self.ids = np.arange(1, 3001)
+        self.index = FaceIndex(nlist=50, nprobe=8).build(self.ids, self.vectors)
+
+    def exact(self, probe, k):
+        dists = np.linalg.norm(self.vectors - probe, axis=1)
+        return [int(self.ids[i]) for i in np.argsort(dists)[:k]]
+
+    def test_search_matches_a_flat_scan(self):
+        self.assertEqual(self.index.stats()['lists'], 50)
+        rng = np.random.default_rng(1)
+        probes = self.vectors[:200] + rng.normal(scale=0.02, size=(200, 128))
+        hits = sum(self.index.search(p, k=1)[0].student_id == self.exact(p, 1)[0] for p in probes)
+        self.assertGreaterEqual(hits / len(probes), 0.95)
+
+        # probing every bucket is exact
+        top = self.index.search(probes[0], k=5, nprobe=50)
+        self.assertEqual([c.student_id for c in top], self.exact(probes[0], 5))
+        self.assertEqual([c.distance for c in top], sorted(c.distance for c in top))
+
+    def test_insert_and_delete(self):
+        probe = np.full(128, 5.0)
+        self.index.add(9999, probe)
+        self.assertEqual(self.index.search(probe, k=1)[0], (9999, 0.0))
+        self.index.remove(9999)
+        self.index.remove(1)
+        self.assertEqual(len(self.index), 2999)
+        self.assertNotIn(1, [c.student_id for c in self.index.search(self.vectors[0], k=3, nprobe=50)])
+
+    def test_save_load_and_sync(self):
+        path = os.path.join(tempfile.mkdtemp(), 'index.npz')
+        self.index.build(self.ids, self.vectors, encoder_version=7)
+        self.index.save(path)
+
+        rows = [(int(i), v) for i, v in zip(self.ids[1:], self.vectors[1:])] + [(5000, np.full(128, 5.0))]
+        restored = FaceIndex(nlist=50, nprobe=8).ensure_loaded(path, lambda: rows, encoder_version=7)
+        self.assertEqual(restored.trained_size, 3000)       # centroids came from the file
+        self.assertNotIn(1, restored)
+        self.assertEqual(restored.search(np.full(128, 5.0), k=1)[0].student_id, 5000)
+        np.testing.assert_array_equal(restored.centroids, self.index.centroids)
+
+        # an index from another encoder is retrained from the rows instead
+        rebuilt = FaceIndex(nlist=10).ensure_loaded(path, lambda: rows, encoder_version=8)
+        self.assertEqual((rebuilt.trained_size, rebuilt.stats()['lists']), (3000, 10))
+
+    def test_workers_follow_each_others_commits(self):
+        path = os.path.join(tempfile.mkdtemp(), 'index.npz')
+        db = {int(i): v for i, v in zip(self.ids[:100], self.vectors[:100])}
+        a = FaceIndex(nlist=5, sync_seconds=60).ensure_loaded(path, lambda: db.items(), now=0.0)
+        b = FaceIndex(nlist=5, sync_seconds=60).ensure_loaded(path, lambda: db.items(), now=0.0)
+        self.assertTrue(os.path.exists(path))      # built by a, loaded by b
+        self.assertEqual(a.syncs + b.syncs, 2)
+
+        # worker a commits a new enrollment and a deletion: only its own hook sees them
+        probe = np.full(128, 5.0)
+        db[5000] = probe
+        del db[1]
+        a.apply({5000: probe, 1: None})
+        b.ensure_loaded(path, lambda: db.items(), now=1.0)    # the saved file changed
+        self.assertEqual(b.search(probe, k=1)[0].student_id, 5000)
+        self.assertNotIn(1, b)
+        self.assertEqual(b.ensure_loaded(path, lambda: db.items(), now=2.0).syncs, 2)
+
+        # without a shared file (or a lost save) the timed sync still catches up
+        a.path = b.path = None
+        del db[2]
+        a.ensure_loaded(None, lambda: db.items(), now=30.0)
+        self.assertIn(2, a)
+        a.ensure_loaded(None, lambda: db.items(), now=61.0)
+        self.assertNotIn(2, a)
+
+    def test_small_and_empty(self):
+        index = FaceIndex(nlist=0).build([], [])
+        self.assertEqual(index.search(np.zeros(128)), [])
+        index.add(1, np.zeros(128))
+        self.assertEqual(index.search(np.zeros(128))[0].student_id, 1)
+
+
+class TestIdentify(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object(TestConfig)  # Use test configuration
+        self.previous = get_backend().name
+        use_backend("synthetic")
+        self.client = app.test_client()
+        Base.metadata.create_all(bind=engine)
+        self.session = SessionLocal()
+        face_index.clear()
+
+        self.teacher = Teacher(name="Teacher", email="teacher@gmail.com", password="password")
+        self.students = [Student(name=name, email=f"{name}@gmail.com", password="password", image=f'./images/{name}.jpg')
+                         for name in ("lebron", "pewdiepie", "cristiano")]
+        self.session.add(self.teacher)
+        self.session.add_all(self.students)
+        self.session.commit()
+        self.client.post('/api/auth/login', json={"email": "teacher@gmail.com", "password": "password"})
+
+    def tearDown(self):
+        use_backend(self.previous)
+        face_index.clear()
+        self.session.query(Teacher).delete()
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def identify(self, image, **params):
+        with open(image, 'rb') as img:
+            response = self.client.post('/api/recognition/identify', data={"frame": img, **params},
+                                        content_type='multipart/form-data')
+        return response.status_code, json.loads(response.data.decode())
+
+    def test_identifies_across_the_school(self):
+        status, data = self.identify('./images/lebron.jpg', k=2)
+        self.assertEqual(status, 200)
+        self.assertEqual(len(data['candidates']), 2)
+        self.assertEqual(data['match']['id'], self.students[0].id)
+        self.assertIn('search', data['timings_ms'])
+        self.assertTrue(face_index.loaded)
+
+    def test_index_follows_enrollment_changes(self):
+        self.identify('./images/lebron.jpg')       # load the index
+        self.session.delete(self.students[0])
+        self.session.commit()
+        status, data = self.identify('./images/lebron.jpg')
+        self.assertIsNone(data['match'])
+        self.assertNotIn('lebron@gmail.com', [c['email'] for c in data['candidates']])
+
+        self.session.add(Student(name="Lebron", email="lebron2@gmail.com", password="password", image='./images/lebron.jpg'))
+        self.session.commit()
+        status, data = self.identify('./images/lebron.jpg')
+        self.assertEqual(data['match']['email'], 'lebron2@gmail.com')
+
+    def test_rebuild_command(self):
+        path = os.path.join(tempfile.mkdtemp(), 'index.npz')
+        app.config['FACE_INDEX_PATH'] = path
+        try:
+            result = app.test_cli_runner().invoke(args=['rebuild-face-index'])
+        finally:
+            app.config['FACE_INDEX_PATH'] = None
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Indexed 3 students', result.output)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(FaceIndex().ensure_loaded(path, lambda: [], encoder_version=get_backend().encoder_version).trained_size, 3)
+
+    def test_bad_k(self):
+        self.assertEqual(self.identify('./images/lebron.jpg', k=0)[0], 400)
+        self.assertEqual(self.identify('./images/lebron.jpg', k=500)[0], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
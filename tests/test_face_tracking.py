@@ -0,0 +1,153 @@
+import os, sys
+import io
+import unittest
+import json
+import numpy as np
+from PIL import Image
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import TestConfig
+from app import app, SessionLocal, engine, present_set
+from Models import Teacher, Base, User, Student, Class, Attendance
+from Gallery import gallery_cache
+from KioskState import FaceTracker, frame_cache, face_tracker
+from FaceBackends import get_backend, use_backend
+import Helpers
+
+
+def face(top, right, bottom, left, student_id=None, distance=0.3):
+    f = {"box": {"top": top, "right": right, "bottom": bottom, "left": left}, "distance": distance,
+         "status": "unknown"}
+    if student_id is not None:
+        f.update({"status": "matched", "matched_student": {"id": student_id, "name": "S", "email": "s@x.com"}})
+    return f
+
+
+class TestFaceTracker(unittest.TestCase):
+    def test_full_scan_cadence(self):
+        tracker = FaceTracker(full_scan_every=3, max_age=10)
+        self.assertIsNone(tracker.tracks("k", 0, now=0))
+        tracker.update("k", 0, [face(10, 60, 60, 10, student_id=1)], full_scan=True, now=0)
+        self.assertEqual(tracker.tracks("k", 0, now=1)[0].student["id"], 1)
+        tracker.update("k", 0, [face(10, 60, 60, 10, student_id=1)], full_scan=False, now=1)
+        self.assertIsNotNone(tracker.tracks("k", 0, now=2))
+        tracker.update("k", 0, [face(10, 60, 60, 10, student_id=1)], full_scan=False, now=2)
+        self.assertIsNone(tracker.tracks("k", 0, now=3))       # third frame since the full scan
+
+    def test_expiry_and_roster_changes(self):
+        tracker = FaceTracker(full_scan_every=10, max_age=3, confident_distance=0.45)
+        tracker.update("k", 0, [face(10, 60, 60, 10, student_id=1), face(10, 160, 60, 110, student_id=2, distance=0.55)],
+                       full_scan=True, now=0)
+        tracks = tracker.tracks("k", 0, now=1)
+        self.assertEqual([t.student is not None for t in tracks], [True, False])   # 0.55 isn't confident
+        self.assertIsNone(tracker.tracks("k", 1, now=1)[0].student)             # gallery changed since
+        self.assertIsNone(tracker.tracks("k", 0, now=5))
+        tracker.update("k", 0, [], full_scan=False, now=1)
+        self.assertIsNone(tracker.tracks("k", 0, now=1))
+
+
+class TestRoiSearch(unittest.TestCase):
+    def setUp(self):
+        self.previous = get_backend().name
+        use_backend("synthetic")
+        with open('./images/lebron.jpg', 'rb') as f:
+            self.frame = f.read()
+        self.full, _ = Helpers.analyse_frame(self.frame, "balanced", multi=True)
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def test_tracked_face_found_in_roi(self):
+        box = self.full[0][0]
+        result, timings = Helpers.analyse_frame(self.frame, "balanced", multi=True,
+                                                hints=[{"box": box, "skip_encode": False}])
+        self.assertIn("roi", timings)
+        self.assertNotIn("detect", timings)
+        self.assertEqual(result[0][0], box)
+        self.assertLess(Helpers.face_distance(result[0][1], self.full[0][1]), 0.1)
+
+        result, timings = Helpers.analyse_frame(self.frame, "balanced", multi=True,
+                                                hints=[{"box": box, "skip_encode": True}])
+        self.assertIsNone(result[0][1])
+        self.assertNotIn("encode", timings)
+
+    def test_falls_back_to_full_scan(self):
+        arr = np.zeros((400, 800, 3), dtype=np.uint8)
+        arr[:, :400] = np.random.default_rng(0).integers(0, 255, size=(400, 400, 3))
+        buf = io.BytesIO()
+        Image.fromarray(arr).save(buf, format="PNG")
+        # tracked box over the blank right-hand side: nothing there any more
+        result, timings = Helpers.analyse_frame(buf.getvalue(), "accurate", multi=True,
+                                                hints=[{"box": (150, 750, 250, 650), "skip_encode": True}])
+        self.assertIn("detect", timings)
+        self.assertNotIn("roi", timings)
+        self.assertIsNotNone(result[0][1])
+
+
+class TestMarkAttendanceTracking(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object(TestConfig)  # Use test configuration
+        self.previous = get_backend().name
+        use_backend("synthetic")
+        self.client = app.test_client()
+        Base.metadata.create_all(bind=engine)
+        self.session = SessionLocal()
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+
+        self.teacher = Teacher(name="Teacher", email="teacher@gmail.com", password="password")
+        self.lebron = Student(name="Lebron", email="lebron@gmail.com", password="password", image='./images/lebron.jpg')
+        self.session.add_all([self.teacher, self.lebron])
+        self.session.commit()
+        self.class_ = Class(teacher_id=self.teacher.id, class_name="class")
+        self.class_.students.append(self.lebron)
+        self.session.add(self.class_)
+        self.session.commit()
+        self.client.post('/api/auth/login', json={"email": "teacher@gmail.com", "password": "password"})
+
+    def tearDown(self):
+        use_backend(self.previous)
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        self.session.query(Attendance).delete()
+        self.session.query(Class).delete()
+        self.session.query(Teacher).delete()
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def post_frame(self):
+        frame_cache.clear()     # every post is a "new" frame here
+        with open('./images/lebron.jpg', 'rb') as img:
+            response = self.client.post(f'/api/classes/{self.class_.id}/attendance/mark',
+                                        data={"frame": img, "mode": "multi", "kiosk_id": "door"},
+                                        content_type='multipart/form-data')
+        return json.loads(response.data.decode())
+
+    def test_tracked_match_is_not_re_encoded(self):
+        first = self.post_frame()
+        self.assertIn("detect", first['timings_ms'])
+        self.assertNotIn('tracked', first['faces'][0])
+
+        second = self.post_frame()
+        self.assertIn("roi", second['timings_ms'])
+        self.assertNotIn("encode", second['timings_ms'])
+        self.assertTrue(second['faces'][0]['tracked'])
+        self.assertEqual(second['faces'][0]['matched_student']['id'], self.lebron.id)
+        self.assertTrue(second['faces'][0]['already_marked'])
+
+        third, fourth, fifth = self.post_frame(), self.post_frame(), self.post_frame()
+        self.assertIn("roi", fourth['timings_ms'])
+        self.assertIn("detect", fifth['timings_ms'])   # periodic full scan, every 4th frame
+
+        stats = json.loads(self.client.get('/api/recognition/stats').data.decode())['face_tracker']
+        self.assertEqual((stats['full_scans'], stats['tracked_frames']), (2, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
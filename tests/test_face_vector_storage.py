@@ -0,0 +1,81 @@
+import os, sys
+import pickle
+import unittest
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import LargeBinary, inspect, select, text, type_coerce
+from app import app, SessionLocal, engine
+from Models import Base, User, Student
+
+
+class TestFaceVectorStorage(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(bind=engine)
+        self.session = SessionLocal()
+        self.vector = np.random.default_rng(0).normal(scale=0.1, size=128)
+
+    def tearDown(self):
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def raw_vector(self, student_id):
+        students = Student.__table__
+        return self.session.execute(
+            select(type_coerce(students.c.face_vector, LargeBinary)).where(students.c.id == student_id)
+        ).scalar()
+
+    def test_stored_as_512_bytes(self):
+        student = Student(name="Student", email="student@gmail.com", password="password")
+        student.face_vector = self.vector
+        self.session.add(student)
+        self.session.commit()
+        self.assertEqual(len(self.raw_vector(student.id)), 512)
+
+        self.session.expire_all()
+        loaded = self.session.get(Student, student.id).face_vector
+        self.assertEqual(loaded.dtype, np.float32)
+        np.testing.assert_allclose(loaded, self.vector, atol=1e-7)
+
+    def test_migrate_legacy_pickled_rows(self):
+        students = []
+        for i in range(5):
+            student = Student(name=f"Student{i}", email=f"student{i}@gmail.com", password="password")
+            self.session.add(student)
+            students.append(student)
+        self.session.commit()
+        # write rows the way the old PickleType column did
+        table = Student.__table__
+        for student in students:
+            self.session.execute(table.update().where(table.c.id == student.id)
+                                 .values(face_vector=type_coerce(pickle.dumps(self.vector), LargeBinary)))
+        self.session.commit()
+        self.assertGreater(len(self.raw_vector(students[0].id)), 512)
+
+        # legacy rows are still readable before migrating
+        self.session.expire_all()
+        np.testing.assert_allclose(self.session.get(Student, students[0].id).face_vector, self.vector, atol=1e-7)
+
+        result = app.test_cli_runner().invoke(args=['migrate-face-vectors', '--batch-size', '2'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('5 of 5', result.output)
+
+        self.session.expire_all()
+        for student in students:
+            self.assertEqual(len(self.raw_vector(student.id)), 512)
+            self.assertEqual(self.session.get(Student, student.id).face_encoder_version, 1)
+
+    def test_migrate_adds_missing_columns(self):
+        # a database from before classes.speed_profile existed
+        with engine.begin() as conn:
+            conn.execute(text('ALTER TABLE classes DROP COLUMN speed_profile'))
+        result = app.test_cli_runner().invoke(args=['migrate-face-vectors'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Added classes.speed_profile', result.output)
+        self.assertIn('speed_profile', {c['name'] for c in inspect(engine).get_columns('classes')})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os, sys
+import io
+import unittest
+import json
+import numpy as np
+from PIL import Image
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import TestConfig
+from app import app, SessionLocal, engine, present_set
+from Models import Teacher, Base, User, Student, Class, Attendance
+from Gallery import gallery_cache
+from KioskState import FrameCache, frame_cache, frame_hash, hamming, face_tracker
+from unittest.mock import patch
+
+
+def jpeg(img, quality=90):
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+class TestFrameHash(unittest.TestCase):
+    def setUp(self):
+        self.image = Image.open('./images/lebron.jpg').convert("RGB")
+
+    def test_recompressed_frame_is_near_identical(self):
+        a = frame_hash(jpeg(self.image, 90))
+        b = frame_hash(jpeg(self.image, 70))
+        self.assertLessEqual(hamming(a, b), 4)
+
+    def test_different_frames_differ(self):
+        other = Image.open('./images/pewdiepie.jpg').convert("RGB")
+        self.assertGreater(hamming(frame_hash(jpeg(self.image)), frame_hash(jpeg(other))), 4)
+
+    def test_undecodable(self):
+        self.assertIsNone(frame_hash(b"not an image"))
+
+    def test_window_and_distance(self):
+        cache = FrameCache(window=3.0, max_distance=4)
+        cache.store("k", 0b1111, ({"status": "success", "already_marked": False}, 200), now=0.0)
+        payload, status = cache.lookup("k", 0b0111, now=1.0)
+        self.assertEqual(status, 200)
+        self.assertTrue(payload["already_marked"])
+        self.assertTrue(payload["cached"])
+        self.assertIsNone(cache.lookup("k", 0b1111, now=5.0))            # window expired
+        self.assertIsNone(cache.lookup("k", 0xFFFF_0000, now=1.0))      # different frame
+        self.assertIsNone(cache.lookup("other", 0b1111, now=1.0))       # different kiosk
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 3)
+
+
+class TestMarkAttendanceFrameCache(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object(TestConfig)  # Use test configuration
+        self.client = app.test_client()
+        Base.metadata.create_all(bind=engine)
+        self.session = SessionLocal()
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+
+        self.teacher = Teacher(name="Teacher", email="teacher@gmail.com", password="password")
+        self.student = Student(name="Lebron", email="lebron@gmail.com", password="password", image='./images/lebron.jpg')
+        self.session.add_all([self.teacher, self.student])
+        self.session.commit()
+        self.class_ = Class(teacher_id=self.teacher.id, class_name="class")
+        self.class_.students.append(self.student)
+        self.session.add(self.class_)
+        self.session.commit()
+        self.client.post('/api/auth/login', json={"email": "teacher@gmail.com", "password": "password"})
+        with open('./images/lebron.jpg', 'rb') as f:
+            self.frame = f.read()
+
+    def tearDown(self):
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        self.session.query(Attendance).delete()
+        self.session.query(Class).delete()
+        self.session.query(Teacher).delete()
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def post_frame(self, kiosk_id="door"):
+        return self.client.post(f'/api/classes/{self.class_.id}/attendance/mark',
+                                data={"frame": (io.BytesIO(self.frame), "frame.jpg"), "kiosk_id": kiosk_id},
+                                content_type='multipart/form-data')
+
+    def test_repeat_frame_skips_recognition(self):
+        first = json.loads(self.post_frame().data.decode())
+        self.assertFalse(first['already_marked'])
+
+        with patch('app.recognition_pool.run') as run, patch('app.upsert_attendance') as upsert:
+            response = self.post_frame()
+            run.assert_not_called()
+            upsert.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data.decode())
+        self.assertTrue(data['cached'])
+        self.assertTrue(data['already_marked'])
+        self.assertEqual(data['matched_student']['id'], self.student.id)
+
+        # another kiosk doesn't share the entry
+        self.assertNotIn('cached', json.loads(self.post_frame(kiosk_id="hall").data.decode()))
+
+        stats = json.loads(self.client.get('/api/recognition/stats').data.decode())
+        self.assertEqual(stats['frame_cache']['hits'], 1)
+        self.assertEqual(stats['frame_cache']['misses'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
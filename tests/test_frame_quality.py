@@ -0,0 +1,178 @@
+import os, sys
+import io
+import unittest
+import json
+from PIL import Image, ImageFilter
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import TestConfig
+from app import app, SessionLocal, engine, present_set
+from Models import Teacher, Base, User, Student, Class, Attendance
+from Gallery import gallery_cache
+from KioskState import frame_cache, face_tracker
+from FaceBackends import get_backend, use_backend
+from Recognition import FrameQuality, frame_quality
+import Helpers
+
+GATE = Helpers.DEFAULT_QUALITY_GATE
+
+
+def jpeg(im):
+    buf = io.BytesIO()
+    im.convert("RGB").save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def lebron(transform=None):
+    im = Image.open('./images/lebron.jpg').convert("RGB")
+    return jpeg(transform(im) if transform else im)
+
+
+def darken(im):
+    return im.point(lambda v: v // 8)
+
+
+def blur(im):
+    return im.filter(ImageFilter.GaussianBlur(16))   # ~3px at the 96px scale the face is checked at
+
+
+def shrink(im):
+    return im.resize((96, 72))
+
+
+class TestQualityGate(unittest.TestCase):
+    def setUp(self):
+        self.previous = get_backend().name
+        use_backend("synthetic")
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def assertRejected(self, frame, reason, multi=False):
+        with self.assertRaises(Helpers.FrameRejected) as ctx:
+            Helpers.analyse_frame(frame, "balanced", multi, quality=GATE)
+        self.assertEqual(ctx.exception.reason, reason)
+        self.assertIn("quality", ctx.exception.timings)
+        return ctx.exception
+
+    def test_sharp_frame_passes(self):
+        result, timings = Helpers.analyse_frame(lebron(), "balanced", quality=GATE)
+        self.assertIsNotNone(result)
+        self.assertIn("quality", timings)
+        self.assertIn("encode", timings)
+
+    def test_dark_and_bright_frames(self):
+        e = self.assertRejected(lebron(darken), "too_dark")
+        self.assertLess(e.value, GATE["min_brightness"])
+        self.assertNotIn("detect", e.timings)        # turned away before detection
+        self.assertRejected(jpeg(Image.new("RGB", (640, 480), (252, 252, 252))), "too_bright")
+
+    def test_blurred_face(self):
+        e = self.assertRejected(lebron(blur), "blurry")
+        self.assertLess(e.value, GATE["min_sharpness"])
+        self.assertNotIn("encode", e.timings)
+
+    def test_small_face(self):
+        e = self.assertRejected(lebron(shrink), "face_too_small", multi=True)
+        self.assertLess(e.value, GATE["min_face"])
+
+    def test_gate_off(self):
+        result, timings = Helpers.analyse_frame(lebron(blur), "balanced")
+        self.assertIsNotNone(result)
+        self.assertNotIn("quality", timings)
+
+    def test_rejection_survives_pickling(self):
+        import pickle
+        e = pickle.loads(pickle.dumps(Helpers.FrameRejected("blurry", 12.5, {"decode": 1.0})))
+        self.assertEqual((e.reason, e.value, e.timings), ("blurry", 12.5, {"decode": 1.0}))
+
+
+class TestFrameQualityCounts(unittest.TestCase):
+    def test_per_class_and_totals(self):
+        counts = FrameQuality()
+        counts.record(1)
+        counts.record(1, "blurry")
+        counts.record(1, "blurry")
+        counts.record(2, "too_dark")
+        one = counts.stats(1)
+        self.assertEqual((one["frames"], one["rejected"]), (3, {"blurry": 2}))
+        self.assertAlmostEqual(one["rejection_rate"], 2 / 3)
+        total = counts.stats()
+        self.assertEqual((total["frames"], total["classes"]), (4, 2))
+        self.assertEqual(total["rejected"], {"blurry": 2, "too_dark": 1})
+        self.assertEqual(counts.stats(3)["rejection_rate"], 0.0)
+
+
+class TestMarkAttendanceQuality(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object(TestConfig)  # Use test configuration
+        self.previous = get_backend().name
+        use_backend("synthetic")
+        self.client = app.test_client()
+        Base.metadata.create_all(bind=engine)
+        self.session = SessionLocal()
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        frame_quality.clear()
+
+        self.teacher = Teacher(name="Teacher", email="teacher@gmail.com", password="password")
+        self.lebron = Student(name="Lebron", email="lebron@gmail.com", password="password", image='./images/lebron.jpg')
+        self.session.add_all([self.teacher, self.lebron])
+        self.session.commit()
+        self.class_ = Class(teacher_id=self.teacher.id, class_name="class")
+        self.class_.students.append(self.lebron)
+        self.session.add(self.class_)
+        self.session.commit()
+        self.client.post('/api/auth/login', json={"email": "teacher@gmail.com", "password": "password"})
+
+    def tearDown(self):
+        use_backend(self.previous)
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        frame_quality.clear()
+        self.session.query(Attendance).delete()
+        self.session.query(Class).delete()
+        self.session.query(Teacher).delete()
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def post_frame(self, frame):
+        frame_cache.clear()
+        return self.client.post(f'/api/classes/{self.class_.id}/attendance/mark',
+                                data={"frame": (io.BytesIO(frame), "frame.jpg")},
+                                content_type='multipart/form-data')
+
+    def test_rejected_frame_reason_and_counts(self):
+        response = self.post_frame(lebron(blur))
+        self.assertEqual(response.status_code, 422)
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['reason'], "blurry")
+        self.assertIn("quality", data['timings_ms'])
+        self.assertEqual(self.session.query(Attendance).count(), 0)
+
+        self.assertEqual(self.post_frame(lebron(darken)).status_code, 422)
+        self.assertEqual(self.post_frame(lebron()).status_code, 200)
+
+        response = self.client.get(f'/api/classes/{self.class_.id}/recognition/quality')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['frames'], 3)
+        self.assertEqual(data['rejected'], {"blurry": 1, "too_dark": 1})
+        self.assertEqual(data['thresholds'], TestConfig.FRAME_QUALITY_GATE)
+
+        stats = json.loads(self.client.get('/api/recognition/stats').data.decode())
+        self.assertEqual(stats['frame_quality']['frames'], 3)
+
+    def test_quality_counts_need_class_owner(self):
+        response = self.client.get(f'/api/classes/{self.class_.id + 1}/recognition/quality')
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
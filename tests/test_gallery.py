@@ -0,0 +1,100 @@
+import os, sys
+import unittest
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Helpers import face_distance
+from Gallery import Gallery, compare_precision
+
+
+class TestGalleryMatching(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(scale=0.1, size=(50, 128))
+        self.gallery = Gallery(
+            ids=list(range(1, 51)),
+            names=[f"Student{i}" for i in range(1, 51)],
+            emails=[f"student{i}@gmail.com" for i in range(1, 51)],
+            vectors=list(self.vectors),
+        )
+
+    def test_distances_match_face_distance(self):
+        probe = self.vectors[7] + 0.01
+        dists = self.gallery.distances(probe)[0]
+        expected = [face_distance(probe, v) for v in self.vectors]
+        np.testing.assert_allclose(dists, expected, rtol=1e-5, atol=1e-5)
+
+    def test_best_and_second_best(self):
+        probe = self.vectors[7] + 0.001
+        expected = sorted(face_distance(probe, v) for v in self.vectors)
+        match = self.gallery.match(probe)
+        self.assertEqual(match.student_id, 8)
+        self.assertEqual(match.name, "Student8")
+        self.assertEqual(match.email, "student8@gmail.com")
+        self.assertAlmostEqual(match.distance, expected[0], places=5)
+        self.assertAlmostEqual(match.second_distance, expected[1], places=5)
+
+    def test_match_many(self):
+        matches = self.gallery.match_many(self.vectors[[3, 20, 41]])
+        self.assertEqual([m.student_id for m in matches], [4, 21, 42])
+
+    def test_single_student(self):
+        gallery = Gallery([1], ["Student1"], ["student1@gmail.com"], [self.vectors[0]])
+        match = gallery.match(self.vectors[0])
+        self.assertEqual(match.student_id, 1)
+        self.assertEqual(match.second_distance, float("inf"))
+
+    def test_empty_gallery(self):
+        gallery = Gallery([], [], [], [])
+        self.assertEqual(len(gallery), 0)
+        self.assertIsNone(gallery.match(self.vectors[0]))
+
+
+class TestQuantisedGallery(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(scale=0.09, size=(2000, 128))
+        self.probes = self.vectors[:100] + rng.normal(scale=0.03, size=(100, 128))
+        self.ids = list(range(1, 2001))
+
+    def gallery(self, precision, fetch=None):
+        return Gallery(ids=self.ids, names=[""] * 2000, emails=[""] * 2000, vectors=list(self.vectors),
+                       precision=precision, fetch=fetch)
+
+    def test_same_matches_as_full_precision(self):
+        full = self.gallery("float32")
+        expected = full.match_many(self.probes)
+        for precision in ("float16", "int8"):
+            gallery = self.gallery(precision)
+            self.assertLess(gallery.matrix.nbytes, full.matrix.nbytes)
+            for probe, m, e in zip(self.probes, gallery.match_many(self.probes), expected):
+                self.assertEqual(m.student_id, e.student_id)
+                # the re-rank reports the exact distance, not the quantised one
+                self.assertAlmostEqual(m.distance, face_distance(probe, self.vectors[m.student_id - 1]), places=5)
+
+    def test_rerank_reads_full_vectors_through_fetch(self):
+        requested = []
+
+        def fetch(ids):
+            requested.extend(ids)
+            return {i: self.vectors[i - 1] for i in ids if i != 1}   # student 1 has since been removed
+
+        gallery = self.gallery("int8", fetch=fetch)
+        self.assertIsNone(gallery._full)
+        self.assertEqual(gallery.match(self.probes[1]).student_id, 2)
+        self.assertLessEqual(len(requested), gallery.rerank)
+        self.assertNotEqual(gallery.match(self.probes[0]).student_id, 1)
+
+    def test_unknown_precision(self):
+        with self.assertRaises(ValueError):
+            self.gallery("int4")
+
+    def test_recall_measurement(self):
+        report = compare_precision(self.vectors, self.probes, "int8")
+        self.assertEqual(report["bytes_per_embedding"], 128)
+        self.assertGreaterEqual(report["recall_at_1"], 0.99)
+        self.assertGreaterEqual(report["decision_agreement"], 0.99)
+        self.assertLess(report["max_distance_error"], 1e-4)
+
+
+if __name__ == '__main__':
+    unittest.main()
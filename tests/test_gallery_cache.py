@@ -0,0 +1,119 @@
+import os, sys
+import unittest
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from Gallery import Gallery, GalleryCache, gallery_cache
+from Models import Base, Teacher, Student, Class
+
+
+def make_gallery(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return Gallery(list(range(n)), [f"S{i}" for i in range(n)], [f"s{i}@gmail.com" for i in range(n)],
+                   list(rng.normal(size=(n, 128))))
+
+
+class TestGalleryCacheEviction(unittest.TestCase):
+    def test_hit_after_build(self):
+        cache = GalleryCache()
+        builds = []
+        build = lambda: builds.append(1) or make_gallery(3)
+        first = cache.get_or_build(1, build)
+        second = cache.get_or_build(1, build)
+        self.assertIs(first, second)
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_lru_eviction_under_memory_cap(self):
+        one = make_gallery(10).nbytes
+        cache = GalleryCache(max_bytes=2 * one + one // 2)
+        cache.get_or_build(1, lambda: make_gallery(10))
+        cache.get_or_build(2, lambda: make_gallery(10))
+        cache.get(1)  # 1 is now most recently used
+        cache.get_or_build(3, lambda: make_gallery(10))
+        self.assertIn(1, cache)
+        self.assertNotIn(2, cache)
+        self.assertIn(3, cache)
+        self.assertLessEqual(cache.stats()["bytes"], cache.max_bytes)
+
+    def test_invalidate_during_build_is_not_cached(self):
+        cache = GalleryCache()
+        def build():
+            cache.invalidate(1)
+            return make_gallery(2)
+        cache.get_or_build(1, build)
+        self.assertNotIn(1, cache)
+
+
+class TestGalleryCacheInvalidation(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(bind=self.engine)
+        self.session = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)()
+        self.teacher = Teacher(name="Teacher", email="teacher@gmail.com", password="password")
+        self.student1 = Student(name="Student1", email="student1@gmail.com", password="password")
+        self.student2 = Student(name="Student2", email="student2@gmail.com", password="password")
+        self.session.add_all([self.teacher, self.student1, self.student2])
+        self.session.commit()
+        self.class_ = Class(teacher_id=self.teacher.id, class_name="class")
+        self.session.add(self.class_)
+        self.session.commit()
+        self.class_.add_student(self.session, self.student1.id)
+        gallery_cache.clear()
+
+    def tearDown(self):
+        gallery_cache.clear()
+        self.session.close()
+        Base.metadata.drop_all(bind=self.engine)
+
+    def warm(self):
+        gallery_cache.get_or_build(self.class_.id, lambda: Gallery.from_students(self.class_.students))
+        self.assertIn(self.class_.id, gallery_cache)
+
+    def test_add_student_invalidates(self):
+        self.warm()
+        self.class_.add_student(self.session, self.student2.id)
+        self.assertNotIn(self.class_.id, gallery_cache)
+
+    def test_remove_student_invalidates(self):
+        self.warm()
+        self.class_.remove_student(self.session, self.student1.id)
+        self.assertNotIn(self.class_.id, gallery_cache)
+
+    def test_join_and_leave_class_invalidate(self):
+        self.warm()
+        self.student2.join_class(self.session, self.class_.id)
+        self.assertNotIn(self.class_.id, gallery_cache)
+        self.warm()
+        self.student2.leave_class(self.session, self.class_.id)
+        self.assertNotIn(self.class_.id, gallery_cache)
+
+    def test_face_vector_change_invalidates(self):
+        self.warm()
+        self.student1.face_vector = np.zeros(128)
+        self.session.commit()
+        self.assertNotIn(self.class_.id, gallery_cache)
+
+    def test_user_deletion_invalidates(self):
+        self.warm()
+        self.session.delete(self.student1)
+        self.session.commit()
+        self.assertNotIn(self.class_.id, gallery_cache)
+
+    def test_unrelated_change_keeps_cache(self):
+        self.warm()
+        self.teacher.name = "Renamed"
+        self.session.commit()
+        self.assertIn(self.class_.id, gallery_cache)
+
+    def test_rollback_keeps_cache(self):
+        self.warm()
+        self.class_.students.append(self.student2)
+        self.session.flush()
+        self.session.rollback()
+        self.assertIn(self.class_.id, gallery_cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import os, sys
+import io
+import shutil
+import tempfile
+import unittest
+import json
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import TestConfig
+from app import app, SessionLocal, engine, present_set
+from Models import Teacher, Base, User, Student, Class, Attendance
+from Gallery import gallery_cache
+from GalleryStore import GalleryStore, gallery_store
+from KioskState import frame_cache, face_tracker
+from Helpers import encoder_version
+from unittest.mock import patch
+
+
+def rows(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [(i + 1, f"S{i}", f"s{i}@gmail.com", v) for i, v in enumerate(rng.normal(scale=0.1, size=(n, 128)))]
+
+
+class TestGalleryStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = GalleryStore(self.directory)
+        self.rows = rows(20)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip_is_memory_mapped(self):
+        self.store.save(7, self.rows, self.store.generation(7), encoder_version=1)
+        gallery = self.store.load(7, encoder_version=1)
+        self.assertTrue(gallery.shared)
+        self.assertFalse(gallery.matrix.flags.writeable)
+        self.assertEqual(gallery.match(self.rows[4][3]).student_id, 5)
+        self.assertLess(gallery.nbytes, gallery.matrix.nbytes)   # the mapped pages aren't ours
+        self.assertTrue(self.store.is_current(7, gallery))
+
+        quantised = self.store.load(7, encoder_version=1, precision="int8")
+        self.assertEqual(quantised.match(self.rows[4][3]).distance, 0.0)   # re-ranked against the mapped rows
+
+    def test_invalidate_and_rewrite(self):
+        self.store.save(7, self.rows, self.store.generation(7), encoder_version=1)
+        gallery = self.store.load(7, encoder_version=1)
+        self.store.invalidate(7)
+        self.assertFalse(self.store.is_current(7, gallery))
+        self.assertIsNone(self.store.load(7, encoder_version=1))
+
+        self.store.save(7, self.rows[:5], self.store.generation(7), encoder_version=1)
+        self.assertEqual(len(self.store.load(7, encoder_version=1)), 5)
+        self.assertEqual(len([f for f in os.listdir(self.directory) if f.endswith('.npy')]), 1)
+        # the gallery mapped before the rewrite still works
+        self.assertEqual(gallery.match(self.rows[10][3]).student_id, 11)
+
+    def test_stale_builds_are_not_served(self):
+        generation = self.store.generation(7)
+        self.store.invalidate(7)                # roster changed while the DB was being read
+        self.store.save(7, self.rows, generation, encoder_version=1)
+        self.assertIsNone(self.store.load(7, encoder_version=1))
+        self.store.save(7, self.rows, self.store.generation(7), encoder_version=1)
+        self.assertIsNone(self.store.load(7, encoder_version=2))
+
+
+class TestMarkAttendanceWithStore(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object(TestConfig)  # Use test configuration
+        self.directory = tempfile.mkdtemp()
+        gallery_store.configure(directory=self.directory)
+        self.client = app.test_client()
+        Base.metadata.create_all(bind=engine)
+        self.session = SessionLocal()
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(scale=0.1, size=(3, 128))
+        self.teacher = Teacher(name="Teacher", email="teacher@gmail.com", password="password")
+        self.students = [Student(name=f"Student{i}", email=f"student{i}@gmail.com", password="password") for i in range(3)]
+        for student, vec in zip(self.students, self.vectors):
+            student.face_vector = vec
+        self.session.add(self.teacher)
+        self.session.add_all(self.students)
+        self.session.commit()
+        self.class_ = Class(teacher_id=self.teacher.id, class_name="class")
+        self.class_.students.extend(self.students[:2])
+        self.session.add(self.class_)
+        self.session.commit()
+        self.client.post('/api/auth/login', json={"email": "teacher@gmail.com", "password": "password"})
+
+    def tearDown(self):
+        gallery_store.directory = None
+        shutil.rmtree(self.directory)
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        self.session.query(Attendance).delete()
+        self.session.query(Class).delete()
+        self.session.query(Teacher).delete()
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def mark(self, vector):
+        frame_cache.clear()
+        with patch('app.analyse_frame', return_value=(vector + 0.001, {})):
+            response = self.client.post(f'/api/classes/{self.class_.id}/attendance/mark',
+                                        data={"frame": (io.BytesIO(b"frame"), "frame.jpg")},
+                                        content_type='multipart/form-data')
+        return response.status_code, json.loads(response.data.decode())
+
+    def test_cold_worker_maps_the_stored_gallery(self):
+        self.assertEqual(self.mark(self.vectors[0])[0], 200)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, f"class_{self.class_.id}.json")))
+
+        gallery_cache.clear()       # a fresh worker: no cached gallery, and no DB scan either
+        with patch('app.class_gallery_rows', side_effect=AssertionError("read the DB")):
+            status, data = self.mark(self.vectors[1])
+        self.assertEqual(status, 200)
+        self.assertEqual(data['matched_student']['id'], self.students[1].id)
+        self.assertTrue(gallery_cache.get(self.class_.id).shared)
+
+    def test_roster_change_in_another_worker_remaps(self):
+        self.assertEqual(self.mark(self.vectors[2])[0], 404)      # not in the class yet
+        generation = gallery_cache.generation(self.class_.id)
+
+        # another worker adds the student: its commit only reaches us through the store
+        self.session.execute(Class.students.property.secondary.insert(),
+                             [{"student_id": self.students[2].id, "class_id": self.class_.id}])
+        self.session.commit()
+        gallery_store.invalidate(self.class_.id)
+
+        status, data = self.mark(self.vectors[2])
+        self.assertEqual(status, 200)
+        self.assertEqual(data['matched_student']['id'], self.students[2].id)
+        self.assertGreater(gallery_cache.generation(self.class_.id), generation)
+
+    def test_local_roster_change_invalidates_the_store(self):
+        self.mark(self.vectors[0])
+        self.class_.add_student(self.session, self.students[2].id)
+        self.assertIsNone(gallery_store.load(self.class_.id, encoder_version()))
+        self.assertEqual(self.mark(self.vectors[2])[0], 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
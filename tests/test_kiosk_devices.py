@@ -0,0 +1,261 @@
+import os, sys
+import io
+import unittest
+import json
+import time
+import numpy as np
+from flask import g
+from sqlalchemy import event
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import TestConfig
+from app import app, SessionLocal, engine, present_set, run_kiosk_stream, load_kiosk_devices
+from Models import Teacher, Base, User, Student, Class, Attendance, KioskDevice
+from Gallery import gallery_cache
+from KioskState import KioskDevices, frame_cache, face_tracker, kiosk_devices
+from unittest.mock import patch
+
+
+class TestKioskDeviceRegistry(unittest.TestCase):
+    def setUp(self):
+        self.loads = 0
+        self.devices = {1, 2}
+        self.registry = KioskDevices(refresh=30.0, min_reload=1.0)
+
+    def load(self):
+        self.loads += 1
+        return set(self.devices), {10: "fast", 11: None}
+
+    def test_snapshot_is_reused_until_stale(self):
+        self.assertTrue(self.registry.is_active(1, self.load, now=100.0))
+        self.assertTrue(self.registry.is_active(2, self.load, now=110.0))
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(self.registry.class_profile(10), (True, "fast"))
+        self.assertEqual(self.registry.class_profile(12), (False, None))
+
+        self.devices.discard(2)          # revoked on another worker
+        self.assertTrue(self.registry.is_active(2, self.load, now=120.0))
+        self.assertFalse(self.registry.is_active(2, self.load, now=131.0))
+        self.assertEqual(self.loads, 2)
+
+    def test_unknown_device_reloads_at_most_every_min_reload(self):
+        self.registry.is_active(1, self.load, now=100.0)
+        self.devices.add(3)              # issued on another worker
+        self.assertFalse(self.registry.is_active(3, self.load, now=100.5))
+        self.assertTrue(self.registry.is_active(3, self.load, now=101.5))
+        for t in (101.6, 101.7, 101.8):
+            self.assertFalse(self.registry.is_active(99, self.load, now=t))
+        self.assertEqual(self.loads, 2)
+
+    def test_local_revoke_and_invalidate(self):
+        self.registry.is_active(1, self.load, now=100.0)
+        self.registry.revoke(1)
+        self.assertFalse(self.registry.is_active(1, self.load, now=100.5))
+        self.registry.invalidate()
+        self.assertTrue(self.registry.is_active(1, self.load, now=100.6))
+        self.assertEqual(self.registry.stats()["reloads"], 2)
+
+
+class TestKioskDeviceTokens(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object(TestConfig)  # Use test configuration
+        self.client = app.test_client()
+        Base.metadata.create_all(bind=engine)
+        self.session = SessionLocal()
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        kiosk_devices.clear()
+
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(scale=0.1, size=(2, 128))
+        self.teacher = Teacher(name="Teacher", email="teacher@gmail.com", password="password")
+        self.other = Teacher(name="Other", email="other@gmail.com", password="password")
+        self.students = [Student(name=f"Student{i}", email=f"student{i}@gmail.com", password="password") for i in range(2)]
+        for student, vec in zip(self.students, self.vectors):
+            student.face_vector = vec
+        self.session.add_all([self.teacher, self.other, *self.students])
+        self.session.commit()
+        self.class_ = Class(teacher_id=self.teacher.id, class_name="class")
+        self.class_.students.extend(self.students)
+        self.second = Class(teacher_id=self.teacher.id, class_name="second")
+        self.foreign = Class(teacher_id=self.other.id, class_name="foreign")
+        self.session.add_all([self.class_, self.second, self.foreign])
+        self.session.commit()
+        self.client.post('/api/auth/login', json={"email": "teacher@gmail.com", "password": "password"})
+
+    def tearDown(self):
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        kiosk_devices.clear()
+        self.session.query(KioskDevice).delete()
+        self.session.query(Attendance).delete()
+        self.session.query(Class).delete()
+        self.session.query(Teacher).delete()
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def issue(self, class_ids, name="Front door"):
+        response = self.client.post('/api/kiosk/devices', json={"name": name, "class_ids": class_ids})
+        return response.status_code, json.loads(response.data.decode())
+
+    def post_frame(self, token, class_id):
+        # a fresh client: the teacher's cookie would otherwise be used instead of the header
+        frame_cache.clear()
+        return app.test_client().post(f'/api/classes/{class_id}/attendance/mark',
+                                      data={"frame": (io.BytesIO(b"frame"), "frame.jpg")},
+                                      headers={"Authorization": f"Bearer {token}"},
+                                      content_type='multipart/form-data')
+
+    def test_device_marks_its_class_without_user_or_class_queries(self):
+        status, data = self.issue([self.class_.id])
+        self.assertEqual(status, 201)
+        self.assertEqual(data['device']['class_ids'], [self.class_.id])
+        token = data['token']
+
+        statements = []
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with patch('app.analyse_frame', return_value=(self.vectors[0] + 0.001, {})):
+            self.assertEqual(self.post_frame(token, self.class_.id).status_code, 200)   # warms the caches
+            event.listen(engine, "before_cursor_execute", record)
+            try:
+                response = self.post_frame(token, self.class_.id)
+            finally:
+                event.remove(engine, "before_cursor_execute", record)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.data.decode())['already_marked'])
+        for table in ("users", "teachers", "classes", "kiosk_devices"):
+            self.assertFalse([s for s in statements if f"FROM {table}" in s], table)
+
+        rows = self.session.query(Attendance).filter_by(class_id=self.class_.id).all()
+        self.assertEqual([r.student_id for r in rows], [self.students[0].id])
+
+    def test_device_is_limited_to_its_classes(self):
+        _, data = self.issue([self.class_.id])
+        token = data['token']
+        with patch('app.analyse_frame', return_value=(self.vectors[0] + 0.001, {})) as analyse:
+            self.assertEqual(self.post_frame(token, self.second.id).status_code, 404)
+            analyse.assert_not_called()
+        response = app.test_client().get('/api/classes', headers={"Authorization": f"Bearer {token}"})
+        self.assertEqual(response.status_code, 403)
+        response = app.test_client().post('/api/kiosk/devices', json={"name": "x", "class_ids": [self.class_.id]},
+                                          headers={"Authorization": f"Bearer {token}"})
+        self.assertEqual(response.status_code, 403)
+
+    def test_device_header_wins_over_a_teacher_cookie(self):
+        # a kiosk browser a teacher is also signed in on sends both
+        _, data = self.issue([self.class_.id])
+        headers = {"Authorization": f"Bearer {data['token']}"}
+        me = json.loads(self.client.get('/api/me', headers=headers).data.decode())
+        self.assertEqual(me['user']['role'], "kiosk")
+        with patch('app.analyse_frame', return_value=(self.vectors[0] + 0.001, {})) as analyse:
+            response = self.client.post(f'/api/classes/{self.second.id}/attendance/mark',
+                                        data={"frame": (io.BytesIO(b"frame"), "frame.jpg")},
+                                        headers=headers, content_type='multipart/form-data')
+            self.assertEqual(response.status_code, 404)
+            analyse.assert_not_called()
+        # without the header the cookie still signs the teacher in
+        me = json.loads(self.client.get('/api/me').data.decode())
+        self.assertEqual(me['user']['role'], "teacher")
+
+    def test_revoke(self):
+        _, data = self.issue([self.class_.id, self.second.id])
+        token, device_id = data['token'], data['device']['id']
+        with patch('app.analyse_frame', return_value=(self.vectors[0] + 0.001, {})):
+            self.assertEqual(self.post_frame(token, self.second.id).status_code, 409)   # empty roster
+
+            self.client.post('/api/auth/login', json={"email": "other@gmail.com", "password": "password"})
+            self.assertEqual(self.client.delete(f'/api/kiosk/devices/{device_id}').status_code, 404)
+            self.client.post('/api/auth/login', json={"email": "teacher@gmail.com", "password": "password"})
+
+            self.assertEqual(self.client.delete(f'/api/kiosk/devices/{device_id}').status_code, 200)
+            self.assertEqual(self.post_frame(token, self.class_.id).status_code, 401)
+
+        devices = json.loads(self.client.get('/api/kiosk/devices').data.decode())['devices']
+        self.assertEqual(len(devices), 1)
+        self.assertFalse(devices[0]['active'])
+        self.assertIsNotNone(devices[0]['revoked_at'])
+
+    def test_revoked_elsewhere_is_picked_up_on_refresh(self):
+        _, data = self.issue([self.class_.id])
+        with patch('app.analyse_frame', return_value=(self.vectors[0] + 0.001, {})):
+            self.assertEqual(self.post_frame(data['token'], self.class_.id).status_code, 200)
+            device = self.session.get(KioskDevice, data['device']['id'])
+            device.revoked_at = device.created_at
+            self.session.commit()
+            kiosk_devices.invalidate()   # stands in for KIOSK_DEVICE_REFRESH_SECONDS passing
+            self.assertEqual(self.post_frame(data['token'], self.class_.id).status_code, 401)
+
+    def stream(self, device, receive, expires=None):
+        """Run the kiosk stream as a device-token connection; receive(n) gives the nth message."""
+        sent = []
+
+        class DeviceWebSocket:
+            def __init__(self):
+                self.n = 0
+
+            def receive(self):
+                self.n += 1
+                return receive(self.n)
+
+            def send(self, data):
+                sent.append(json.loads(data))
+
+        with app.test_request_context(f'/api/classes/{self.class_.id}/kiosk/stream?mode=multi'):
+            g.session, g.role, g.user = SessionLocal(), "kiosk", None
+            g.kiosk_device, g.kiosk_classes = device['id'], frozenset(device['class_ids'])
+            g.kiosk_expires = expires or time.time() + 3600
+            kiosk_devices.is_active(device['id'], load_kiosk_devices)   # what verifying the token does
+            run_kiosk_stream(DeviceWebSocket(), self.class_.id)
+        return sent
+
+    def test_stream_stops_once_the_device_is_revoked(self):
+        _, data = self.issue([self.class_.id])
+        device = data['device']
+
+        def receive(n):
+            if n == 2:
+                # the teacher revokes the device while the kiosk is connected (as DELETE
+                # /api/kiosk/devices/<id> does; a nested test request would share this g)
+                row = self.session.get(KioskDevice, device['id'])
+                row.revoked_at = row.created_at
+                self.session.commit()
+                kiosk_devices.revoke(device['id'])
+            if n <= 3:
+                frame_cache.clear()
+                return b"frame"
+            return None
+
+        with patch('app.analyse_frame', return_value=([((0, 10, 10, 0), self.vectors[0] + 0.001)], {})) as analyse:
+            events = self.stream(device, receive)
+        self.assertEqual([e['type'] for e in events], ["ready", "recognition", "error"])
+        self.assertEqual(events[2]['code'], 401)
+        self.assertEqual(analyse.call_count, 1)
+
+    def test_stream_stops_once_the_token_expires(self):
+        _, data = self.issue([self.class_.id])
+        events = self.stream(data['device'], lambda n: b"frame" if n == 1 else None, expires=time.time() - 1)
+        self.assertEqual([e['type'] for e in events], ["ready", "error"])
+        self.assertEqual(events[1]['code'], 401)
+
+    def test_issue_validation(self):
+        self.assertEqual(self.issue([self.foreign.id])[0], 404)
+        self.assertEqual(self.issue([self.class_.id, self.foreign.id])[0], 404)
+        self.assertEqual(self.issue([])[0], 400)
+        self.assertEqual(self.issue(["1"])[0], 400)
+        self.assertEqual(self.issue([2**70])[0], 400)
+        self.assertEqual(self.issue([0])[0], 400)
+        self.assertEqual(self.issue([self.class_.id], name=" ")[0], 400)
+        self.assertEqual(self.issue(list(range(1, TestConfig.KIOSK_DEVICE_MAX_CLASSES + 2)))[0], 400)
+        self.assertEqual(self.session.query(KioskDevice).count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
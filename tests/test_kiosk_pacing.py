@@ -0,0 +1,109 @@
+import os, sys
+import io
+import unittest
+import json
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import TestConfig
+from app import app, SessionLocal, engine, present_set
+from Models import Teacher, Base, User, Student, Class, Attendance
+from Gallery import gallery_cache
+from KioskState import KioskPacing, frame_cache, face_tracker, kiosk_pacing
+from Recognition import RecognitionPool
+from unittest.mock import patch, PropertyMock
+
+
+class TestKioskPacing(unittest.TestCase):
+    def setUp(self):
+        self.pacing = KioskPacing(min_ms=500, base_ms=2000, max_ms=8000, busy_factor=3.0, smoothing=0.5)
+
+    def test_arrivals_face_and_empty_room(self):
+        self.assertEqual(self.pacing.suggest("k", face_present=True, repeat=False, arrivals=True), 500)
+        self.assertEqual(self.pacing.suggest("k", face_present=True, repeat=True, arrivals=False), 2000)
+        # empty room: backs off towards max_ms as its frames keep coming back empty
+        delays = [self.pacing.suggest("k", face_present=False, repeat=True, arrivals=False) for _ in range(6)]
+        self.assertEqual(delays, sorted(delays))
+        self.assertGreater(delays[-1], 7500)
+        self.assertLessEqual(delays[-1], 8000)
+        # other kiosks keep their own history: one empty frame moves it halfway (smoothing=0.5)
+        self.assertEqual(self.pacing.suggest("other", face_present=False, repeat=False, arrivals=False), 5000)
+
+    def test_load_stretches_within_bounds(self):
+        self.assertEqual(self.pacing.suggest("k", True, False, True, load=0.5), 1250)
+        self.assertEqual(self.pacing.suggest("k", True, False, False, load=1.0), 8000)
+        stats = self.pacing.stats()
+        self.assertEqual((stats["kiosks"], stats["suggestions"]), (1, 2))
+
+    def test_pool_load(self):
+        self.assertEqual(RecognitionPool(workers=0).load, 0.0)
+        pool = RecognitionPool(workers=2, max_pending=4)
+        pool._pending = 3
+        self.assertEqual(pool.load, 0.75)
+
+
+class TestMarkAttendancePacing(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object(TestConfig)  # Use test configuration
+        self.client = app.test_client()
+        Base.metadata.create_all(bind=engine)
+        self.session = SessionLocal()
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        kiosk_pacing.clear()
+
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(scale=0.1, size=(2, 128))
+        self.teacher = Teacher(name="Teacher", email="teacher@gmail.com", password="password")
+        self.students = [Student(name=f"Student{i}", email=f"student{i}@gmail.com", password="password") for i in range(2)]
+        for student, vec in zip(self.students, self.vectors):
+            student.face_vector = vec
+        self.session.add_all([self.teacher, *self.students])
+        self.session.commit()
+        self.class_ = Class(teacher_id=self.teacher.id, class_name="class")
+        self.class_.students.extend(self.students)
+        self.session.add(self.class_)
+        self.session.commit()
+        self.client.post('/api/auth/login', json={"email": "teacher@gmail.com", "password": "password"})
+
+    def tearDown(self):
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        kiosk_pacing.clear()
+        self.session.query(Attendance).delete()
+        self.session.query(Class).delete()
+        self.session.query(Teacher).delete()
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def next_capture(self, result):
+        frame_cache.clear()
+        with patch('app.analyse_frame', return_value=(result, {})):
+            response = self.client.post(f'/api/classes/{self.class_.id}/attendance/mark',
+                                        data={"frame": (io.BytesIO(b"frame"), "frame.jpg"), "kiosk_id": "door"},
+                                        content_type='multipart/form-data')
+        return json.loads(response.data.decode())['next_capture_ms']
+
+    def test_suggested_delay_follows_the_door(self):
+        pacing = TestConfig.KIOSK_PACING
+        self.assertEqual(self.next_capture(self.vectors[0] + 0.001), pacing['min_ms'])     # newly marked
+        self.assertEqual(self.next_capture(self.vectors[0] + 0.001), pacing['base_ms'])    # still standing there
+        empty = [self.next_capture(None) for _ in range(3)]
+        self.assertEqual(empty, sorted(empty))
+        self.assertGreater(empty[0], pacing['base_ms'])
+
+        with patch.object(RecognitionPool, 'load', new_callable=PropertyMock, return_value=1.0):
+            self.assertEqual(self.next_capture(self.vectors[1] + 0.001), pacing['min_ms'] * 4)
+
+        stats = json.loads(self.client.get('/api/recognition/stats').data.decode())['pacing']
+        self.assertEqual((stats['kiosks'], stats['suggestions']), (1, 6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import os, sys
+import unittest
+import json
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flask import g
+from config import TestConfig
+from app import app, SessionLocal, engine, present_set, run_kiosk_stream, load_class_gallery
+from Models import Teacher, Base, User, Student, Class, Attendance
+from Gallery import gallery_cache
+from KioskState import frame_cache, face_tracker
+from FaceBackends import get_backend, use_backend
+from unittest.mock import patch
+
+
+class FakeWebSocket:
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.sent = []
+
+    def receive(self):
+        return self.messages.pop(0) if self.messages else None
+
+    def send(self, data):
+        self.sent.append(json.loads(data))
+
+
+class TestKioskStream(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object(TestConfig)  # Use test configuration
+        self.previous = get_backend().name
+        use_backend("synthetic")
+        Base.metadata.create_all(bind=engine)
+        self.session = SessionLocal()
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+
+        self.teacher = Teacher(name="Teacher", email="teacher@gmail.com", password="password")
+        self.other = Teacher(name="Other", email="other@gmail.com", password="password")
+        self.lebron = Student(name="Lebron", email="lebron@gmail.com", password="password", image='./images/lebron.jpg')
+        self.session.add_all([self.teacher, self.other, self.lebron])
+        self.session.commit()
+        self.class_ = Class(teacher_id=self.teacher.id, class_name="class")
+        self.class_.students.append(self.lebron)
+        self.session.add(self.class_)
+        self.session.commit()
+        with open('./images/lebron.jpg', 'rb') as f:
+            self.frame = f.read()
+
+    def tearDown(self):
+        use_backend(self.previous)
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        self.session.query(Attendance).delete()
+        self.session.query(Class).delete()
+        self.session.query(Teacher).delete()
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def stream(self, messages, teacher=None, query="mode=multi&kiosk_id=door", role="teacher", headers=None):
+        ws = FakeWebSocket(messages)
+        with app.test_request_context(f'/api/classes/{self.class_.id}/kiosk/stream?{query}', headers=headers):
+            g.session = SessionLocal()
+            g.role = role
+            g.user = g.session.get(Teacher, (teacher or self.teacher).id)
+            run_kiosk_stream(ws, self.class_.id)
+        return ws.sent
+
+    def test_frames_over_one_connection(self):
+        with patch('app.load_class_gallery', wraps=load_class_gallery) as load:
+            events = self.stream([self.frame, self.frame])
+            self.assertEqual(load.call_count, 1)    # gallery pinned for the connection
+        self.assertEqual([e['type'] for e in events], ["ready", "recognition", "recognition"])
+        self.assertEqual(events[0]['mode'], "multi")
+        self.assertEqual(events[1]['faces'][0]['matched_student']['id'], self.lebron.id)
+        self.assertEqual(events[1]['newly_marked'], 1)
+        self.assertTrue(events[2]['cached'])
+        self.assertEqual(self.session.query(Attendance).filter_by(class_id=self.class_.id).count(), 1)
+
+    def test_settings_message(self):
+        events = self.stream(['{"mode": "single", "profile": "fast"}', self.frame, '{"profile": "warp"}'])
+        self.assertEqual(events[1]['type'], "settings")
+        self.assertEqual((events[1]['mode'], events[1]['profile']), ("single", "fast"))
+        self.assertEqual(events[2]['matched_student']['id'], self.lebron.id)
+        self.assertEqual(events[3]['code'], 400)
+
+    def test_bad_settings_keep_the_stream_open(self):
+        bad = ['{"profile": ["fast"]}', '{"profile": {}}', '{"mode": ["multi"]}', '{"mode": "both"}', '[1]', 'not json']
+        events = self.stream(bad + [self.frame])
+        self.assertEqual([e['type'] for e in events], ["ready"] + ["error"] * len(bad) + ["recognition"])
+        self.assertTrue(all(e['code'] == 400 for e in events[1:-1]))
+        self.assertEqual(events[-1]['faces'][0]['matched_student']['id'], self.lebron.id)   # still multi, as opened
+
+    def test_roster_change_reloads_pinned_gallery(self):
+        session = self.session
+        class_, lebron, frame = self.class_, self.lebron, self.frame
+
+        class LeavingWebSocket(FakeWebSocket):
+            def receive(self):
+                if self.messages:
+                    # the student leaves the class while the kiosk is connected
+                    class_.students.remove(lebron)
+                    session.commit()
+                return super().receive()
+
+        ws = LeavingWebSocket([frame])
+        with app.test_request_context(f'/api/classes/{self.class_.id}/kiosk/stream?mode=multi'):
+            g.session, g.role = SessionLocal(), "teacher"
+            g.user = g.session.get(Teacher, self.teacher.id)
+            run_kiosk_stream(ws, self.class_.id)
+        self.assertEqual(ws.sent[0]['students'], 1)
+        self.assertEqual(ws.sent[1]['code'], 409)
+
+    def test_rejects_other_teachers_and_origins(self):
+        self.assertEqual(self.stream([self.frame], teacher=self.other)[0]['code'], 404)
+        self.assertEqual(self.stream([self.frame], role="student")[0]['code'], 401)
+        self.assertEqual(self.stream([self.frame], headers={"Origin": "https://evil.example"})[0]['code'], 403)
+        self.assertEqual(self.stream([self.frame], query="profile=warp")[0]['code'], 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
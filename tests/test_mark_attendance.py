@@ -0,0 +1,164 @@
+import os, sys
+import io
+import unittest
+import json
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import TestConfig
+from app import app, SessionLocal, engine, present_set, run_frame_batch, FrameJob
+from Models import Teacher, Base, User, Student, Class, Attendance
+from Gallery import Gallery, gallery_cache
+from KioskState import frame_cache, face_tracker
+from Recognition import RecognitionBusy, frame_batcher
+from unittest.mock import patch
+
+
+class TestMarkAttendance(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object(TestConfig)  # Use test configuration
+        self.client = app.test_client()
+        Base.metadata.create_all(bind=engine)  # Create all tables
+        self.session = SessionLocal()
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(scale=0.1, size=(3, 128))
+        self.teacher = Teacher(name="Teacher", email="teacher@gmail.com", password="password")
+        self.students = [Student(name=f"Student{i}", email=f"student{i}@gmail.com", password="password") for i in range(3)]
+        for student, vec in zip(self.students, self.vectors):
+            student.face_vector = vec
+        self.session.add(self.teacher)
+        self.session.add_all(self.students)
+        self.session.commit()
+        self.class_ = Class(teacher_id=self.teacher.id, class_name="class")
+        self.class_.students.extend(self.students)
+        self.session.add(self.class_)
+        self.session.commit()
+        self.client.post('/api/auth/login', json={"email": "teacher@gmail.com", "password": "password"})
+
+    def tearDown(self):
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        self.session.query(Attendance).delete()
+        self.session.query(Class).delete()
+        self.session.query(Teacher).delete()
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def post_frame(self, mode=None, profile=None):
+        data = {"frame": (io.BytesIO(b"frame"), "frame.jpg")}
+        if mode:
+            data["mode"] = mode
+        if profile:
+            data["profile"] = profile
+        return self.client.post(f'/api/classes/{self.class_.id}/attendance/mark',
+                                data=data, content_type='multipart/form-data')
+
+    def test_single_face(self):
+        with patch('app.analyse_frame', return_value=(self.vectors[1] + 0.001, {"decode": 1.0})):
+            response = self.post_frame()
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['matched_student']['id'], self.students[1].id)
+        self.assertFalse(data['already_marked'])
+        self.assertEqual(set(data['timings_ms']), {"decode", "queue", "match"})
+
+    def test_multi_face_marks_everyone(self):
+        faces = [
+            ((10, 60, 60, 10), self.vectors[0] + 0.001),
+            ((10, 160, 60, 110), self.vectors[2] + 0.001),
+            ((10, 260, 60, 210), self.vectors[2] + 0.002),   # same student twice
+            ((10, 360, 60, 310), np.ones(128)),              # stranger
+        ]
+        with patch('app.analyse_frame', return_value=(faces, {})):
+            response = self.post_frame(mode="multi")
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data.decode())
+        self.assertEqual([f['status'] for f in data['faces']], ["matched", "matched", "duplicate", "unknown"])
+        self.assertEqual(data['matched'], 2)
+        self.assertEqual(data['newly_marked'], 2)
+        marked = {a.student_id for a in self.session.query(Attendance).filter_by(class_id=self.class_.id, attended=True)}
+        self.assertEqual(marked, {self.students[0].id, self.students[2].id})
+
+        with patch('app.analyse_frame', return_value=(faces[:1], {})):
+            data = json.loads(self.post_frame(mode="multi").data.decode())
+        self.assertTrue(data['faces'][0]['already_marked'])
+        self.assertEqual(data['newly_marked'], 0)
+
+    def test_multi_face_no_faces(self):
+        with patch('app.analyse_frame', return_value=([], {})):
+            response = self.post_frame(mode="multi")
+        self.assertEqual(response.status_code, 422)
+
+    def test_busy_pool_returns_503(self):
+        with patch('app.recognition_pool.run', side_effect=RecognitionBusy(3)):
+            response = self.post_frame()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '3')
+
+    def test_speed_profile_selection(self):
+        with patch('app.analyse_frame', return_value=(self.vectors[0], {})) as encode:
+            self.post_frame()
+            self.assertEqual(encode.call_args.args[1], TestConfig.RECOGNITION_SPEED_PROFILE)
+
+            response = self.client.patch(f'/api/classes/{self.class_.id}/recognition', json={"speed_profile": "accurate"})
+            self.assertEqual(response.status_code, 200)
+            self.post_frame()
+            self.assertEqual(encode.call_args.args[1], "accurate")
+
+            # kiosk override wins over the class setting
+            self.post_frame(profile="fast")
+            self.assertEqual(encode.call_args.args[1], "fast")
+
+        self.assertEqual(self.post_frame(profile="warp").status_code, 400)
+        for bad in ("warp", ["fast"], {}, 1):
+            response = self.client.patch(f'/api/classes/{self.class_.id}/recognition', json={"speed_profile": bad})
+            self.assertEqual(response.status_code, 400, bad)
+        response = self.client.patch(f'/api/classes/{self.class_.id}/recognition', json={"speed_profile": None})
+        self.assertEqual(response.status_code, 200)
+
+    def test_batch_matches_once_per_gallery(self):
+        ids = [s.id for s in self.students]
+        names = [s.name for s in self.students]
+        gallery = Gallery(ids, names, names, self.vectors.astype(np.float32))
+        other = Gallery(ids[:1], names[:1], names[:1], self.vectors[:1].astype(np.float32))
+        frames = {b"a": (self.vectors[1] + 0.001, {}), b"b": (None, {}),
+                  b"c": ([((0, 10, 10, 0), self.vectors[2]), ((0, 30, 10, 20), None)], {}),
+                  b"d": (self.vectors[0], {})}
+        jobs = [FrameJob(self.class_.id, b"a", False, "balanced", None, gallery),
+                FrameJob(self.class_.id, b"b", False, "balanced", None, gallery),
+                FrameJob(self.class_.id, b"c", True, "balanced", None, gallery),
+                FrameJob(self.class_.id + 1, b"d", False, "balanced", None, other)]
+        with patch('app.analyse_frame', side_effect=lambda raw, *args: frames[raw]), \
+                patch.object(Gallery, 'match_many', autospec=True, side_effect=Gallery.match_many) as match_many:
+            out = run_frame_batch(jobs)
+        self.assertEqual(match_many.call_count, 2)
+        self.assertEqual(out[0][3][0].student_id, ids[1])
+        self.assertIsNone(out[1][3])
+        self.assertEqual([m.student_id for m in out[2][3]], [ids[2]])     # the tracked face isn't matched
+        self.assertEqual(out[3][3][0].student_id, ids[0])
+        self.assertIn("match", out[0][1])
+
+    def test_batching_enabled(self):
+        frame_batcher.configure(window_ms=1)
+        try:
+            with patch('app.analyse_frame', return_value=(self.vectors[1] + 0.001, {"decode": 1.0})):
+                response = self.post_frame()
+        finally:
+            frame_batcher.configure(window_ms=0)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['matched_student']['id'], self.students[1].id)
+        self.assertEqual(set(data['timings_ms']), {"decode", "queue", "match"})
+
+
+if __name__ == '__main__':
+    unittest.main()
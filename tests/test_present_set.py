@@ -0,0 +1,122 @@
+import os, sys
+import io
+import unittest
+import json
+from datetime import date, timedelta
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import TestConfig
+from app import app, SessionLocal, engine, present_set
+from Models import Teacher, Base, User, Student, Class, Attendance
+from Gallery import gallery_cache
+from KioskState import PresentSet, frame_cache, make_present_set, face_tracker
+from unittest.mock import patch
+
+
+class TestPresentSet(unittest.TestCase):
+    def test_loads_once_per_class_and_day(self):
+        present = PresentSet()
+        today = date(2025, 1, 6)
+        calls = []
+
+        def load():
+            calls.append(1)
+            return [1, 2]
+
+        self.assertEqual(present.members(7, today, load), {1, 2})
+        present.add(7, today, [3])
+        self.assertEqual(present.members(7, today, load), {1, 2, 3})
+        self.assertEqual(len(calls), 1)
+
+    def test_add_to_cold_class_is_ignored(self):
+        present = PresentSet()
+        today = date(2025, 1, 6)
+        present.add(7, today, [3])
+        self.assertEqual(present.members(7, today, lambda: [1]), {1})
+
+    def test_rolls_over_on_a_new_day(self):
+        present = PresentSet()
+        today = date(2025, 1, 6)
+        present.members(7, today, lambda: [1, 2])
+        self.assertEqual(present.members(7, today + timedelta(days=1), lambda: []), frozenset())
+
+    def test_default_is_in_memory(self):
+        self.assertIsInstance(make_present_set(None), PresentSet)
+
+
+class TestMarkAttendancePresentSet(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object(TestConfig)  # Use test configuration
+        self.client = app.test_client()
+        Base.metadata.create_all(bind=engine)
+        self.session = SessionLocal()
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+
+        self.teacher = Teacher(name="Teacher", email="teacher@gmail.com", password="password")
+        self.student = Student(name="Lebron", email="lebron@gmail.com", password="password", image='./images/lebron.jpg')
+        self.session.add_all([self.teacher, self.student])
+        self.session.commit()
+        self.class_ = Class(teacher_id=self.teacher.id, class_name="class")
+        self.class_.students.append(self.student)
+        self.session.add(self.class_)
+        self.session.commit()
+        self.client.post('/api/auth/login', json={"email": "teacher@gmail.com", "password": "password"})
+        with open('./images/lebron.jpg', 'rb') as f:
+            self.frame = f.read()
+
+    def tearDown(self):
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        self.session.query(Attendance).delete()
+        self.session.query(Class).delete()
+        self.session.query(Teacher).delete()
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def post_frame(self, mode=None):
+        data = {"frame": (io.BytesIO(self.frame), "frame.jpg")}
+        if mode:
+            data["mode"] = mode
+        return self.client.post(f'/api/classes/{self.class_.id}/attendance/mark',
+                                data=data, content_type='multipart/form-data')
+
+    def test_repeat_recognition_skips_upsert(self):
+        first = json.loads(self.post_frame().data.decode())
+        self.assertFalse(first['already_marked'])
+
+        for mode in (None, "multi"):
+            frame_cache.clear()     # force a full recognition, not a replayed frame
+            with patch('app.upsert_attendance') as upsert:
+                response = self.post_frame(mode)
+                upsert.assert_not_called()
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data.decode())
+            self.assertNotIn('cached', data)
+            if mode:
+                self.assertEqual(data['newly_marked'], 0)
+                self.assertTrue(data['faces'][0]['already_marked'])
+            else:
+                self.assertTrue(data['already_marked'])
+
+        self.assertEqual(self.session.query(Attendance).filter_by(class_id=self.class_.id).count(), 1)
+
+    def test_warms_from_existing_rows(self):
+        self.session.add(Attendance(student_id=self.student.id, class_id=self.class_.id,
+                                    date=date.today(), attended=True))
+        self.session.commit()
+
+        with patch('app.upsert_attendance') as upsert:
+            data = json.loads(self.post_frame().data.decode())
+            upsert.assert_not_called()
+        self.assertTrue(data['already_marked'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import os, sys
+import threading
+import time
+import unittest
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Recognition import RecognitionPool, RecognitionBusy, FrameBatcher
+
+
+def negate_all(items, *args):
+    return [-i for i in items]
+
+
+class TestRecognitionPool(unittest.TestCase):
+    def test_inline_when_no_workers(self):
+        pool = RecognitionPool(workers=0)
+        self.assertEqual(pool.run(abs, -3), 3)
+        self.assertEqual(pool.submit(abs, -4).result(), 4)
+
+    def test_runs_in_worker_process(self):
+        pool = RecognitionPool(workers=1, max_pending=2)
+        try:
+            self.assertNotEqual(pool.run(os.getpid), os.getpid())
+        finally:
+            pool.shutdown()
+
+    def test_full_queue_raises_busy(self):
+        pool = RecognitionPool(workers=1, max_pending=1, retry_after=3)
+        try:
+            future = pool.submit(time.sleep, 0.5)
+            with self.assertRaises(RecognitionBusy) as ctx:
+                pool.submit(time.sleep, 0)
+            self.assertEqual(ctx.exception.retry_after, 3)
+            future.result()
+            # slot is released once the task finishes
+            pool.submit(abs, -1).result()
+            self.assertEqual(pool.pending, 0)
+        finally:
+            pool.shutdown()
+
+    def test_timeout_raises_busy(self):
+        pool = RecognitionPool(workers=1, max_pending=2, timeout=0.05)
+        try:
+            with self.assertRaises(RecognitionBusy):
+                pool.run(time.sleep, 0.5)
+        finally:
+            pool.shutdown()
+
+    def test_run_batch_splits_across_workers(self):
+        self.assertEqual(RecognitionPool(workers=0).run_batch(negate_all, [1, 2, 3]), [-1, -2, -3])
+        pool = RecognitionPool(workers=2, max_pending=4)
+        try:
+            self.assertEqual(pool.run_batch(negate_all, list(range(7))), [-i for i in range(7)])
+        finally:
+            pool.shutdown()
+
+
+class TestFrameBatcher(unittest.TestCase):
+    def run_concurrently(self, batcher, items, execute):
+        results = {}
+
+        def call(item):
+            try:
+                results[item] = batcher.run(item, execute)
+            except Exception as e:
+                results[item] = e
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in items]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(5)
+        return results
+
+    def test_disabled_runs_each_item_alone(self):
+        batcher = FrameBatcher(window_ms=0)
+        seen = []
+        self.assertEqual(batcher.run(3, lambda items: seen.append(items) or [i * 2 for i in items]), 6)
+        self.assertEqual(seen, [[3]])
+        self.assertEqual(batcher.stats()["batch_sizes"], {"1": 1})
+
+    def test_concurrent_calls_share_a_batch(self):
+        batcher = FrameBatcher(window_ms=200, max_batch=4)
+        batches = []
+
+        def execute(items):
+            batches.append(list(items))
+            return [i * 10 if i != 2 else ValueError(i) for i in items]
+
+        results = self.run_concurrently(batcher, range(6), execute)
+        self.assertEqual(sorted(len(b) for b in batches), [2, 4])      # full batch, then the rest
+        self.assertEqual(sorted(i for b in batches for i in b), list(range(6)))
+        self.assertIsInstance(results[2], ValueError)
+        self.assertEqual({i: r for i, r in results.items() if i != 2}, {0: 0, 1: 10, 3: 30, 4: 40, 5: 50})
+        stats = batcher.stats()
+        self.assertEqual((stats["batches"], stats["frames"]), (2, 6))
+        self.assertEqual(stats["batch_sizes"], {"2": 1, "4": 1})
+
+    def test_failed_batch_raises_in_every_caller(self):
+        batcher = FrameBatcher(window_ms=100, max_batch=3)
+
+        def execute(items):
+            raise RecognitionBusy(2)
+
+        results = self.run_concurrently(batcher, range(3), execute)
+        self.assertTrue(all(isinstance(r, RecognitionBusy) for r in results.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os, sys
+import json
+import tempfile
+import unittest
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import app, SessionLocal, engine
+from Models import Base, User, Student
+from Helpers import encoder_version
+
+
+class TestReencodeFaces(unittest.TestCase):
+    def setUp(self):
+        Base.metadata.create_all(bind=engine)
+        self.session = SessionLocal()
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+        images = ['./images/lebron.jpg', './images/pewdiepie.jpg', './images/cristiano.jpg', None]
+        self.students = []
+        for i, image in enumerate(images):
+            student = Student(name=f"Student{i}", email=f"student{i}@gmail.com", password="password", image=image)
+            self.session.add(student)
+            self.students.append(student)
+        self.session.commit()
+        # the first two look like they were encoded by another engine
+        for student in self.students[:2]:
+            student.face_vector = np.zeros(128)
+            student.face_encoder_version = 1
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def reencode(self, *args):
+        result = app.test_cli_runner().invoke(args=['reencode-faces', '--workers', '0', '--batch-size', '1',
+                                                    '--checkpoint', self.checkpoint, *args])
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result.output
+
+    def test_only_stale_rows_are_redone(self):
+        output = self.reencode()
+        self.assertIn('2 of 2 students re-encoded', output)
+        self.assertIn('images/s', output)
+        self.assertIn('Restart the web workers', output)    # TestConfig has no gallery store
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+        self.session.expire_all()
+        for student in self.students[:3]:
+            self.assertEqual(student.face_encoder_version, encoder_version())
+            self.assertGreater(np.linalg.norm(student.face_vector), 0)
+        self.assertIn('0 of 0', self.reencode())
+
+    def test_force_redoes_everything_with_an_image(self):
+        self.assertIn('3 of 3', self.reencode('--force'))
+
+    def test_resumes_from_checkpoint(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'encoder_version': encoder_version(), 'force': False, 'last_id': self.students[0].id}, f)
+        output = self.reencode()
+        self.assertIn(f'Resuming after student {self.students[0].id}', output)
+        self.assertIn('1 of 1', output)
+
+        self.session.expire_all()
+        self.assertEqual(self.students[0].face_encoder_version, 1)
+        self.assertEqual(self.students[1].face_encoder_version, encoder_version())
+
+    def test_checkpoint_from_another_encoder_is_ignored(self):
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'encoder_version': -1, 'force': False, 'last_id': self.students[0].id}, f)
+        self.assertIn('2 of 2', self.reencode())
+
+
+if __name__ == '__main__':
+    unittest.main()
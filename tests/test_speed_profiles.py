@@ -0,0 +1,99 @@
+import os, sys
+import io
+import unittest
+import numpy as np
+from PIL import Image
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Helpers
+import FaceBackends
+from unittest.mock import patch, MagicMock
+
+
+def jpeg_bytes(w=1280, h=720):
+    buf = io.BytesIO()
+    Image.new("RGB", (w, h), (120, 110, 100)).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+class TestSpeedProfiles(unittest.TestCase):
+    def setUp(self):
+        self.fr = MagicMock()
+        self.fr.face_locations.return_value = [(20, 60, 60, 20)]
+        self.fr.face_encodings.side_effect = lambda arr, known_face_locations, **kw: [np.zeros(128)] * len(known_face_locations)
+        for patcher in (patch.object(FaceBackends, 'fr', self.fr),
+                        patch.object(Helpers, 'get_backend', return_value=FaceBackends.DlibBackend())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_fast_profile_detects_at_draft_size_and_encodes_full_frame(self):
+        enc = Helpers.bytes_to_encoding(jpeg_bytes(), profile="fast")
+        self.assertIsNotNone(enc)
+        detect_arr = self.fr.face_locations.call_args.args[0]
+        self.assertEqual(detect_arr.shape[:2], (180, 320))
+        self.assertEqual(self.fr.face_locations.call_args.kwargs["number_of_times_to_upsample"], 1)
+
+        encode_arr = self.fr.face_encodings.call_args.args[0]
+        kwargs = self.fr.face_encodings.call_args.kwargs
+        self.assertEqual(encode_arr.shape[:2], (720, 1280))
+        self.assertEqual(kwargs["known_face_locations"], [(80, 240, 240, 80)])
+        self.assertEqual(kwargs["model"], "small")
+        self.assertEqual(kwargs["num_jitters"], 1)
+
+    def test_fast_profile_skips_the_full_decode_without_faces(self):
+        self.fr.face_locations.return_value = []
+        with patch.object(Helpers, 'decode_frame', wraps=Helpers.decode_frame) as decode:
+            self.assertEqual(Helpers.bytes_to_encodings(jpeg_bytes(), profile="fast"), [])
+        self.assertEqual([c.args[1:] for c in decode.call_args_list], [(4,)])
+        self.fr.face_encodings.assert_not_called()
+
+    def test_balanced_profile_maps_boxes_to_full_frame(self):
+        faces = Helpers.bytes_to_encodings(jpeg_bytes(), profile="balanced")
+        self.assertEqual(self.fr.face_locations.call_args.args[0].shape[:2], (360, 640))
+        kwargs = self.fr.face_encodings.call_args.kwargs
+        self.assertEqual(self.fr.face_encodings.call_args.args[0].shape[:2], (720, 1280))
+        self.assertEqual(kwargs["known_face_locations"], [(40, 120, 120, 40)])
+        self.assertEqual(faces[0][0], (40, 120, 120, 40))
+
+    def test_multi_face_boxes_are_in_upload_coordinates(self):
+        faces = Helpers.bytes_to_encodings(jpeg_bytes(), profile="fast")
+        self.assertEqual(faces[0][0], (80, 240, 240, 80))
+
+    def test_accurate_profile_uses_full_frame(self):
+        Helpers.bytes_to_encodings(jpeg_bytes(), profile="accurate")
+        self.assertEqual(self.fr.face_locations.call_args.args[0].shape[:2], (720, 1280))
+        kwargs = self.fr.face_encodings.call_args.kwargs
+        self.assertEqual(kwargs["known_face_locations"], [(20, 60, 60, 20)])
+        self.assertEqual(kwargs["model"], "large")
+        self.assertEqual(kwargs["num_jitters"], 2)
+
+    def test_default_profile(self):
+        Helpers.bytes_to_encoding(jpeg_bytes())
+        self.assertEqual(self.fr.face_locations.call_args.args[0].shape[:2], (360, 640))
+
+
+class TestDecodeFrame(unittest.TestCase):
+    def test_jpeg_draft_decode(self):
+        im, arr, scale = Helpers.decode_frame(jpeg_bytes(), 4)
+        self.assertEqual(scale, 4)
+        self.assertEqual(arr.shape, (180, 320, 3))
+        self.assertEqual(arr.dtype, np.uint8)
+        self.assertTrue(arr.flags.c_contiguous)
+
+    def test_png_is_reduced(self):
+        buf = io.BytesIO()
+        Image.new("RGBA", (1280, 720), (120, 110, 100, 255)).save(buf, format="PNG")
+        im, arr, scale = Helpers.decode_frame(buf.getvalue(), 2)
+        self.assertEqual((arr.shape, scale), ((360, 640, 3), 2))
+
+    def test_undecodable(self):
+        self.assertIsNone(Helpers.decode_frame(b"not an image"))
+
+    def test_stage_timings(self):
+        with patch.object(Helpers, 'get_backend', return_value=FaceBackends.SyntheticBackend()):
+            result, timings = Helpers.analyse_frame(jpeg_bytes(), "fast")
+        self.assertEqual(list(timings), ["decode", "detect", "encode"])
+        self.assertTrue(all(ms >= 0 for ms in timings.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
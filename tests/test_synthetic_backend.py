@@ -0,0 +1,114 @@
+import os, sys
+import io
+import unittest
+import json
+import numpy as np
+from PIL import Image
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import TestConfig
+from app import app, SessionLocal, engine, present_set
+from Models import Teacher, Base, User, Student, Class, Attendance
+from Gallery import gallery_cache, MATCH_THRESHOLD
+from KioskState import frame_cache, face_tracker
+from FaceBackends import get_backend, use_backend
+from Helpers import bytes_to_encoding, image_to_encoding, face_distance
+
+
+class TestSyntheticBackend(unittest.TestCase):
+    def setUp(self):
+        self.previous = get_backend().name
+        use_backend("synthetic")
+
+    def tearDown(self):
+        use_backend(self.previous)
+
+    def test_same_image_same_embedding(self):
+        a = image_to_encoding('./images/cristiano.jpg')
+        with open('./images/cristiano.jpg', 'rb') as f:
+            b = bytes_to_encoding(f.read())
+        self.assertIsNotNone(a)
+        self.assertLess(face_distance(a, b), 1e-9)
+
+    def test_fast_profile_encodes_at_full_resolution(self):
+        for path in ('./images/cristiano.jpg', './images/lebron.jpg', './images/adam.jpg'):
+            a = image_to_encoding(path)
+            with open(path, 'rb') as f:
+                b = bytes_to_encoding(f.read(), profile="fast")    # detected at 1/4 scale
+            self.assertLess(face_distance(a, b), 1e-9)
+
+    def test_different_images_do_not_match(self):
+        a = image_to_encoding('./images/cristiano.jpg')
+        b = image_to_encoding('./images/lebron.jpg')
+        self.assertGreater(face_distance(a, b), MATCH_THRESHOLD)
+
+    def test_blank_frame_has_no_face(self):
+        buf = io.BytesIO()
+        Image.new("RGB", (640, 480), (0, 0, 0)).save(buf, format="JPEG")
+        self.assertIsNone(bytes_to_encoding(buf.getvalue()))
+
+    def test_missing_image(self):
+        self.assertIsNone(image_to_encoding('./images/does-not-exist.jpg'))
+
+
+class TestMarkAttendanceSynthetic(unittest.TestCase):
+    def setUp(self):
+        app.config.from_object(TestConfig)  # Use test configuration
+        self.previous = get_backend().name
+        use_backend("synthetic")
+        self.client = app.test_client()
+        Base.metadata.create_all(bind=engine)
+        self.session = SessionLocal()
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+
+        self.teacher = Teacher(name="Teacher", email="teacher@gmail.com", password="password")
+        # enrolled through the normal image_to_encoding path
+        self.cristiano = Student(name="Cristiano", email="cristiano@gmail.com", password="password", image='./images/cristiano.jpg')
+        self.lebron = Student(name="Lebron", email="lebron@gmail.com", password="password", image='./images/lebron.jpg')
+        self.session.add_all([self.teacher, self.cristiano, self.lebron])
+        self.session.commit()
+        self.class_ = Class(teacher_id=self.teacher.id, class_name="class")
+        self.class_.students.extend([self.cristiano, self.lebron])
+        self.session.add(self.class_)
+        self.session.commit()
+        self.client.post('/api/auth/login', json={"email": "teacher@gmail.com", "password": "password"})
+
+    def tearDown(self):
+        use_backend(self.previous)
+        gallery_cache.clear()
+        frame_cache.clear()
+        face_tracker.clear()
+        present_set.clear()
+        self.session.query(Attendance).delete()
+        self.session.query(Class).delete()
+        self.session.query(Teacher).delete()
+        self.session.query(Student).delete()
+        self.session.query(User).delete()
+        self.session.commit()
+        self.session.close()
+        Base.metadata.drop_all(bind=engine)
+
+    def test_enrolled_with_encoder_version(self):
+        self.assertIsNotNone(self.cristiano.face_vector)
+        self.assertEqual(self.cristiano.face_encoder_version, get_backend().encoder_version)
+
+    def test_mark_end_to_end(self):
+        with open('./images/lebron.jpg', 'rb') as img:
+            response = self.client.post(f'/api/classes/{self.class_.id}/attendance/mark',
+                                        data={"frame": img}, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data.decode())
+        self.assertEqual(data['matched_student']['id'], self.lebron.id)
+        self.assertFalse(data['already_marked'])
+
+    def test_unknown_face(self):
+        with open('./images/pinkman.png', 'rb') as img:
+            response = self.client.post(f'/api/classes/{self.class_.id}/attendance/mark',
+                                        data={"frame": img}, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()